@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Checks that importing mlgw stays cheap: it measures the time to import mlgw in a fresh interpreter and it checks which heavy packages are loaded along the inference path.
+The script fails (exit code 1) if:
+
+- `import mlgw` takes more than the given threshold (best of a number of fresh interpreters)
+- `import mlgw` loads tensorflow, keras, keras_tuner, matplotlib or joblib
+- generating a WF with the numpy backend loads tensorflow, keras, keras_tuner or matplotlib
+- generating a WF with the tensorflow backend loads keras_tuner or matplotlib
+
+It is a development check, to be run by hand (or in a CI job) after changing the imports of the package.
+
+Typical usage:
+
+	python dev/check_import_time.py --threshold 1.0 --n-runs 5
+
+"""
+import argparse
+import subprocess
+import sys
+import json
+import os
+
+parser = argparse.ArgumentParser(__doc__)
+
+parser.add_argument(
+	"--threshold", type = float, required = False, default = 1.,
+	help="Maximum time (in seconds) allowed for import mlgw")
+
+parser.add_argument(
+	"--n-runs", type = int, required = False, default = 5,
+	help="Number of fresh interpreters to measure the import time with: the best time is compared with the threshold")
+
+args = parser.parse_args()
+
+heavy_modules = ['tensorflow', 'keras', 'keras_tuner', 'matplotlib', 'joblib']
+
+	#Each snippet runs in a fresh interpreter and prints a json with the time and the heavy modules loaded
+import_snippet = """
+import sys, time, json
+start = time.perf_counter()
+import mlgw
+elapsed = time.perf_counter() - start
+{}
+print(json.dumps({{'time': elapsed, 'modules': [m for m in {} if m in sys.modules]}}))
+"""
+generate_snippet = """
+import numpy as np
+g = mlgw.GW_generator(0, backend = '{}')
+g.get_WF(np.array([[30., 20., 0.1, -0.2, 1., 0., 0.]]), np.linspace(-1., 0.01, 100))
+"""
+
+checks = [
+	('import mlgw', '', heavy_modules),
+	("GW_generator(backend = 'numpy')", generate_snippet.format('numpy'), ['tensorflow', 'keras', 'keras_tuner', 'matplotlib']),
+	("GW_generator(backend = 'tf')", generate_snippet.format('tf'), ['keras_tuner', 'matplotlib']),
+]
+
+env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL = '3')
+failed = False
+for name, snippet, forbidden in checks:
+	n_runs = args.n_runs if name == 'import mlgw' else 1
+	results = []
+	for _ in range(n_runs):
+		out = subprocess.run([sys.executable, '-c', import_snippet.format(snippet, heavy_modules)],
+			capture_output = True, text = True, env = env)
+		if out.returncode != 0:
+			print(out.stderr)
+			sys.exit("{}: the snippet failed".format(name))
+		results.append(json.loads(out.stdout.strip().split('\n')[-1]))
+
+	loaded = [m for m in results[0]['modules'] if m in forbidden]
+	print("{}: loaded {}".format(name, results[0]['modules'] if results[0]['modules'] else 'no heavy module'))
+	if loaded:
+		print("\tFAILED: {} should not be loaded".format(loaded))
+		failed = True
+	if name == 'import mlgw':
+		best = min(r['time'] for r in results)
+		print("{}: {:.3f} s (best of {}, threshold {} s)".format(name, best, n_runs, args.threshold))
+		if best > args.threshold:
+			print("\tFAILED: import is too slow")
+			failed = True
+
+sys.exit(1 if failed else 0)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Checks that a GW_generator is thread-safe: many threads call `get_WF` and `get_modes` on the same generator at the same time and the output of each call is compared with the output of the same call done serially.
+The calls share the caches of the generator: the time grids are repeated across the calls (so that the interpolation plans are shared), some calls cache the modes (``get_WF(..., cache_modes = True)``) and one time grid is compiled (see GW_generator.compile).
+Each generator is checked with `n_threads` = 1 and with `n_threads` > 1 (i.e. with and without the inner thread pool of the generator).
+
+The script fails (exit code 1) if the output of any concurrent call differs from the serial one by more than the given tolerance.
+The default tolerance allows for round-off only: numpy and BLAS may round differently (by ~1e-16) depending on the memory alignment of the arrays, even in a serial run. A race on the caches of the generator gives a wrong WF, i.e. a difference of order 1.
+It is a development check, to be run by hand (or in a CI job) after changing the generation code or the caches of the generator.
+
+Typical usage:
+
+	python dev/check_thread_safety.py --backends numpy tf --n-callers 8 --n-repeat 4
+
+"""
+import argparse
+import sys
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import mlgw
+
+parser = argparse.ArgumentParser(__doc__)
+
+parser.add_argument(
+	"--model", type = int, required = False, default = 0,
+	help="Index of the pre-fitted model to check")
+
+parser.add_argument(
+	"--backends", type = str, nargs = '+', required = False, default = ['numpy', 'tf'],
+	help="Backends of the generator to check")
+
+parser.add_argument(
+	"--n-callers", type = int, required = False, default = 8,
+	help="Number of threads calling the generator at the same time")
+
+parser.add_argument(
+	"--n-repeat", type = int, required = False, default = 4,
+	help="Number of times each call is repeated in the concurrent run")
+
+parser.add_argument(
+	"--rtol", type = float, required = False, default = 1e-12,
+	help="Maximum relative difference allowed between concurrent and serial output")
+
+args = parser.parse_args()
+
+rng = np.random.default_rng(0)
+t_grids = [np.linspace(-8., 0.02, 4000), np.linspace(-0.5, 0.02, 1000), np.linspace(-0.05, 0.01, 300)]
+compiled_grid, compiled_mass = t_grids[1], 50.
+
+def random_theta(N, m_tot = None):
+	theta = np.column_stack([rng.uniform(10., 60., N), rng.uniform(5., 30., N), rng.uniform(-0.8, 0.8, (N,2)),
+		rng.uniform(1., 10., N), rng.uniform(0., np.pi, N), rng.uniform(0., 2*np.pi, N)]) #(N,7)
+	if m_tot is not None:
+		q = theta[:,0]/theta[:,1]
+		theta[:,1] = m_tot/(1.+q)
+		theta[:,0] = m_tot - theta[:,1]
+	return theta
+
+	#each task is (method, theta, t_grid, keyword arguments): the thetas are repeated across the tasks, to share the mode cache
+thetas = [random_theta(20) for _ in range(3)] + [random_theta(20, compiled_mass)]
+tasks = []
+for i, t_grid in enumerate(t_grids):
+	for j, theta in enumerate(thetas):
+		tasks.append(('get_WF', theta, t_grid, {'modes': None, 'cache_modes': bool(j%2)}))
+		tasks.append(('get_WF', theta, t_grid, {'modes': (2,2)}))
+		tasks.append(('get_modes', theta[:,:4], t_grid, {'modes': None, 'out_type': 'realimag' if i%2 else 'ampph'}))
+
+def run_task(generator, task):
+	method, theta, t_grid, kwargs = task
+	return np.stack(getattr(generator, method)(theta, t_grid, **kwargs))
+
+def max_rel_diff(a, b):
+	return np.max(np.abs(a-b))/max(np.max(np.abs(b)), np.finfo(b.dtype).tiny)
+
+warnings.simplefilter('ignore') #the long time grid triggers warnings on the time grid
+failed = False
+for backend in args.backends:
+	for n_threads in [1, 4]:
+		generator = mlgw.GW_generator(args.model, backend = backend, n_threads = n_threads, preload_modes = 'all')
+		generator.compile(compiled_grid, compiled_mass)
+		serial = [run_task(generator, task) for task in tasks]
+		generator.clear_plan_cache()
+		generator.clear_mode_cache()
+
+		concurrent_tasks = [i for i in range(len(tasks))]*args.n_repeat
+		rng.shuffle(concurrent_tasks)
+		with ThreadPoolExecutor(args.n_callers) as executor:
+			outputs = list(executor.map(lambda i: run_task(generator, tasks[i]), concurrent_tasks))
+
+		diff = max(max_rel_diff(out, serial[i]) for i, out in zip(concurrent_tasks, outputs))
+		ok = diff <= args.rtol
+		print("backend = '{}', n_threads = {}: {} concurrent calls from {} threads, max relative difference with the serial output {:.2e}{}".format(
+			backend, n_threads, len(concurrent_tasks), args.n_callers, diff, '' if ok else '\tFAILED'))
+		failed = failed or not ok
+
+sys.exit(1 if failed else 0)
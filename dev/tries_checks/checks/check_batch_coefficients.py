@@ -0,0 +1,36 @@
+#Regression check for the PCA coefficients of a batch: each row of a batch must get its own coefficients.
+#The default (keras) backend used to take only the first row of each network output, so that all the WFs of a batch had the PCA coefficients of the first WF.
+#Here the coefficients and the WFs of a batch are compared with those computed one row at a time, for every backend available.
+
+import numpy as np
+import mlgw
+
+N_waves = 20
+rng = np.random.default_rng(0)
+q, m_tot = rng.uniform(1., 8., N_waves), rng.uniform(20., 100., N_waves)
+theta = np.column_stack([m_tot*q/(1+q), m_tot/(1+q), rng.uniform(-0.8, 0.8, (N_waves,2)),
+	np.ones((N_waves,)), rng.uniform(0., np.pi, N_waves), rng.uniform(0., 2*np.pi, N_waves)])
+times = np.linspace(-2., 0.01, 10000)
+
+for backend in mlgw.mode_generator_base.backends:
+	try:
+		gen = mlgw.GW_generator(0, backend = backend, fuse_networks = False)
+	except ImportError:
+		print("Backend {}: not available".format(backend))
+		continue
+
+	for mode in gen.list_modes():
+		g = gen.get_mode_obj(mode)
+		q_std = np.column_stack([q, theta[:,2], theta[:,3]])
+		red_amp, red_ph = g.get_red_coefficients(q_std)
+		for i in range(N_waves):
+			red_amp_i, red_ph_i = g.get_red_coefficients(q_std[[i]])
+			assert np.allclose(red_amp[i], red_amp_i[0], rtol = 1e-4, atol = 1e-6), "Backend {}, mode {}: wrong amplitude coefficients for row {}".format(backend, mode, i)
+			assert np.allclose(red_ph[i], red_ph_i[0], rtol = 1e-4, atol = 1e-6), "Backend {}, mode {}: wrong phase coefficients for row {}".format(backend, mode, i)
+
+	h_p, h_c = gen.get_WF(theta, times, modes = None)
+	for i in range(N_waves):
+		h_p_i, h_c_i = gen.get_WF(theta[i], times, modes = None)
+		scale = np.max(np.abs(h_p_i))
+		assert np.allclose(h_p[i], h_p_i, atol = 1e-4*scale) and np.allclose(h_c[i], h_c_i, atol = 1e-4*scale), "Backend {}: the WF of row {} of the batch is wrong".format(backend, i)
+	print("Backend {}: the batch agrees with the single rows".format(backend))
@@ -9,8 +9,6 @@ Module EM_MoE.py
 """
 #################
 
-import scipy.stats
-import scipy.optimize
 import numpy as np
 import sys
 import os
@@ -85,11 +83,11 @@ MoE_model
 	====
 		Load the model from file. It changes parameters D and K if required.
 		Input:
-			exp_file		file to load the expert model from
+			exp_file		file to load the expert model from (or array (D+2,K) with its content, as saved by save)
 			gat_file		file to load the model for gating function from (using function load_function)
 			gating_function	function for loading the gating function model from file
 		"""
-		weights = np.loadtxt(exp_file)
+		weights = exp_file if isinstance(exp_file, np.ndarray) else np.loadtxt(exp_file)
 		self.W = weights[:weights.shape[0]-2,:]
 		self.b = weights[weights.shape[0]-2,:]
 		self.sigma = weights[weights.shape[0]-1,:]
@@ -175,7 +173,8 @@ MoE_model
 		y = np.repeat( np.reshape(y, (len(y),1)), self.K, axis = 1) #(N,K)
 
 		#print('sigma: ', self.sigma)
-		res = scipy.stats.norm.pdf( np.divide((y - gaussians_mean), self.sigma) ) #(N,K)
+		from scipy.stats import norm #scipy.stats is slow to import: it is loaded only for fitting
+		res = norm.pdf( np.divide((y - gaussians_mean), self.sigma) ) #(N,K)
 		return np.divide(res, self.sigma) #normalizing result
 
 	def log_likelihood(self, X, y):
@@ -482,9 +481,9 @@ softmax_regression
 	====
 		Load the model from file.
 		Input:
-			filename	name of the file to load the model from
+			filename	name of the file to load the model from (or array (D+1,K) with its content, as saved by save)
 		"""
-		self.V = np.loadtxt(filename)
+		self.V = filename if isinstance(filename, np.ndarray) else np.loadtxt(filename)
 		self.D = self.V.shape[0]-1
 		self.K = self.V.shape[1]
 		return self
@@ -713,7 +712,8 @@ softmax_regression
 		loss = lambda V, a,b,c: self.loss(V,(a,b,c))
 		grad = lambda V, a,b,c: self.grad(V,(a,b,c))
 
-		res = scipy.optimize.fmin_bfgs(loss, self.V.reshape(((self.D+1)*self.K,)), grad, args , disp = verbose)
+		from scipy.optimize import fmin_bfgs
+		res = fmin_bfgs(loss, self.V.reshape(((self.D+1)*self.K,)), grad, args , disp = verbose)
 		self.V = res.reshape((self.D+1,self.K))
 
 		if isinstance(val_set,tuple):
@@ -26,14 +26,11 @@ import sys
 import warnings
 import numpy as np
 import ast
-import tensorflow as tf
-from tensorflow.keras import models as keras_models
-from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
 import inspect
 sys.path.insert(1, os.path.dirname(__file__)) 	#adding to path folder where mlgw package is installed (ugly?)
 from .EM_MoE import MoE_model #WARNING commented out 
-from .ML_routines import PCA_model, add_extra_features, jac_extra_features, augment_features
-from .NN_model import mlgw_NN
+from .ML_routines import PCA_model, dense_NN, add_extra_features, jac_extra_features, augment_features
+from . import thread_policy
 #from .precession_helper import angle_manager, get_alpha0_beta0_gamma0, angle_params_keeper, CosinesLayer, augment_for_angles, to_polar, get_beta_trend_fast, get_fref_at_time_IMR
 from scipy.special import factorial as fact
 from pathlib import Path
@@ -41,11 +38,39 @@ import scipy
 #import precession
 
 
-import matplotlib.pyplot as plt #DEBUG
 import re
-import joblib
+import time
+import copy
+import json
+import hashlib
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+
+thread_state = threading.local() #flags of the current thread: 'quiet' silences the warnings on the time grid, 'worker' is True within a thread pool of a GW_generator, 'timings' holds the timings of the last batch of the thread
+
+def array_key(array):
+	"""
+	Returns a key that identifies the content of an array, to be used in a cache: it holds the shape, the dtype and a 128 bit digest of the content of the array. Unlike the python hash of the bytes, two different arrays have the same key only with a negligible probability.
+
+	Input:
+		array: :class:`~numpy:numpy.ndarray`
+			array to build the key for
 
-warnings.simplefilter("always", UserWarning) #always print a UserWarning message ??
+	Output:
+		key: tuple
+			(shape, dtype, digest) of the array
+	"""
+	array = np.ascontiguousarray(array)
+	return (array.shape, array.dtype.str, hashlib.blake2b(array, digest_size = 16).digest())
+
+def warn_outside_grid():
+	"""
+	Warns that the time grid is too long for the model, unless the warning is silenced for the current thread (with the flag `thread_state.quiet`). Unlike the global filters of the warnings module, this is safe when many threads generate WFs at once.
+	"""
+	if not getattr(thread_state, 'quiet', False):
+		warnings.warn("Warning: time grid given is too long for the fitted model. Set 0 amplitude outside the fitting domain.")
 
 #############DEBUG PROFILING
 try:
@@ -68,7 +93,590 @@ try:
 except:
 	pass
 
+
+################# Interpolation helpers
+class interp_plan:
+	"""
+	Holds the indices and weights to perform a batched linear interpolation of many functions, all defined on the same (increasing) grid `xp`, on a set of points `x`, which can be different for each function.
+	Building the plan amounts to a single call to ``np.searchsorted`` for the whole batch; applying it is a gather and a weighted sum. The result is the same as calling ``np.interp`` row by row, without the python loop.
+	The points can also be given in a ragged layout, as a flat array together with the index of the function each point refers to: in this case, the interpolated values are returned in the same flat layout.
+	"""
+	def __init__(self, x, xp, rows = None):
+		"""
+		Builds the interpolation plan.
+
+		Input:
+			x: :class:`~numpy:numpy.ndarray`
+				shape (N,D')/(M,) - points to evaluate each of the N functions at (or flat array of points if `rows` is given)
+			xp: :class:`~numpy:numpy.ndarray`
+				shape (D,) - increasing grid at which the functions are defined
+			rows: :class:`~numpy:numpy.ndarray`
+				shape (M,) - for each point of a flat `x`, the index of the function to interpolate (if None, `x` must be a 2D array)
+		"""
+		x, xp = np.asarray(x), np.asarray(xp)
+		if rows is None and x.ndim != 2:
+			raise ValueError("The points to interpolate at must have shape (N,D'): given shape {}".format(x.shape))
+		if rows is not None and (x.ndim != 1 or np.shape(rows) != x.shape):
+			raise ValueError("In the ragged layout, points and rows must be 1D arrays with the same shape: given shapes {} and {}".format(x.shape, np.shape(rows)))
+
+		ids = np.searchsorted(xp, x, side = 'right') - 1 #(N,D')
+		np.clip(ids, 0, len(xp)-2, out = ids)
+		xp_low = xp[ids]
+		weights = (x - xp_low)/(xp[ids+1] - xp_low) #(N,D')
+
+		self.left_mask = x < xp[0] #(N,D')
+		self.right_mask = x > xp[-1] #(N,D')
+		self.weights = np.clip(weights, 0., 1., out = weights) #outside the domain, the edge value is taken (as in np.interp)
+		self.weights_cast = {} #weights cast to a different precision
+		self.restricted = None #(max_points, restricted plan): plan restricted to the grid points it uses (see restrict)
+		self.grid_size = len(xp)
+		self.ids = ids
+		self.rows = np.arange(x.shape[0])[:,None] if rows is None else np.asarray(rows) #(N,1)/(M,)
+		return
+
+	def is_outside(self):
+		"""
+		Returns whether any of the points of the plan lies before the beginning of the grid.
+
+		Output:
+			outside: bool
+				True if some points are before the start of the grid
+		"""
+		return bool(np.any(self.left_mask))
+
+	def interpolate(self, fp, left = None, right = None):
+		"""
+		Interpolates the functions `fp` with the plan. It has the same behaviour as ``np.interp``.
+
+		Input:
+			fp: :class:`~numpy:numpy.ndarray`
+				shape (N,D)/(N,D,...) - values of the functions on the grid (extra trailing dimensions are interpolated independently)
+			left: float
+				Value to return for the points before the grid (if None, the value of the first grid point is returned)
+			right: float
+				Value to return for the points after the grid (if None, the value of the last grid point is returned)
+
+		Output:
+			f: :class:`~numpy:numpy.ndarray`
+				shape (N,D')/(N,D',...) - interpolated functions (with the same precision of `fp`). In the ragged layout, shape is (M,)/(M,...)
+		"""
+		fp_low = fp[self.rows, self.ids] #(N,D',...)
+		fp_high = fp[self.rows, self.ids+1] #(N,D',...)
+		weights = self.get_weights(fp.dtype)
+		weights = weights.reshape(weights.shape + (1,)*(fp.ndim-2))
+
+		f = fp_low + weights*(fp_high - fp_low)
+		if left is not None: f[self.left_mask] = left
+		if right is not None: f[self.right_mask] = right
+		return f
+
+	def restrict(self, max_points = None):
+		"""
+		Returns the indices of the points of the grid `xp` which are used by the plan and a plan which acts on functions evaluated only at those points.
+		If the plan uses more than `max_points` points of the grid, the restriction is not worth it and None is returned: the check is cheap and the restricted plan is built only if it is required.
+		The points used are first bounded by the span of the indices of the plan: if it is short enough, the restricted plan is a shift of the indices. Otherwise, the points used are marked on a mask of the grid and the indices are remapped with a cumulative sum of the mask. The restricted plan is computed only once.
+
+		Input:
+			max_points: int
+				maximum number of grid points for the restriction (if None, the plan is always restricted)
+
+		Output:
+			indices: :class:`~numpy:numpy.ndarray`
+				shape (D_r,) - sorted indices of the grid points needed by the plan
+			plan: :class:`interp_plan`
+				plan for functions of shape (N,D_r), evaluated only at xp[indices]
+		"""
+		if max_points is None: max_points = self.grid_size
+		if self.restricted is not None and self.restricted[0] == max_points:
+			return self.restricted[1]
+
+		restricted = None
+		start, stop = int(self.ids.min()), int(self.ids.max())+2 #as for each index i used, also i+1 is used
+		if stop - start <= max_points:
+			indices, ids = np.arange(start, stop), self.ids - start
+		else:
+			used = np.zeros((self.grid_size+1,), dtype = bool)
+			used[self.ids] = True
+			used[self.ids+1] = True
+			indices = np.flatnonzero(used) #(D_r,)
+			ids = None if len(indices) > max_points else (np.cumsum(used)-1)[self.ids]
+		if ids is not None:
+			plan = copy.copy(self)
+			plan.ids = ids
+			plan.restricted = None
+			restricted = (indices, plan)
+		self.restricted = (max_points, restricted)
+		return restricted
+
+	def take_rows(self, rows):
+		"""
+		Returns the plan for a contiguous subset of the functions, i.e. for the points ``x[rows]``. The arrays of the new plan are views of those of the plan, which are not copied. It is available only if the points are given as a 2D array.
+
+		Input:
+			rows: slice
+				rows of `x` to keep
+
+		Output:
+			plan: :class:`interp_plan`
+				plan for the functions of the given rows
+		"""
+		if self.rows.ndim != 2:
+			raise ValueError("The rows of a plan can be taken only if the points are given as a 2D array")
+		plan = copy.copy(self)
+		plan.ids, plan.weights = self.ids[rows], self.weights[rows]
+		plan.left_mask, plan.right_mask = self.left_mask[rows], self.right_mask[rows]
+		plan.weights_cast = {dtype: w[rows] for dtype, w in self.weights_cast.items()}
+		plan.restricted = None
+		plan.rows = np.arange(plan.ids.shape[0])[:,None]
+		return plan
+
+	def nbytes(self):
+		"""
+		Returns the memory (in bytes) taken by the plan, including its cast weights and its restricted plan.
+		"""
+		nbytes = sum(a.nbytes for a in [self.ids, self.weights, self.left_mask, self.right_mask, self.rows])
+		nbytes += sum(w.nbytes for w in self.weights_cast.values())
+		if self.restricted is not None and self.restricted[1] is not None:
+			indices, plan = self.restricted[1]
+			nbytes += indices.nbytes + plan.ids.nbytes
+		return nbytes
+
+	def get_weights(self, dtype = np.float64):
+		"""
+		Returns the interpolation weights with the given floating point precision. The cast weights are computed only once.
+
+		Input:
+			dtype: type
+				precision of the data to interpolate (single precision data are interpolated with single precision weights)
+		Output:
+			weights: :class:`~numpy:numpy.ndarray`
+				shape (N,D') - interpolation weights
+		"""
+		dtype = np.dtype(dtype)
+		if dtype != np.float32:
+			return self.weights
+		if dtype not in self.weights_cast:
+			self.weights_cast[dtype] = self.weights.astype(dtype)
+		return self.weights_cast[dtype]
+
+class intrinsic_batch:
+	"""
+	Holds the preprocessing of the intrinsic parameters of a batch of WFs, which is shared by all the modes: the parameters [q,s1,s2] in the format of the ML model (with q>1), the total mass, the symmetric mass ratio scaling the amplitude and the interpolation plans to the user grid.
+	:class:`GW_generator` builds a batch once per call and every :class:`mode_generator_base` consumes it, so that the bookkeeping is not repeated for each mode. The batch also collects the time (in seconds) spent on each stage of the generation in the dictionary `timings`.
+	As the raw modes depend only on [q,s1,s2], the batch also holds the unique rows of theta_std: the ML model is evaluated only once for each of them and the result is then fanned out to all the WFs (e.g. to all the total masses of a mass sweep).
+	Each WF can also be evaluated on its own time grid: in this ragged layout, the grids are concatenated in a flat array `t_grid` and the points of the i-th WF are ``t_grid[offsets[i]:offsets[i+1]]``. The modes are then returned in the same flat layout.
+	"""
+	def __init__(self, theta, t_grid = None, plan_builder = None, dtype = np.float64, offsets = None, grid_key = None):
+		"""
+		Performs the preprocessing of the intrinsic parameters.
+
+		Input:
+			theta: :class:`~numpy:numpy.ndarray`
+				shape (N,3)/(N,4) - source parameters [q, spin1_z, spin2_z] or [m1, m2, spin1_z, spin2_z]. If D = 3, the total mass is set to 20 M_sun
+			t_grid: :class:`~numpy:numpy.ndarray`
+				shape (D',) - a grid in (physical) time to evaluate the modes at (if None, the modes can only be generated on the model grid)
+			plan_builder: function
+				Function with signature ``plan_builder(t_grid, m_tot, times, t_key)`` returning the :class:`interp_plan` for the grid `t_grid/m_tot`, such as :func:`GW_generator.get_interp_plan`. If None, the plans are computed directly.
+			dtype: type
+				floating point precision of the modes generated for the batch (np.float32 or np.float64)
+			offsets: :class:`~numpy:numpy.ndarray`
+				shape (N+1,) - if given, `t_grid` holds the concatenation of a different grid for each WF (ragged layout) and the points of the i-th WF are ``t_grid[offsets[i]:offsets[i+1]]``. Each grid must have at least one point.
+			grid_key: tuple
+				key of `t_grid` (see :func:`array_key`), if already computed by the caller
+		"""
+		start = time.perf_counter()
+		theta = np.atleast_2d(np.asarray(theta))
+
+		D= theta.shape[1] #number of features given
+		if D not in [3,4]:
+			raise RuntimeError("Unable to generata mode. Wrong number of BBH parameters!!")
+
+			#setting theta_std & m_tot_us
+		if D == 3:
+			theta_std = theta
+			m_tot_us = 20. * np.ones((theta.shape[0],)) 
+			to_switch = (np.array([], dtype = int),)
+		else:
+			q = np.divide(theta[:,0],theta[:,1]) #theta[:,0]/theta[:,1] #mass ratio (general) (N,)
+			m_tot_us = theta[:,0] + theta[:,1]	#total mass in solar masses for the user
+			theta_std = np.column_stack((q,theta[:,2],theta[:,3])) #(N,3)
+
+			to_switch = np.where(theta_std[:,0] < 1.) #holds the indices of the events to swap
+
+				#switching masses (where relevant)
+			theta_std[to_switch,0] = np.power(theta_std[to_switch,0], -1)
+			theta_std[to_switch,1], theta_std[to_switch,2] = theta_std[to_switch,2], theta_std[to_switch,1]
+
+		self.theta_std = theta_std #(N,3)
+		self.m_tot_us = m_tot_us #(N,)
+		self.to_switch = to_switch
+		self.dtype = np.dtype(dtype)
+		self.nu = (theta_std[:,0]/(1 + theta_std[:,0])**2).astype(self.dtype) #(N,)
+
+			#unique rows of theta_std: inverse is None if all the rows are different
+		self.theta_unique, self.inverse = np.unique(theta_std, axis = 0, return_inverse = True) #(N',3), (N,)
+		if self.theta_unique.shape[0] == theta_std.shape[0]:
+			self.theta_unique, self.inverse = theta_std, None
+		else:
+			self.inverse = np.reshape(self.inverse, (-1,))
+		self.t_grid = None if t_grid is None else np.asarray(t_grid)
+		self.offsets, self.row_ids = None, None
+		if offsets is not None:
+			offsets = np.asarray(offsets, dtype = int)
+			lengths = np.diff(offsets)
+			if self.t_grid is None or self.t_grid.ndim != 1 or offsets.shape != (theta.shape[0]+1,) or offsets[0] != 0 or offsets[-1] != len(self.t_grid) or np.any(lengths < 1):
+				raise ValueError("Wrong offsets for the ragged time grid: they must be N+1 = {} increasing indices of the flat grid, starting from 0 and ending at its length".format(theta.shape[0]+1))
+			self.offsets = offsets
+			self.row_ids = np.repeat(np.arange(theta.shape[0]), lengths) #index of the WF for each point of the grid
+		self.plan_builder = plan_builder
+		self.t_key = grid_key #computed only once, when first required (see grid_key)
+		self.plans = {}
+		self.bases = {} #PCA bases interpolated on the user grid, for each mode (see mode_generator_base.compile_basis)
+		self.coefficients = {} #PCA coefficients for the rows of theta_unique, for each mode (see fused_networks)
+		self.timings = {'preprocessing': time.perf_counter()-start}
+		return
+
+	def __len__(self):
+		return self.theta_std.shape[0]
+
+	def expand(self, *arrays):
+		"""
+		Fans out some arrays computed on the unique rows `theta_unique` to all the rows of the batch.
+
+		Input:
+			arrays: :class:`~numpy:numpy.ndarray`
+				shape (N',...) - quantities evaluated on `theta_unique`
+		Output:
+			arrays: :class:`~numpy:numpy.ndarray`
+				shape (N,...) - quantities evaluated on `theta_std`
+		"""
+		if self.inverse is None:
+			return arrays
+		return tuple(array[self.inverse] for array in arrays)
+
+	def grid_key(self):
+		"""
+		Returns the key of the user grid (see :func:`array_key`), which identifies the grid in the caches of the generator. The key is computed only once for each batch, as hashing a long grid is not cheap.
+		"""
+		if self.t_key is None and self.t_grid is not None:
+			self.t_key = array_key(self.t_grid)
+		return self.t_key
+
+	def is_ragged(self):
+		"""
+		Returns whether each WF of the batch has its own time grid.
+		"""
+		return self.offsets is not None
+
+	def grid_shape(self):
+		"""
+		Returns the shape of a quantity evaluated on the user grid: (N,D') or (M,) in the ragged layout.
+		"""
+		if self.is_ragged():
+			return self.t_grid.shape
+		return (len(self), self.t_grid.shape[0])
+
+	def to_grid(self, values):
+		"""
+		Broadcasts a quantity defined for each WF to the layout of the user grid, to be combined with quantities of shape :func:`grid_shape`.
+
+		Input:
+			values: :class:`~numpy:numpy.ndarray`
+				shape (N,) - a quantity for each WF
+		Output:
+			values: :class:`~numpy:numpy.ndarray`
+				shape (N,1)/(M,) - quantity ready for broadcasting
+		"""
+		if np.ndim(values) == 0:
+			return values
+		if self.is_ragged():
+			return np.asarray(values)[self.row_ids]
+		return np.reshape(values, (-1,1))
+
+	def first(self, values):
+		"""
+		Returns the value at the first point of the grid of each WF of a quantity evaluated on the user grid.
+
+		Input:
+			values: :class:`~numpy:numpy.ndarray`
+				shape (N,D')/(M,) - a quantity evaluated on the user grid
+		Output:
+			values: :class:`~numpy:numpy.ndarray`
+				shape (N,) - values at the beginning of each grid
+		"""
+		if self.is_ragged():
+			return values[self.offsets[:-1]]
+		return values[:,0]
+
+	def get_plan(self, times):
+		"""
+		Returns the interpolation plan from the model grid `times` to the user grid of the batch. The plan is computed only once for each model grid.
+
+		Input:
+			times: :class:`~numpy:numpy.ndarray`
+				shape (D,) - reduced time grid of the model
+		Output:
+			plan: :class:`interp_plan`
+				interpolation plan for the grids t_grid/m_tot_us
+		"""
+		if self.t_grid is None:
+			raise ValueError("No user time grid was given to the batch: unable to compute an interpolation plan")
+		key = array_key(times)
+		if key not in self.plans:
+			if self.is_ragged():
+				self.plans[key] = interp_plan(np.divide(self.t_grid, self.m_tot_us[self.row_ids]), times, rows = self.row_ids)
+			elif self.plan_builder is not None:
+				self.plans[key] = self.plan_builder(self.t_grid, self.m_tot_us, times, self.grid_key())
+			else:
+				self.plans[key] = interp_plan(np.divide(self.t_grid[None,:], self.m_tot_us[:,None]), times)
+		return self.plans[key]
+
+	def set_plan(self, times, plan):
+		"""
+		Sets the interpolation plan to be used for the model grid `times`.
+
+		Input:
+			times: :class:`~numpy:numpy.ndarray`
+				shape (D,) - reduced time grid of the model
+			plan: :class:`interp_plan`
+				interpolation plan for the grids t_grid/m_tot_us
+		"""
+		self.plans[array_key(times)] = plan
+		return
+
+class fused_networks:
+	"""
+	Evaluates in a single call all the neural networks (amplitude, phase and phase residuals) of a set of modes generated by :class:`mode_generator_NN`.
+	The input features are computed only once for each distinct set of features and, with a tensorflow backend, all the networks are traced into a single graph with an input signature of shape (None, D_in) for each set of features: a batch of WFs requires a single dispatch to tensorflow, rather than one for each network.
+	"""
+	def __init__(self, mode_generators, backend = 'tf'):
+		"""
+		Builds the fused evaluation of the networks of the given modes.
+
+		Input:
+			mode_generators: list
+				list of :class:`mode_generator_NN` to evaluate
+			backend: str
+				backend for the inference (see :func:`GW_generator.set_backend`). With 'tf', the graph is traced but its variables are not frozen.
+		"""
+		if backend not in mode_generator_base.backends:
+			raise ValueError("Wrong backend given: expected one of {} but '{}' given".format(mode_generator_base.backends, backend))
+		self.backend = backend
+		self.mode_generators = list(mode_generators)
+		self.features = [] #distinct sets of input features
+		self.entries = [] #(index of the mode generator, kind, components, residual coefficient, index of the features) for each network
+		networks = []
+		for i, generator in enumerate(self.mode_generators):
+			for kind, models in [('amp', generator.amp_models), ('ph', generator.ph_models), ('ph_residual', generator.ph_residual_models)]:
+				for comps, model in models.items():
+					features = list(model.features)
+					if features not in self.features: self.features.append(features)
+					coefficient = generator.ph_res_coefficients[comps] if kind == 'ph_residual' else None
+					self.entries.append((i, kind, [int(c) for c in comps], coefficient, self.features.index(features)))
+					networks.append(model)
+
+		if backend == 'numpy':
+			self.networks = [generator.numpy_models[id(model)] if id(model) in generator.numpy_models else dense_NN.from_keras(model)
+				for generator, model in zip([self.mode_generators[entry[0]] for entry in self.entries], networks)] #possibly in reduced precision
+			self.function = None
+		else:
+			import tensorflow as tf
+			from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+			feature_ids = [entry[-1] for entry in self.entries]
+			def fused_call(*inputs):
+				return [model(inputs[j]) for model, j in zip(networks, feature_ids)]
+			input_signature = [tf.TensorSpec(shape=(None, augment_features(np.ones((1,3)), features).shape[1]), dtype=tf.float32) for features in self.features]
+			self.function = tf.function(fused_call, input_signature = input_signature).get_concrete_function()
+			if backend == 'tf_frozen':
+				self.function = convert_variables_to_constants_v2(self.function)
+		return
+
+	def __call__(self, theta):
+		"""
+		Evaluates the networks of all the modes.
+
+		Input:
+			theta: :class:`~numpy:numpy.ndarray`
+				shape (N,3) - source parameters to make prediction at
+
+		Output:
+			coefficients: list
+				list of tuples (red_amp, red_ph), one for each mode generator, with the PCA reduced amplitude (N,K_amp) and phase (N,K_ph) of the mode
+		"""
+		theta = np.atleast_2d(theta)
+		inputs = [augment_features(theta, features).astype(np.float32) for features in self.features]
+		if self.function is None:
+			outputs = [network(inputs[entry[-1]]) for network, entry in zip(self.networks, self.entries)]
+		else:
+			import tensorflow as tf
+			outputs = [output.numpy() for output in self.function(*[tf.constant(input_) for input_ in inputs])]
+
+		coefficients = [(np.zeros((theta.shape[0], generator.amp_PCA.get_dimensions()[1])), np.zeros((theta.shape[0], generator.ph_PCA.get_dimensions()[1])))
+			for generator in self.mode_generators]
+		for (i, kind, comps, coefficient, _), output in zip(self.entries, outputs):
+			if kind == 'amp':
+				coefficients[i][0][:,comps] = output
+			elif kind == 'ph':
+				coefficients[i][1][:,comps] = output
+			else:
+				coefficients[i][1][:,comps] += output*coefficient
+		return coefficients
+
 ################# GW_generator class
+class lazy_mode_list:
+	"""
+	List of the mode generators of a :class:`GW_generator`, in the order of the manifest of the model. Each mode generator is built by the function `build` the first time it is accessed (by index or by iteration): the modes that are never used are never loaded.
+	"""
+	def __init__(self, build, n_modes = 0):
+		"""
+		Input:
+			build: function
+				function that builds the mode generator with a given index: it must store it in the list (in `generators`) and return it
+			n_modes: int
+				number of modes of the model
+		"""
+		self.build = build
+		self.generators = [None]*n_modes #None for the modes not loaded yet
+		return
+
+	def __len__(self):
+		return len(self.generators)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [self[i] for i in range(*index.indices(len(self)))]
+		index = range(len(self))[index] #raises an IndexError, as a list
+		generator = self.generators[index]
+		return self.build(index) if generator is None else generator
+
+	def __setitem__(self, index, generator):
+		self.generators[index] = generator
+
+	def __iter__(self):
+		return (self[i] for i in range(len(self)))
+
+	def append(self, generator):
+		self.generators.append(generator)
+
+	def __getstate__(self):
+		return {'build': None, 'generators': self.generators} #the build function is set again by the owner (see GW_generator.__setstate__)
+
+	def loaded(self):
+		"""
+		Returns the list of the mode generators loaded so far.
+		"""
+		return [g for g in self.generators if g is not None]
+
+class model_bundle:
+	"""
+	Single binary file holding a whole model (see :func:`GW_generator.export_bundle`): the arrays of all the modes (PCA bases, weights of the networks, time grids...) together with a json header holding the metadata (features, activations, README...).
+	The file is memory mapped: loading a model from a bundle only parses the header, while the arrays are read from disk by the OS when first used. The arrays of a bundle are read-only and, as they live in the page cache, they are shared by all the processes that load the same bundle (e.g. the workers of a :class:`~mlgw.pool.generator_pool`).
+
+	The layout of the file is:
+
+	- 8 bytes with the magic string `MLGWBNDL`
+	- 8 bytes with the length of the header (little endian unsigned integer)
+	- the header: a utf-8 json dictionary with keys 'version', 'metadata' and 'arrays'. For each array, 'arrays' stores the offset (from the beginning of the data section), the dtype and the shape
+	- the data section, with the raw bytes of each array in C order. The data section and each array are aligned to 64 bytes.
+	"""
+	magic = b'MLGWBNDL'
+	version = 1
+	alignment = 64
+
+	def __init__(self, filename):
+		"""
+		Opens a bundle and maps its content in memory.
+
+		Input:
+			filename: str
+				path to the bundle
+		"""
+		self.filename = str(filename)
+		with open(self.filename, 'rb') as f:
+			if f.read(len(self.magic)) != self.magic:
+				raise ValueError("File {} is not a valid model bundle".format(self.filename))
+			header_size = int(np.frombuffer(f.read(8), dtype = '<u8')[0])
+			header = json.loads(f.read(header_size).decode('utf-8'))
+		if header['version'] > self.version:
+			raise ValueError("Model bundle {} has version {}, while the highest version supported is {}: please update mlgw".format(self.filename, header['version'], self.version))
+		self.metadata = header['metadata']
+		self.arrays = header['arrays']
+		self.data_start = self.__align(len(self.magic)+8+header_size)
+		self.buffer = np.memmap(self.filename, dtype = np.uint8, mode = 'r')
+		return
+
+	@classmethod
+	def __align(cls, offset):
+		return -(-offset//cls.alignment)*cls.alignment
+
+	def __getstate__(self):
+		return {'filename': self.filename} #the file is mapped again when unpickled: the arrays are never copied
+
+	def __setstate__(self, state):
+		self.__init__(state['filename'])
+		return
+
+	def __contains__(self, name):
+		return name in self.arrays
+
+	def __getitem__(self, name):
+		"""
+		Returns the array with the given name: it is a read-only view on the memory mapped file.
+		"""
+		if name not in self.arrays:
+			raise KeyError("Array '{}' not found in model bundle {}".format(name, self.filename))
+		offset, dtype, shape = self.arrays[name]
+		dtype = np.dtype(dtype)
+		start = self.data_start + offset
+		size = int(np.prod(shape, dtype = np.int64))*dtype.itemsize
+		return np.asarray(self.buffer[start:start+size]).view(dtype).reshape(shape)
+
+	@classmethod
+	def write(cls, filename, arrays, metadata):
+		"""
+		Writes a bundle to file. The file is first written to a temporary file, which then replaces the given file: a bundle being read by other processes is never overwritten in place.
+
+		Input:
+			filename: str
+				path to the bundle
+			arrays: dict
+				arrays to save, indexed by their name
+			metadata: dict
+				metadata to save: it must be serializable to json
+		"""
+		arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+		offsets, offset = {}, 0
+		for name, array in arrays.items():
+			offsets[name] = [offset, array.dtype.str, list(array.shape)]
+			offset = cls.__align(offset+array.nbytes)
+		header = json.dumps({'version': cls.version, 'metadata': metadata, 'arrays': offsets}).encode('utf-8')
+		data_start = cls.__align(len(cls.magic)+8+len(header))
+
+		tmp_filename = '{}.tmp{}'.format(filename, os.getpid())
+		try:
+			with open(tmp_filename, 'wb') as f:
+				f.write(cls.magic)
+				f.write(np.array(len(header), dtype = '<u8').tobytes())
+				f.write(header)
+				for name, array in arrays.items():
+					f.write(b'\0'*(data_start + offsets[name][0] - f.tell()))
+					f.write(array.tobytes())
+			os.replace(tmp_filename, filename)
+		finally:
+			if os.path.exists(tmp_filename): os.remove(tmp_filename) #the write failed
+		return
+
+def autotune_cache_file():
+	"""
+	Returns the default path of the file where the configurations chosen by :func:`GW_generator.autotune` are stored. There is a different file for each host, in the folder $XDG_CACHE_HOME/mlgw (default ~/.cache/mlgw).
+
+	Output:
+		cache_file: str
+			path to the cache file
+	"""
+	cache_dir = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+	return os.path.join(cache_dir, 'mlgw', 'autotune_{}.json'.format(socket.gethostname()))
+
 def list_models(print_out = True):
 	"""
 	Print to screen the models available by default in the relevant folder.
@@ -118,9 +726,12 @@ class GW_generator:
 
 	The model shall be saved in a single folder, which collects a different subfolder "lm" for each mode to generate. Each mode is independent from the others and modes can be added at will.
 	Some default models are already included in the package.
+
+	A generator is thread-safe: many threads can generate WFs with the same generator at the same time. The caches of the generator (interpolation plans, modes, fused networks) are protected by a lock and no global state is modified during the generation. The methods that change the model (such as :func:`load`, :func:`set_backend` or :func:`compile`) should not be called while other threads are generating WFs.
+	With `n_threads` > 1, the generator itself evaluates the independent modes of a WF (or, if only one mode is required, chunks of the batch of WFs) concurrently on a pool of threads. As numpy and tensorflow release the GIL in the expensive operations, this gives a speed up on a multi-core machine. The modes are always summed in the same order: the output does not depend on the number of threads, up to the float32 round-off of the networks when the batch is split in chunks.
 	"""
 
-	def __init__(self, folder = 0, verbose = False):
+	def __init__(self, folder = 0, verbose = False, plan_cache_size = 8, mode_cache_bytes = 2**27, dtype = np.float64, backend = None, fuse_networks = True, autotune = False, precision = 'full', n_threads = 1, preload_modes = None, plan_cache_bytes = 2**27):
 		"""
 		Initialise class by loading the modes from file.
 		A number of pre-fitted models for the modes are released: they can be loaded with folder argument by specifying an integer index (default 0. They are all saved in "__dir__/TD_models/model_(index_given)". A list of the available models can be listed with list models().
@@ -128,12 +739,60 @@ class GW_generator:
 		
 		Inputs:
 			folder: str
-				Folder in which everything is kept (if None, models must be loaded manually with load())
+				Folder in which everything is kept, or path to a model bundle (see :func:`export_bundle`). If None, models must be loaded manually with load()
 			verbose: str
 				Whether to be verbose when loading the model
+			plan_cache_size: int
+				Maximum number of interpolation plans to keep in memory (see :func:`get_interp_plan`). If 0, no plan is cached.
+			plan_cache_bytes: int
+				Maximum memory (in bytes) used by the interpolation plans kept in memory. If 0, no plan is cached.
+			mode_cache_bytes: int
+				Maximum memory (in bytes) used to cache the modes generated with ``get_WF(..., cache_modes = True)``. If 0, no mode is cached.
+			dtype: type
+				Floating point precision of the generated WFs and modes: np.float64 (default) or np.float32. In single precision the whole pipeline (PCA reconstruction, interpolation, spherical harmonics and output arrays) runs in float32, halving the memory traffic for large batches. For the default model_0 (with all the modes and 2^15 points), the mismatch with the double precision WFs is below ~1e-7 (~2e-8 on average). Beware that the square of a strain (~1e-42) underflows in single precision: scalar products between WFs should be computed in double precision.
+			backend: str
+				Backend for the inference of the neural networks of the modes (see :func:`set_backend`): 'tf', 'tf_frozen' or 'numpy'. If None, 'tf' is used in full precision and 'numpy' otherwise. With 'numpy', tensorflow is never imported (unless the gradients are required).
+			fuse_networks: bool
+				Whether to evaluate the networks of all the modes of a WF in a single call (see :class:`fused_networks`). With a tensorflow backend, it requires a single dispatch for all the modes, rather than one for each network.
+			autotune: bool
+				Whether to choose the backend and the batch size for the inference of the networks with :func:`autotune`, after loading the model. The configuration is read from the per-host cache file, if already tuned for the model, and it overrides `backend`. The number of BLAS threads of the process is not changed.
+			precision: str
+				Precision of the weights of the amplitude networks and PCA bases (see :func:`mode_generator_NN.set_precision`): 'full' (default), 'float16' (float16 storage, float32 compute) or 'int8' (int8 quantized dense layers). Reduced precision requires the numpy backend. The accuracy of the reduced precision model can be checked with :func:`get_precision_report`: if `verbose`, the report is printed after loading.
+			n_threads: int
+				Number of threads used to evaluate the modes (or chunks of the batch) concurrently. The attribute `n_threads` can be changed at any time.
+			preload_modes: list/str
+				Modes to load together with the model (see :func:`load`): a list of (l,m) modes or 'all'. If None, each mode is loaded the first time it is used.
 		"""
-		self.modes = [] #list of modes (classes mode_generator)
+		if np.dtype(dtype) not in [np.float32, np.float64]:
+			raise ValueError("Wrong dtype given: expected np.float32 or np.float64 but {} given".format(dtype))
+		self.dtype = np.dtype(dtype)
+		if precision not in mode_generator_base.precisions:
+			raise ValueError("Wrong precision given: expected one of {} but '{}' given".format(mode_generator_base.precisions, precision))
+		self.precision = precision
+		if backend is None: backend = 'tf' if precision == 'full' else 'numpy'
+		if backend not in mode_generator_base.backends:
+			raise ValueError("Wrong backend given: expected one of {} but '{}' given".format(mode_generator_base.backends, backend))
+		if precision != 'full' and backend != 'numpy':
+			raise ValueError("Reduced precision '{}' is only supported by the numpy backend".format(precision))
+		self.backend = backend
+
+		self.modes = lazy_mode_list(self.__build_mode) #list of modes (classes mode_generator), loaded on first use
 		self.mode_dict = {}
+		self.manifest = OrderedDict() #folder and type of mode generator of each mode, read by load
+		self.batch_size = None #batch size for the inference of the networks (if None, the default of each mode generator)
+		self.plan_cache = OrderedDict() #LRU cache of interpolation plans
+		self.plan_cache_size = plan_cache_size
+		self.plan_cache_bytes = plan_cache_bytes
+		self.timings = {} #timings of the last call (see get_intrinsic_batch)
+		self.mode_cache = OrderedDict() #LRU cache of the modes for the extrinsic recombination
+		self.mode_cache_bytes = mode_cache_bytes
+		self.mode_cache_nbytes = 0 #memory currently used by the mode cache
+		self.compiled = {} #PCA bases compiled for a fixed time grid and total mass (see compile)
+		self.fuse_networks = fuse_networks
+		self.fused = {} #fused evaluation of the networks, for each set of modes (see fused_networks)
+		self.n_threads = n_threads
+		self.executor, self.executor_threads = None, 0 #thread pool for the evaluation of the modes
+		self.lock = threading.RLock() #protects the caches from concurrent access
 
 		if folder is not None:
 			if type(folder) is int:
@@ -141,7 +800,28 @@ class GW_generator:
 				folder = os.path.dirname(inspect.getfile(GW_generator))+"/TD_models/model_"+str(folder)
 				if not os.path.isdir(folder):
 					raise RuntimeError("Given value {0} for pre-fitted model is not valid. Available models are:\n{1}".format(str(int_folder), list_models(False)))
-			self.load(folder, verbose)
+			self.load(folder, verbose, preload_modes)
+			if autotune: self.autotune(verbose = verbose)
+			if verbose and precision != 'full':
+				report = self.get_precision_report()
+				print("Precision '{}': mismatch with the full precision model mean = {:.2e}, median = {:.2e}, max = {:.2e} (weights: {} bytes, full precision: {} bytes)".format(
+					precision, report['mean'], report['median'], report['max'], report['nbytes'], report['nbytes_full']))
+		return
+
+	def __getstate__(self):
+		"""
+		Returns a compact state of the generator, for pickling: the weights of the networks and the PCA models of each mode (see :func:`mode_generator_NN.__getstate__`) and the options of the generator. The caches, the thread pool and the lock are not included.
+		A generator can then be sent to other processes (e.g. with multiprocessing or joblib) and it is rebuilt there from the state, without loading the model from its folder. Only the modes already loaded are included: the others are loaded from the folder when first used, as in the original generator. The modes of a generator loaded from a model bundle only store a reference to the bundle (see :class:`model_bundle`): the arrays are mapped again from the file, rather than copied.
+		"""
+		state = self.__dict__.copy()
+		state.update({'plan_cache': OrderedDict(), 'mode_cache': OrderedDict(), 'mode_cache_nbytes': 0, 'compiled': {}, 'fused': {},
+			'timings': {}, 'executor': None, 'executor_threads': 0, 'lock': None})
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.lock = threading.RLock()
+		self.modes.build = self.__build_mode
 		return
 
 	def __extract_mode(self, folder):
@@ -167,24 +847,39 @@ class GW_generator:
 			return None
 		return lm
 
-	def load(self, folder, verbose = False):
+	def load(self, folder, verbose = False, preload_modes = None):
 		"""
 		Loads the GW generator by loading the different mode_generator classes.
 		Each mode is loaded from a dedicated folder in the given folder of the model.
 		An optional README files holds some information about the model.
+		The model can also be loaded from a single binary file written by :func:`export_bundle`: the arrays of the model are memory mapped (see :class:`model_bundle`).
+
+		Loading is lazy: only a manifest of the model (i.e. the available modes, with the folder and the type of generator of each) is read here, and each mode generator is built the first time the mode is used. A job that only requires the (2,2) mode never loads the networks of the other modes.
+		The modes in `preload_modes` are loaded right away (see also :func:`load_modes`).
+		The modes are added to those loaded before: loading many folders (or bundles) builds a generator with the modes of all of them. If a mode is in more than one of them, the last one loaded is kept.
 		
 		Inputs:
 			folder: str
-				Folder in which everything is kept
+				Folder in which everything is kept (or path to a model bundle)
 			verbose: bool
 				Whether to be verbose
+			preload_modes: list/str
+				Modes to load right away: a list of (l,m) modes or 'all'. If None, each mode is loaded the first time it is used.
 		"""
+		if os.path.isfile(folder):
+			self.__load_bundle(folder, verbose)
+			self.load_modes(preload_modes, verbose)
+			return
 		if not os.path.isdir(folder):
 			raise RuntimeError("Unable to load folder "+folder+": no such directory!")
 
 		if not folder.endswith('/'):
 			folder = folder + "/"
 		if verbose: print("Loading model from: ", folder)
+		self.folder = folder
+		self.clear_mode_cache() #the modes cached so far might be outdated
+		self.clear_compiled()
+		self.fused.clear()
 		file_list = os.listdir(folder)
 		
 		if 'README' in file_list:
@@ -203,6 +898,8 @@ class GW_generator:
 
 		#Loading angles (if any)
 		if 'angles' in file_list:
+			import tensorflow as tf
+			import joblib
 			with tf.keras.utils.custom_object_scope({'CosinesLayer': CosinesLayer}):
 				self.angle_trend_generator = tf.keras.saving.load_model(folder+'angles/model.keras')
 			self.angle_trend_scaler = joblib.load(folder+'angles/scaler.gz')
@@ -213,25 +910,390 @@ class GW_generator:
 			self.angle_trend_scaler = None
 
 
-		#loading modes
+		#reading the manifest of the modes
+		manifest = OrderedDict()
 		for mode in file_list:
 			lm = self.__extract_mode(folder+mode)
 			if lm is None:
 				continue
+				#Checking for the type of mode generator (FIXME: make this better! How to know which generator to use?)
+			isNN = len(glob.glob(folder+mode+'/*keras'))
+			manifest[lm] = (folder+mode, mode_generator_NN if isNN else mode_generator_MoE)
+		self.__add_to_manifest(manifest)
+		if verbose: print('\tFound modes {}'.format(self.list_modes()))
+
+		self.load_modes(preload_modes, verbose)
+		return
+
+	def __load_bundle(self, filename, verbose = False):
+		"""
+		Reads the manifest of the model from a model bundle (see :func:`export_bundle`). The arrays of the modes are not read here: they are memory mapped when each mode is built.
+
+		Input:
+			filename: str
+				path to the bundle
+			verbose: bool
+				Whether to be verbose
+		"""
+		if verbose: print("Loading model from bundle: ", filename)
+		bundle = model_bundle(filename)
+		self.folder = filename
+		self.clear_mode_cache() #the modes cached so far might be outdated
+		self.clear_compiled()
+		self.fused.clear()
+
+		self.readme = ast.literal_eval(bundle.metadata['readme'])
+		self.angle_trend_generator = None
+		self.angle_trend_scaler = None
+
+		manifest = OrderedDict()
+		for entry in bundle.metadata['modes']:
+			generator_type = mode_generator_NN if entry['type'] == 'NN' else mode_generator_MoE
+			manifest[tuple(entry['mode'])] = ((bundle, entry), generator_type)
+		self.__add_to_manifest(manifest)
+		if verbose: print('\tFound modes {}'.format(self.list_modes()))
+		return
+
+	def __add_to_manifest(self, manifest):
+		"""
+		Adds the modes of a manifest to those of the generator: the modes loaded before are kept, while a mode already in the generator is replaced by the new one (and it is built again when first used).
+
+		Input:
+			manifest: :class:`~collections.OrderedDict`
+				for each (l,m) mode, the source of the mode and the type of its generator
+		"""
+		for lm, entry in manifest.items():
+			if lm in self.mode_dict:
+				self.modes[self.mode_dict[lm]] = None
 			else:
 				self.mode_dict[lm] = len(self.modes)
+				self.modes.append(None)
+			self.manifest[lm] = entry
+		return
 
-					#Checking for the type of mode generator (FIXME: make this better! How to know which generator to use?)
-				isNN = len(glob.glob(folder+mode+'/*keras'))
-				if isNN:
-					self.modes.append(mode_generator_NN(lm, folder+mode)) #loads mode_generator
+	def export_bundle(self, filename):
+		"""
+		Exports the model to a single binary file (a "model bundle", see :class:`model_bundle`), which holds the arrays and the metadata of all the modes.
+		The model is loaded from the bundle as from a folder, with ``GW_generator(filename)``: the arrays are memory mapped rather than parsed from text files and keras archives, so that loading takes a few milliseconds and the memory of the model is shared by all the processes that load the same bundle.
+		The exported model is in full precision and does not depend on the backend; precessing models (with angles) cannot be exported.
+
+		Input:
+			filename: str
+				path to the bundle to write
+		"""
+		if self.precision != 'full':
+			raise ValueError("Only a model in full precision can be exported: the model is in precision '{}'".format(self.precision))
+		if self.angle_trend_generator is not None:
+			raise ValueError("Unable to export a model with angles to a model bundle")
+		arrays, modes = {}, []
+		for lm, mode in zip(self.list_modes(), self.modes):
+			prefix = '{}{}/'.format(*lm)
+			mode_metadata, mode_arrays = mode.to_bundle(prefix)
+			arrays.update(mode_arrays)
+			mode_metadata.update({'mode': list(lm), 'type': 'NN' if isinstance(mode, mode_generator_NN) else 'MoE', 'prefix': prefix})
+			modes.append(mode_metadata)
+		model_bundle.write(filename, arrays, {'readme': repr(self.readme), 'modes': modes})
+		return
+
+	def __build_mode(self, index):
+		"""
+		Builds the mode generator with the given index in the manifest, with the current backend, precision and batch size (see :class:`lazy_mode_list`).
+
+		Input:
+			index: int
+				index of the mode in `self.modes`
+
+		Output:
+			generator: :class:`mode_generator_base`
+				mode generator
+		"""
+		with self.lock: #a mode is built only once, even if many threads require it at once
+			if self.modes.generators[index] is None:
+				lm = self.list_modes()[index]
+				folder, generator_type = self.manifest[lm]
+				if isinstance(folder, tuple): #mode stored in a model bundle
+					generator = generator_type(lm, backend = self.backend)
+					generator.load_bundle(*folder)
+				elif generator_type is mode_generator_NN:
+					generator = mode_generator_NN(lm, folder, backend = self.backend) #loads mode_generator
 				else:
-					self.modes.append(mode_generator_MoE(lm, folder+mode)) #loads mode_generator
+					generator = mode_generator_MoE(lm, folder) #loads mode_generator
+				generator.set_backend(self.backend)
+				generator.set_precision(self.precision)
+				if self.batch_size is not None and isinstance(generator, mode_generator_NN): generator.batch_size = self.batch_size
+				self.modes.generators[index] = generator
+			return self.modes.generators[index]
+
+	def load_modes(self, modes = 'all', verbose = False):
+		"""
+		Loads the given modes, which otherwise would be loaded the first time they are used (see :func:`load`).
 
-			if verbose: print('\tLoaded mode {}'.format(lm))
+		Input:
+			modes: list/str
+				list of (l,m) modes to load or 'all' to load every mode of the model (if None, nothing is done)
+			verbose: bool
+				Whether to be verbose
+		"""
+		if modes is None: return
+		if isinstance(modes, str):
+			if modes != 'all': raise ValueError("Wrong modes given: expected a list of modes or 'all' but '{}' given".format(modes))
+			modes = self.list_modes()
+		if isinstance(modes, tuple): modes = [modes]
+		for mode in modes:
+			mode = tuple(mode)
+			if mode not in self.mode_dict:
+				warnings.warn("Unable to find mode {}: mode might be non existing or in the wrong format. Skipping it".format(mode))
+				continue
+			self.modes[self.mode_dict[mode]]
+			if verbose: print('\tLoaded mode {}'.format(mode))
+		return
 
+	def set_backend(self, backend):
+		"""
+		Sets the backend used for the inference of the neural networks of all the modes. Available backends are:
+
+		- 'tf': the networks are evaluated by tensorflow (default)
+		- 'tf_frozen': each network is traced once into a tensorflow graph, with an input signature that accepts any batch size, and its variables are frozen into constants. It removes the eager overhead of each call and it never retraces: the output agrees with 'tf' within float32 precision.
+		- 'numpy': the weights of each network are extracted at load time and the networks are evaluated with plain numpy matrix multiplications (see :class:`~mlgw.ML_routines.dense_NN`). It avoids the tensorflow dispatch overhead, which dominates the generation time of a small number of WFs. The output agrees with tensorflow within float32 precision.
+
+		Modes that are not generated by neural networks are not affected.
+
+		Input:
+			backend: str
+				name of the backend
+		"""
+		if backend not in mode_generator_base.backends:
+			raise ValueError("Wrong backend given: expected one of {} but '{}' given".format(mode_generator_base.backends, backend))
+		if self.precision != 'full' and backend != 'numpy':
+			raise ValueError("Reduced precision '{}' is only supported by the numpy backend".format(self.precision))
+		for mode in self.modes.loaded(): #the modes not loaded yet will be built with the new backend
+			mode.set_backend(backend)
+		self.backend = backend
+		self.clear_mode_cache() #the cached modes were generated by a different backend
+		self.fused.clear()
 		return
 
+	def __set_fused_coefficients(self, batch, modes):
+		"""
+		Evaluates at once the networks of all the given modes generated by neural networks (see :class:`fused_networks`) and stores their PCA coefficients in the batch, where the mode generators will find them.
+		It does nothing if `self.fuse_networks` is False.
+
+		Input:
+			batch: :class:`intrinsic_batch`
+				preprocessed intrinsic parameters
+			modes: list
+				list of modes to generate
+		"""
+		if not self.fuse_networks: return
+		generators = [self.modes[self.mode_dict[mode]] for mode in modes if mode in self.mode_dict]
+		generators = [g for g in generators if isinstance(g, mode_generator_NN)] #also the compiled modes read their coefficients from the batch
+		if not generators: return
+		start = time.perf_counter()
+
+		key = tuple(g.mode for g in generators)
+		with self.lock:
+			if key not in self.fused:
+				self.fused[key] = fused_networks(generators, self.backend)
+			fused = self.fused[key]
+
+		theta, batch_size = batch.theta_unique, min(g.batch_size for g in generators)
+		coefficients = [fused(theta[i:i+batch_size]) for i in range(0, len(theta), batch_size)]
+		for k, mode in enumerate(key):
+			batch.coefficients[mode] = (np.concatenate([c[k][0] for c in coefficients], axis = 0), np.concatenate([c[k][1] for c in coefficients], axis = 0))
+		batch.timings['networks'] = time.perf_counter() - start
+		return
+
+	def __map(self, func, items):
+		"""
+		Applies a function to each of the items. If `self.n_threads` > 1, the items are processed concurrently by the thread pool of the generator, unless the call comes from a worker of the pool itself (to avoid deadlocks).
+		The results are returned in order as an iterator: in the serial case, each item is processed only when its result is requested.
+
+		Input:
+			func: function
+				function to apply
+			items: list
+				items to process
+
+		Output:
+			results: iterator
+				``func(item)`` for each item, in the order of `items`
+		"""
+		items = list(items)
+		if self.n_threads <= 1 or len(items) < 2 or getattr(thread_state, 'worker', False):
+			return map(func, items)
+		quiet = getattr(thread_state, 'quiet', False)
+		def worker_func(item):
+			thread_state.worker, thread_state.quiet = True, quiet #the warnings are silenced in the workers as in the caller
+			try:
+				return func(item)
+			finally:
+				thread_state.worker, thread_state.quiet = False, False
+		with self.lock:
+			if self.executor_threads != self.n_threads:
+				if self.executor is not None: self.executor.shutdown(wait = False)
+				self.executor, self.executor_threads = ThreadPoolExecutor(max_workers = self.n_threads), self.n_threads
+			executor = self.executor
+		return executor.map(worker_func, items)
+
+	def autotune(self, n_wf = 256, backends = None, batch_sizes = (10, 32, 100, 320, 1000), n_threads = None, cache_file = None, force = False, set_threads = False, verbose = False):
+		"""
+		Chooses the fastest configuration for the inference of the neural networks on the current machine, by timing the evaluation of the networks of all the modes on a batch of `n_wf` random WFs. The configuration is given by:
+
+		- the backend (see :func:`set_backend`)
+		- the batch size of the network calls (attribute `batch_size` of each :class:`mode_generator_NN`)
+		- the number of BLAS threads used by the numpy backend (only if the optional package `threadpoolctl` is installed)
+
+		The chosen configuration is applied to the generator and stored in a per-host cache file (see :func:`autotune_cache_file`), keyed by the model folder, the precision, the dtype and the modes benchmarked: if a configuration is already stored for the model, it is applied without running the benchmark (unless `force` is True).
+		Note that the number of threads of tensorflow cannot be changed after tensorflow is initialized: it is not tuned here.
+		Each trial runs within :func:`~mlgw.thread_policy.threading_limits`, so that the BLAS threads of the process are left as they were. The number of BLAS threads is a setting of the whole process (and of its child processes): the chosen one is applied (with :func:`~mlgw.thread_policy.set_threading`) only if `set_threads` is True.
+		The benchmark runs on the modes loaded so far (e.g. with `preload_modes`, see :func:`load`) or, if no mode is loaded yet, on the (2,2) mode only (on the first mode, if the model has no (2,2) mode): the other modes are not loaded by the benchmark.
+
+		Input:
+			n_wf: int
+				Number of WFs for the benchmark
+			backends: list
+				Backends to try (if None, all the available backends)
+			batch_sizes: list
+				Batch sizes to try (those larger than `n_wf` are replaced by `n_wf`)
+			n_threads: list
+				Number of BLAS threads to try for the numpy backend (if None, powers of 2 up to the number of CPUs)
+			cache_file: str
+				File to store the configurations in (if None, the default per-host file is used)
+			force: bool
+				Whether to run the benchmark even if a configuration is already stored
+			set_threads: bool
+				Whether to set the number of BLAS threads of the process to the chosen one
+			verbose: bool
+				Whether to print the timing of each configuration
+
+		Output:
+			config: dict
+				chosen configuration, with keys 'backend', 'batch_size', 'n_threads' and 'time' (time in seconds of the benchmark)
+		"""
+		if cache_file is None: cache_file = autotune_cache_file()
+		tuned_modes = self.modes.loaded() or [self.modes[self.mode_dict.get((2,2), 0)]] #the benchmark does not load the other modes
+		allowed_backends = mode_generator_base.backends if self.precision == 'full' else ('numpy',)
+			#the configuration depends on the precision of the weights and on the modes benchmarked
+		key = '{}|fuse_networks={}|precision={}|dtype={}|modes={}'.format(os.path.abspath(self.folder), self.fuse_networks,
+			self.precision, np.dtype(self.dtype).name, sorted(tuple(g.mode) for g in tuned_modes))
+		try:
+			with open(cache_file, 'r') as f:
+				cache = json.load(f)
+		except (OSError, ValueError):
+			cache = {}
+
+		if key in cache and not force and cache[key].get('backend', None) in allowed_backends:
+			self.__apply_config(cache[key], set_threads)
+			if verbose: print("Autotune: loaded configuration {} from {}".format(cache[key], cache_file))
+			return cache[key]
+
+		NN_modes = [g for g in tuned_modes if isinstance(g, mode_generator_NN)]
+		if backends is None: backends = allowed_backends
+		batch_sizes = sorted(set(min(int(b), n_wf) for b in batch_sizes)) #a batch size larger than n_wf evaluates the whole batch at once
+		if thread_policy.threadpoolctl is None:
+			n_threads = [None]
+		elif n_threads is None:
+			n_threads = [2**i for i in range(int(np.log2(os.cpu_count() or 1))+1)]
+
+		rng = np.random.default_rng(0)
+		theta = np.column_stack([rng.uniform(1., 8., n_wf), rng.uniform(-0.8, 0.8, (n_wf,2))]) #(N,3)
+
+		best = None
+		for backend in backends:
+			self.set_backend(backend)
+			for threads in (n_threads if backend == 'numpy' else [None]):
+				for batch_size in batch_sizes:
+					config = {'backend': backend, 'batch_size': batch_size, 'n_threads': threads}
+					self.__apply_config(config)
+					timing = []
+					with thread_policy.threading_limits(threads):
+						for _ in range(4): #the first call is a warm up (e.g. tracing)
+							start = time.perf_counter()
+							if self.fuse_networks:
+								self.__set_fused_coefficients(intrinsic_batch(theta), [g.mode for g in tuned_modes])
+							else:
+								for g in NN_modes: g.get_PCA_coefficients(theta)
+							timing.append(time.perf_counter() - start)
+					config['time'] = min(timing[1:])
+					if verbose: print("Autotune: {}".format(config))
+					if best is None or config['time'] < best['time']: best = config
+
+		self.__apply_config(best, set_threads)
+		cache[key] = best
+		try:
+			os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok = True)
+			with open(cache_file+'.tmp', 'w') as f:
+				json.dump(cache, f, indent = 1)
+			os.replace(cache_file+'.tmp', cache_file) #atomic, in case of concurrent processes
+		except OSError as e:
+			warnings.warn("Unable to save the autotuned configuration to {}: {}".format(cache_file, e))
+		if verbose: print("Autotune: chosen configuration {}".format(best))
+		return best
+
+	def __apply_config(self, config, set_threads = False):
+		"""
+		Applies a configuration chosen by :func:`autotune`.
+
+		Input:
+			config: dict
+				configuration, with keys 'backend', 'batch_size' and 'n_threads'
+			set_threads: bool
+				Whether to set the number of BLAS threads of the process to 'n_threads' (otherwise, it is left unchanged)
+		"""
+		if self.backend != config['backend']: self.set_backend(config['backend'])
+		self.batch_size = config['batch_size']
+		for g in self.modes.loaded():
+			if isinstance(g, mode_generator_NN): g.batch_size = config['batch_size']
+		if set_threads and config.get('n_threads', None) is not None and thread_policy.threadpoolctl is not None:
+			thread_policy.set_threading(blas = config['n_threads'])
+		return
+
+	def get_precision_report(self, theta = None, t_grid = None, modes = None, n_wf = 100, reference = None):
+		"""
+		Measures the accuracy of the generator against the full precision model, in terms of the mismatch (optimized over a constant phase) between the WFs generated by the two. It is useful to assess the loss of accuracy of a reduced precision model (see argument `precision` of :class:`GW_generator`).
+		If not given, the validation set is made of `n_wf` random WFs with total mass in [20,100] M_sun, mass ratio in [1,8] and spins in [-0.8,0.8], evaluated on a grid of 4096 points covering the whole model grid.
+
+		Input:
+			theta: :class:`~numpy:numpy.ndarray`
+				shape (N,7) - validation set of source parameters [m1,m2,spin1_z,spin2_z,D_L,inclination,phi_0]
+			t_grid: :class:`~numpy:numpy.ndarray`
+				shape (D',) - time grid to generate the WFs at
+			modes: list
+				modes to include in the WFs (if None, all the available modes)
+			n_wf: int
+				number of WFs of the default validation set
+			reference: :class:`GW_generator`
+				full precision generator to compare with (if None, the model is loaded again from `self.folder` in full precision, with the numpy backend)
+
+		Output:
+			report: dict
+				dictionary with keys: 'mismatch' (mismatch of each WF), 'mean', 'median', 'max' (statistics of the mismatch), 'nbytes' and 'nbytes_full' (memory taken by the weights and the PCA bases of the modes of the WFs, for the generator and for the reference)
+		"""
+		from .GW_helper import compute_optimal_mismatch
+
+		if theta is None:
+			rng = np.random.default_rng(0)
+			q, m_tot = rng.uniform(1., 8., n_wf), rng.uniform(20., 100., n_wf)
+			theta = np.column_stack([m_tot*q/(1+q), m_tot/(1+q), rng.uniform(-0.8, 0.8, (n_wf,2)),
+				np.ones((n_wf,)), rng.uniform(0., np.pi, n_wf), rng.uniform(0., 2*np.pi, n_wf)])
+		if t_grid is None:
+			m_min = np.min(np.atleast_2d(theta)[:,0]+np.atleast_2d(theta)[:,1])
+			t_grid = np.linspace(self.modes[0].times[0], self.modes[0].times[-1], 4096)*m_min
+		if reference is None:
+			reference = GW_generator(self.folder, dtype = self.dtype, backend = 'numpy', fuse_networks = self.fuse_networks)
+
+		h_p, h_c = self.get_WF(theta, t_grid, modes)
+		h_p_ref, h_c_ref = reference.get_WF(theta, t_grid, modes)
+			#in double precision: the squares of the strains underflow in single precision
+		h = np.atleast_2d(h_p).astype(np.float64) + 1j*np.atleast_2d(h_c).astype(np.float64)
+		h_ref = np.atleast_2d(h_p_ref).astype(np.float64) + 1j*np.atleast_2d(h_c_ref).astype(np.float64)
+		mismatch, _ = compute_optimal_mismatch(h_ref, h)
+
+		report_modes = self.list_modes() if modes is None else (modes if isinstance(modes, list) else [modes])
+		nbytes = lambda generator: sum(generator.modes[generator.mode_dict[mode]].nbytes() for mode in report_modes if mode in generator.mode_dict)
+		return {'mismatch': mismatch, 'mean': np.mean(mismatch), 'median': np.median(mismatch), 'max': np.max(mismatch),
+			'nbytes': nbytes(self), 'nbytes_full': nbytes(reference)}
+
 	def get_precessing_params(self, m1, m2, s1, s2):
 		"""
 		Given the two masses and (dimensionless) spins, it computes the angles between the two spins and the orbital angular momentum (theta1, theta2) and the angle between the projections of the two spins onto the orbital plane (delta_Phi). Please, refer to eqs. (1-4) of https://arxiv.org/abs/1605.01067.
@@ -325,9 +1387,7 @@ class GW_generator:
 			mode_list: list
 				List with the available modes
 		"""
-		mode_list = []
-		for mode in self.modes:
-			mode_list.append(mode.lm())
+		mode_list = list(self.mode_dict.keys()) #the modes need not to be loaded
 		if print_screen: print(mode_list)
 		return mode_list
 
@@ -371,7 +1431,7 @@ class GW_generator:
 		return self.get_WF(theta, t_grid= t_grid, modes = (2,2))
 
 	#@do_profile(follow=[])
-	def get_WF(self, theta, t_grid, modes = (2,2) ):
+	def get_WF(self, theta, t_grid, modes = (2,2), combine_on_model_grid = False, cache_modes = False, out = None, lengths = None, offsets = None):
 		"""
 		Generates a WF according to the model. It makes all the required preprocessing to include wave dependance on the full 14 parameters space of the GW forms. It outputs the plus cross polarization of the WF.
 		All the available modes are employed to build the WF.
@@ -402,6 +1462,15 @@ class GW_generator:
 			[spin] = adimensional
 		
 		User might choose which modes are to be included in the WF.
+		If `combine_on_model_grid` is True, the modes are weighted by the spherical harmonics and summed on the internal grid of the model (~2000 points) and only the resulting WF is interpolated to the user grid. As the cost of interpolation does not scale with the number of modes, this is much faster for long grids and many modes. The WF is split in its positive and negative m parts, and the amplitude and phase of each of them are interpolated: this is exact for a single mode, while for many modes the beating between modes is interpolated linearly, introducing a small error in the inspiral (for model_0 with all the modes, the mismatch with the standard path is ~5e-5 on average and below ~5e-4 for q<8).
+		If `cache_modes` is True, the amplitude and phase of each mode are stored in a LRU cache, keyed by the intrinsic parameters [m1, m2, spin1_z, spin2_z] and by the time grid. When the WF is requested again with the same intrinsic parameters (e.g. when only D_L, inclination or phi_0 change), the modes are not generated again and they are only recombined with the spherical harmonics and the distance scaling. The cache holds at most `self.mode_cache_bytes` bytes and it can be emptied with :func:`clear_mode_cache`.
+		Each WF can be evaluated on its own time grid, in one of two layouts:
+			
+			padded	`t_grid` has shape (N,D'_max) and the i-th WF is evaluated at ``t_grid[i,:lengths[i]]``. The output has shape (N,D'_max) and it is zero on the padding.
+			
+			ragged	`t_grid` is the concatenation of all the grids, with shape (M,), and the i-th WF is evaluated at ``t_grid[offsets[i]:offsets[i+1]]``. The output has the same flat layout (M,).
+			
+		In both cases each WF is evaluated only on its own points and, as in the standard case, its phase is zero at the first point of its grid.
 
 		Input:
 			theta: :class:`~numpy:numpy.ndarray`
@@ -410,14 +1479,126 @@ class GW_generator:
 				shape (D',) - a grid in (reduced) time to evaluate the wave at (uses np.interp)
 			modes: list
 				list of modes employed for building the WF (if None, every mode available is employed)
+			combine_on_model_grid: bool
+				Whether to sum the modes on the model grid and to interpolate only the final WF
+			cache_modes: bool
+				Whether to cache the modes and to reuse them for WFs with the same intrinsic parameters (not available with `combine_on_model_grid`)
+			out: tuple
+				Two preallocated arrays (h_plus, h_cross) with the shape of the output and type `self.dtype`. If given, the WFs are written in place into them and they are returned. It avoids to allocate new memory at each call.
+			lengths: :class:`~numpy:numpy.ndarray`
+				shape (N,) - number of points of the grid of each WF, for a padded `t_grid` of shape (N,D'_max)
+			offsets: :class:`~numpy:numpy.ndarray`
+				shape (N+1,) - offsets of the grid of each WF in a flat (ragged) `t_grid`
 
 		Ouput:
-			h_plus, h_cross (D,)/(N,D)		desidered polarizations (if it applies)
+			h_plus, h_cross (D,)/(N,D)		desidered polarizations (if it applies). In the ragged layout, the shape is (M,)
 		"""
 		#TODO: this function eventually should take f_ref. If f_ref is not None, the spin will be evolved up to our merger frequency
 		
 		if isinstance(modes,tuple) and modes != (2,2):
 			modes = [modes]
+		theta, to_reshape = self.__standardize_theta_WF(theta)
+
+			#generating waves and returning to user
+		t_grid, offsets, pad_mask = self.__get_ragged_grid(theta.shape[0], t_grid, lengths, offsets)
+		if offsets is not None and cache_modes:
+			raise ValueError("Mode caching is not available when each WF has its own time grid")
+		out_WF = out if pad_mask is None else None #in the padded layout, the WF is first computed on the ragged grid
+		
+		if combine_on_model_grid and (modes is None or (isinstance(modes, list) and len(modes)>1)): #for a single mode, there is nothing to combine
+			if cache_modes:
+				raise ValueError("Mode caching is not available when the modes are combined on the model grid")
+			h_plus, h_cross = self.__get_WF_model_grid(theta, t_grid, modes, offsets = offsets) #(N,D)
+			if out_WF is not None:
+				for buff, h in zip(self.__get_out_buffers(out_WF, 2, h_plus.shape, self.dtype), [h_plus, h_cross]):
+					buff[...] = h
+		elif self.n_threads > 1 and theta.shape[0] > 1 and offsets is None and not cache_modes and (modes == (2,2) or (isinstance(modes, list) and len(modes) == 1)):
+				#a single mode: the batch is split in chunks, generated concurrently
+			h_plus, h_cross = self.__get_out_buffers(out_WF, 2, (theta.shape[0], len(t_grid)), self.dtype)
+			chunks = [slice(rows[0], rows[-1]+1) for rows in np.array_split(np.arange(theta.shape[0]), min(self.n_threads, theta.shape[0]))]
+				#the plan of a chunk is a slice of the plan of the whole batch, which is taken from the cache (and built only once)
+			m_tot, full_plans, plans_lock = theta[:,0] + theta[:,1], {}, threading.Lock()
+			t_key = array_key(t_grid) #the grid is hashed only once for all the chunks
+			def get_chunk(rows):
+				def plan_builder(t_grid, m_tot_chunk, times, t_key):
+					with plans_lock:
+						key = array_key(times)
+						if key not in full_plans: full_plans[key] = self.get_interp_plan(t_grid, m_tot, times, t_key)
+					return full_plans[key].take_rows(rows)
+				self.__get_WF(theta[rows], t_grid, modes, out = (h_plus[rows], h_cross[rows]), plan_builder = plan_builder, grid_key = t_key)
+				return thread_state.timings
+			timings = {}
+			for chunk_timings in self.__map(get_chunk, chunks):
+				for k, v in chunk_timings.items(): timings[k] = timings.get(k, 0.) + v #summed over the chunks
+			self.timings = timings
+		else:
+			h_plus, h_cross = self.__get_WF(theta, t_grid, modes, cache_modes, out = out_WF, offsets = offsets) #(N,D)
+
+		if pad_mask is not None:
+			h_flat = (h_plus, h_cross)
+			h_plus, h_cross = self.__get_out_buffers(out, 2, pad_mask.shape, self.dtype) #(N,D'_max)
+			h_plus[pad_mask], h_cross[pad_mask] = h_flat
+		if out is not None:
+			return out
+		if to_reshape and (offsets is None or pad_mask is not None):
+			return h_plus[0,:], h_cross[0,:] #(D,)
+		return h_plus, h_cross #(N,D)
+
+	def __get_ragged_grid(self, N, t_grid, lengths = None, offsets = None):
+		"""
+		Checks the time grid given by the user and brings a grid which is different for each WF (padded or ragged) in the ragged layout.
+
+		Input:
+			N: int
+				number of WFs
+			t_grid: :class:`~numpy:numpy.ndarray`
+				shape (D',)/(N,D'_max)/(M,) - time grid given by the user (standard, padded or ragged layout)
+			lengths: :class:`~numpy:numpy.ndarray`
+				shape (N,) - lengths of the grids in the padded layout
+			offsets: :class:`~numpy:numpy.ndarray`
+				shape (N+1,) - offsets of the grids in the ragged layout
+		Output:
+			t_grid: :class:`~numpy:numpy.ndarray`
+				shape (D',)/(M,) - time grid (in the ragged layout, if it applies)
+			offsets: :class:`~numpy:numpy.ndarray`
+				shape (N+1,) - offsets of the grids in the ragged layout (None if the grid is shared by all WFs)
+			pad_mask: :class:`~numpy:numpy.ndarray`
+				shape (N,D'_max) - mask of the points of the padded grid which belongs to the grid of each WF (None if the grid is not padded)
+		"""
+		t_grid = np.asarray(t_grid)
+		if lengths is not None and offsets is not None:
+			raise ValueError("Only one between lengths (padded grid) and offsets (ragged grid) can be given")
+		if lengths is None and offsets is None:
+			if t_grid.ndim != 1:
+				raise ValueError("Wrong shape for the time grid: expected a 1D array but shape {} given. For a different grid for each WF, lengths or offsets must be given".format(t_grid.shape))
+			return t_grid, None, None
+		if offsets is not None:
+			if t_grid.ndim != 1:
+				raise ValueError("Wrong shape for the ragged time grid: expected a 1D array but shape {} given".format(t_grid.shape))
+			return t_grid, np.asarray(offsets, dtype = int), None
+
+		lengths = np.asarray(lengths, dtype = int)
+		if t_grid.ndim != 2 or t_grid.shape[0] != N or lengths.shape != (N,):
+			raise ValueError("Wrong shape for the padded time grid: expected a grid of shape (N,D'_max) and N lengths, with N = {}".format(N))
+		if np.any(lengths < 1) or np.any(lengths > t_grid.shape[1]):
+			raise ValueError("Wrong lengths for the padded time grid: they must be between 1 and {}".format(t_grid.shape[1]))
+		pad_mask = np.arange(t_grid.shape[1])[None,:] < lengths[:,None] #(N,D'_max)
+		offsets = np.concatenate([[0], np.cumsum(lengths)])
+		return t_grid[pad_mask], offsets, pad_mask
+
+	def __standardize_theta_WF(self, theta):
+		"""
+		Brings the parameters given to :func:`get_WF` in the standard layout D = 7 [m1, m2, spin1_z , spin2_z, D_L, inclination, phi_0] used by __get_WF.
+
+		Input:
+			theta: :class:`~numpy:numpy.ndarray`
+				shape (D,)/(N,D) - source parameters in any of the layouts accepted by :func:`get_WF`
+		Output:
+			theta: :class:`~numpy:numpy.ndarray`
+				shape (N,7) - source parameters in the standard layout (always a copy of the input)
+			to_reshape: bool
+				whether the input was one dimensional
+		"""
 		theta = np.array(theta) #to ensure user theta is copied into new array
 		if theta.ndim == 1:
 			to_reshape = True #whether return a one dimensional array
@@ -428,14 +1609,13 @@ class GW_generator:
 		D= theta.shape[1] #number of features given
 		if D <3:
 			raise RuntimeError("Unable to generata WF. Too few parameters given!!")
-			return
 
 			#creating a standard theta vector for __get_WF
 		if D==3:
 			new_theta = np.zeros((theta.shape[0],7))
 			new_theta[:,4] = 1.
 			new_theta[:,[2,3]] = theta[:,[1,2]] #setting spins
-			new_theta[:,[0,1]] = [theta[:,0]*20./(1+theta[:,0]), 20./(1+theta[:,0])] #setting m1,m2 with M = 20
+			new_theta[:,[0,1]] = np.column_stack([theta[:,0]*20./(1+theta[:,0]), 20./(1+theta[:,0])]) #setting m1,m2 with M = 20
 			theta = new_theta #(N,7)
 
 		if D>3 and D!=7:
@@ -458,11 +1638,61 @@ class GW_generator:
 		if np.any(np.logical_and(theta[:,[2,3]]>=1,theta[:,[2,3]]<=-1)):
 			raise ValueError("Wrong value for spins, please set a value in range [-1,1]")
 
-			#generating waves and returning to user
-		h_plus, h_cross = self.__get_WF(theta, t_grid, modes) #(N,D)
-		if to_reshape:
-			return h_plus[0,:], h_cross[0,:] #(D,)
-		return h_plus, h_cross #(N,D)
+		return theta, to_reshape
+
+	def iter_WF(self, theta, t_grid, modes = (2,2), max_bytes = 2**28, combine_on_model_grid = False):
+		"""
+		Generates the WFs of a (possibly huge) batch in chunks, so that the memory needed does not depend on the number of WFs.
+		The batch is split in chunks of rows, whose size is set s.t. the memory used to generate a chunk (output, intermediate arrays and interpolation plans) is roughly below `max_bytes`. The arguments are the same as in :func:`get_WF`.
+		For each chunk, the generator yields the slice of the rows of theta and the two polarizations. To keep the memory flat, the same output buffers are reused for all the chunks: the arrays yielded are overwritten at the next iteration and they must be copied if they need to be kept.
+		
+			>>> for rows, h_plus, h_cross in generator.iter_WF(theta, t_grid, modes = None):
+			...	snr[rows] = compute_snr(h_plus, h_cross)
+
+		Input:
+			theta: :class:`~numpy:numpy.ndarray`
+				shape (D,)/(N,D) - source parameters to make prediction at (same layouts as in :func:`get_WF`)
+			t_grid: :class:`~numpy:numpy.ndarray`
+				shape (D',) - a grid in (physical) time to evaluate the wave at
+			modes: list
+				list of modes employed for building the WF (if None, every mode available is employed)
+			max_bytes: int
+				approximate memory budget (in bytes) for generating a chunk. A chunk holds at least one WF.
+			combine_on_model_grid: bool
+				Whether to sum the modes on the model grid and to interpolate only the final WF
+
+		Output:
+			rows: slice
+				rows of theta of the current chunk
+			h_plus, h_cross: :class:`~numpy:numpy.ndarray`
+				shape (N_chunk,D') - polarizations of the chunk
+		"""
+		if isinstance(modes,tuple) and modes != (2,2):
+			modes = [modes]
+		theta, _ = self.__standardize_theta_WF(theta)
+		t_grid = np.asarray(t_grid)
+		combine = combine_on_model_grid and (modes is None or (isinstance(modes, list) and len(modes)>1))
+
+			#memory for a single WF: output and temporary arrays on the user grid (~10 arrays), the interpolation plan and the modes on the model grid
+		required_modes = self.list_modes() if modes is None else (modes if isinstance(modes, list) else [modes])
+		N_native = max([len(self.modes[self.mode_dict[mode]].times) for mode in required_modes if mode in self.mode_dict], default = 0)
+			#the plan holds int indices, float64 weights (and their cast to dtype) and two boolean masks, whatever the dtype of the output
+		plan_bytes = np.dtype(np.intp).itemsize + np.dtype(np.float64).itemsize + self.dtype.itemsize + 2*np.dtype(bool).itemsize
+		row_bytes = len(t_grid)*(10*self.dtype.itemsize + plan_bytes) + self.dtype.itemsize*(16 if combine else 4)*N_native
+		chunk_size = int(max(1, min(theta.shape[0], max_bytes//row_bytes)))
+
+		h_plus, h_cross = np.zeros((chunk_size, len(t_grid)), dtype = self.dtype), np.zeros((chunk_size, len(t_grid)), dtype = self.dtype)
+		for start in range(0, theta.shape[0], chunk_size):
+			rows = slice(start, min(start+chunk_size, theta.shape[0]))
+			out = (h_plus[:rows.stop-rows.start], h_cross[:rows.stop-rows.start])
+				#the plans of each chunk are not cached, as they would not be used again
+			if combine:
+				h_p, h_c = self.__get_WF_model_grid(theta[rows], t_grid, modes, cache_plans = False)
+				out[0][...], out[1][...] = h_p, h_c
+				del h_p, h_c
+			else:
+				self.__get_WF(theta[rows], t_grid, modes, out = out, cache_plans = False)
+			yield rows, out[0], out[1]
 
 	def __check_modes_input(self, theta, modes):
 		"""
@@ -505,6 +1735,247 @@ class GW_generator:
 
 		return theta, modes, remove_first_dim, remove_last_dim
 
+	def __get_out_buffers(self, out, n_buffers, shape, dtype):
+		"""
+		Checks the output buffers given by the user and returns a view of them with the shape used internally. The buffers are set to zero. If no buffer is given, new arrays are allocated.
+
+		Input:
+			out: tuple
+				`n_buffers` arrays given by the user (or None)
+			n_buffers: int
+				number of output arrays
+			shape: tuple
+				shape of each buffer, as used internally: the user buffers can differ only for some axes of length 1
+			dtype: type
+				data type of the buffers
+		Output:
+			buffers: tuple
+				arrays of shape `shape` (views of the user buffers, if they are given)
+		"""
+		if out is None:
+			return tuple(np.zeros(shape, dtype = dtype) for _ in range(n_buffers))
+		if isinstance(out, np.ndarray): out = (out,)
+		if len(out) != n_buffers:
+			raise ValueError("Wrong number of output buffers: expected {} but {} given".format(n_buffers, len(out)))
+		
+		buffers = []
+		for buff in out:
+			if not isinstance(buff, np.ndarray) or buff.dtype != dtype:
+				raise ValueError("Wrong output buffer given: expected a numpy array of type {}".format(np.dtype(dtype)))
+			if buff.size != int(np.prod(shape)) or tuple(d for d in buff.shape if d != 1) != tuple(d for d in shape if d != 1):
+				raise ValueError("Wrong shape for the output buffer: expected {} but {} given".format(shape, buff.shape))
+			buff = buff.view()
+			try:
+				buff.shape = shape #this never copies the data
+			except AttributeError:
+				raise ValueError("The output buffer cannot be reshaped to {} without a copy".format(shape))
+			buff[...] = 0.
+			buffers.append(buff)
+		return tuple(buffers)
+
+	def get_interp_plan(self, t_grid, m_tot, times, t_key = None):
+		"""
+		Returns the interpolation plan (:class:`interp_plan`) to put a mode, generated by the model on the grid `times`, on the user time grid `t_grid`, for the given total masses.
+		Plans are kept in a LRU cache, keyed by the content of the time grid, of the model grid and by the total masses: in this way, all the modes of a call (and all the calls with the same grid and masses) share the same plan.
+		The cache holds at most `self.plan_cache_size` plans, taking at most `self.plan_cache_bytes` bytes (see :func:`interp_plan.nbytes`): the least recently used plans are removed first. It can be emptied with :func:`clear_plan_cache`.
+
+		Input:
+			t_grid: :class:`~numpy:numpy.ndarray`
+				shape (D',) - a grid in (physical) time to evaluate the wave at
+			m_tot: :class:`~numpy:numpy.ndarray`
+				shape (N,) - total mass of each WF (in solar masses)
+			times: :class:`~numpy:numpy.ndarray`
+				shape (D,) - reduced time grid of the model (as given by mode_generator.get_time_grid())
+			t_key: tuple
+				key of `t_grid` (see :func:`array_key`): if None, it is computed here
+
+		Output:
+			plan: :class:`interp_plan`
+				interpolation plan for the grids t_grid/m_tot
+		"""
+		t_grid, m_tot = np.asarray(t_grid), np.asarray(m_tot)
+		key = (array_key(t_grid) if t_key is None else t_key, array_key(m_tot), array_key(times))
+
+		with self.lock:
+			plan = self.plan_cache.get(key, None)
+			if plan is not None:
+				self.plan_cache.move_to_end(key)
+				return plan
+
+		plan = interp_plan(np.divide(t_grid[None,:], m_tot[:,None]), times)
+		if self.plan_cache_size > 0 and self.plan_cache_bytes > 0:
+			with self.lock:
+				self.plan_cache[key] = plan
+					#the memory of a plan is computed each time, as a plan grows when used (see interp_plan.restrict and interp_plan.get_weights)
+				while len(self.plan_cache) > self.plan_cache_size or sum(p.nbytes() for p in self.plan_cache.values()) > self.plan_cache_bytes:
+					self.plan_cache.popitem(last = False) #removing the least recently used
+		return plan
+
+	def get_intrinsic_batch(self, theta, t_grid = None, cache_plans = True, offsets = None, plan_builder = None, grid_key = None):
+		"""
+		Performs the preprocessing of the intrinsic parameters which is shared by all the modes (see :class:`intrinsic_batch`). The interpolation plans of the batch are taken from the cache of the generator.
+		The timings of the batch are made available in `self.timings`, which always refers to the last batch generated: after a call to :func:`get_WF` or :func:`get_modes`, it holds the time (in seconds) spent for the preprocessing and for each mode. When :func:`get_WF` splits the batch in chunks generated by the thread pool, the timings are summed over the chunks.
+
+		Input:
+			theta: :class:`~numpy:numpy.ndarray`
+				shape (N,3)/(N,4) - source parameters [q, spin1_z, spin2_z] or [m1, m2, spin1_z, spin2_z]
+			t_grid: :class:`~numpy:numpy.ndarray`
+				shape (D',) - a grid in (physical) time to evaluate the modes at
+			cache_plans: bool
+				Whether to take the interpolation plans from the cache of the generator (if False, they are computed for the batch only)
+			offsets: :class:`~numpy:numpy.ndarray`
+				shape (N+1,) - offsets of the grid of each WF, if `t_grid` is in the ragged layout (see :class:`intrinsic_batch`)
+			plan_builder: function
+				Function building the interpolation plans of the batch (see :class:`intrinsic_batch`). If given, it is used in place of the cache of the generator
+			grid_key: tuple
+				key of `t_grid` (see :func:`array_key`), if already computed by the caller
+		Output:
+			batch: :class:`intrinsic_batch`
+				preprocessed intrinsic parameters
+		"""
+		if plan_builder is None and cache_plans: plan_builder = self.get_interp_plan
+		batch = intrinsic_batch(theta, t_grid, plan_builder = plan_builder, dtype = self.dtype, offsets = offsets, grid_key = grid_key)
+
+			#using the compiled bases, if the grid and the masses are the ones compiled
+		if len(self.compiled) and batch.t_grid is not None and not batch.is_ragged():
+			m_tot, bases = self.compiled.get(batch.grid_key(), (None, None))
+			if m_tot is not None and np.allclose(batch.m_tot_us, m_tot, rtol = 1e-10, atol = 0.): #up to round-off in m1+m2
+				batch.bases = bases
+		self.timings = thread_state.timings = batch.timings #the timings of the last batch of the current thread are also kept in thread_state
+		return batch
+
+	def clear_plan_cache(self):
+		"""
+		Removes all the interpolation plans stored in the cache.
+		"""
+		self.plan_cache.clear()
+		return
+
+	def get_cached_modes(self, theta, t_grid, modes, timings = None, grid_key = None):
+		"""
+		Returns amplitude and phase of the modes, as in ``get_modes(theta, t_grid, modes, out_type = "ampph")``, taking them from the mode cache whenever possible.
+		Each entry of the cache holds a single mode of a single WF and it is keyed by the exact value of the intrinsic parameters [m1, m2, spin1_z, spin2_z] and by the time grid. The modes not found in the cache are generated all at once, from a single batch and with a single evaluation of the networks (each distinct set of intrinsic parameters only once), and they are stored in the cache. The least recently used entries are removed as soon as the cache takes more than `self.mode_cache_bytes` bytes.
+		The timings of the call (see :func:`get_intrinsic_batch`) are added to `timings` and published in `self.timings`.
+
+		Input:
+			theta: :class:`~numpy:numpy.ndarray`
+				shape (N,4) - intrinsic parameters [m1, m2, spin1_z, spin2_z]
+			t_grid: :class:`~numpy:numpy.ndarray`
+				shape (D',) - a grid in (physical) time to evaluate the modes at
+			modes: list
+				list of modes to be returned (if a tuple, no third dimension is returned)
+			timings: dict
+				timings to add the timings of the call to (if None, a new dictionary is used)
+			grid_key: tuple
+				key of `t_grid` (see :func:`array_key`), if already computed by the caller
+
+		Output:
+			amp, ph: :class:`~numpy:numpy.ndarray`
+				shape (N, D', K) - amplitude and phase of the K modes required by the user (if K =1, no third dimension)
+		"""
+		theta = np.ascontiguousarray(np.atleast_2d(theta)[:,:4], dtype = np.float64)
+		t_grid = np.asarray(t_grid)
+		remove_last_dim = isinstance(modes, tuple)
+		if remove_last_dim: modes = [modes]
+		if timings is None: timings = {}
+		if grid_key is None: grid_key = array_key(t_grid)
+		t_key = (grid_key, self.dtype.str)
+		row_keys = [row.tobytes() for row in theta]
+
+		amp = np.zeros((theta.shape[0],t_grid.shape[0],len(modes)), dtype = self.dtype)
+		ph = np.zeros((theta.shape[0],t_grid.shape[0],len(modes)), dtype = self.dtype)
+		missing = [] #rows missing from the cache, for each mode
+		with self.lock:
+			for k, mode in enumerate(modes):
+				missing.append([])
+				for i, row_key in enumerate(row_keys):
+					entry = self.mode_cache.get((t_key, row_key, mode), None)
+					if entry is None:
+						missing[k].append(i)
+					else:
+						self.mode_cache.move_to_end((t_key, row_key, mode))
+						amp[i,:,k], ph[i,:,k] = entry
+
+			#generating the missing modes, with a batch shared by all the modes (only once for each set of intrinsic parameters)
+		rows = sorted(set().union(*missing))
+		if len(rows):
+			theta_new, inverse = np.unique(theta[rows], axis = 0, return_inverse = True)
+			inverse = np.reshape(inverse, (-1,))
+			batch = self.get_intrinsic_batch(theta_new, t_grid, grid_key = grid_key)
+			self.__set_fused_coefficients(batch, [mode for k, mode in enumerate(modes) if missing[k]])
+			for k, mode in enumerate(modes):
+				if not missing[k]: continue
+				start = time.perf_counter()
+				amp_new, ph_new = self.modes[self.mode_dict[mode]].get_mode(batch, t_grid, out_type = "ampph") #(N_new,D')
+				amp[rows,:,k], ph[rows,:,k] = amp_new[inverse], ph_new[inverse]
+				batch.timings[mode] = time.perf_counter() - start
+
+				if self.mode_cache_bytes <= 0:
+					continue
+				with self.lock:
+					for j, row in enumerate(theta_new):
+						key = (t_key, row.tobytes(), mode)
+						if key in self.mode_cache: continue
+						self.mode_cache[key] = (amp_new[j].copy(), ph_new[j].copy())
+						self.mode_cache_nbytes += amp_new[j].nbytes + ph_new[j].nbytes
+					while self.mode_cache_nbytes > self.mode_cache_bytes:
+						_, (amp_old, ph_old) = self.mode_cache.popitem(last = False) #removing the least recently used
+						self.mode_cache_nbytes -= amp_old.nbytes + ph_old.nbytes
+			for k, v in batch.timings.items(): timings[k] = timings.get(k, 0.) + v
+		for mode in modes: timings.setdefault(mode, 0.) #the modes taken from the cache entirely
+		self.timings = thread_state.timings = timings
+
+		if remove_last_dim:
+			return amp[...,0], ph[...,0]
+		return amp, ph
+
+	def compile(self, t_grid, m_tot, modes = None):
+		"""
+		Compiles the generator for a fixed time grid and a fixed total mass, as it is the case for injection studies or for template banks at fixed mass.
+		For each mode, the interpolation to the user grid is folded in the PCA basis (see :func:`mode_generator_base.compile_basis`): afterwards, whenever :func:`get_WF` or :func:`get_modes` are called with the same time grid and with WFs all with the given total mass, the modes are generated on the user grid from the PCA coefficients with a single matrix multiplication, skipping the reconstruction on the model grid and the interpolation.
+		A compiled basis takes (D'xK) numbers for each mode, where K is the number of PCA components: for long grids, this can be a lot of memory. Compiled bases can be removed with :func:`clear_compiled`.
+
+		Input:
+			t_grid: :class:`~numpy:numpy.ndarray`
+				shape (D',) - grid in (physical) time to evaluate the modes at
+			m_tot: float
+				total mass (in solar masses) of the WFs
+			modes: list
+				list of modes to compile (if None, every mode available is compiled)
+		"""
+		t_grid = np.asarray(t_grid)
+		if t_grid.ndim != 1:
+			raise ValueError("Wrong shape for the time grid: expected a 1D array but shape {} given".format(t_grid.shape))
+		if modes is None:
+			modes = self.list_modes()
+		elif isinstance(modes, tuple):
+			modes = [modes]
+
+		key = array_key(t_grid)
+		bases = {}
+		for mode in modes:
+			if mode not in self.mode_dict:
+				warnings.warn("Unable to find mode {}: mode might be non existing or in the wrong format. Skipping it".format(mode))
+				continue
+			bases[mode] = self.modes[self.mode_dict[mode]].compile_basis(t_grid, m_tot, self.dtype)
+		self.compiled[key] = (float(m_tot), bases)
+		return
+
+	def clear_compiled(self):
+		"""
+		Removes all the compiled bases (see :func:`compile`).
+		"""
+		self.compiled.clear()
+		return
+
+	def clear_mode_cache(self):
+		"""
+		Removes all the modes stored in the mode cache (see :func:`get_cached_modes`). It is called automatically when a new model is loaded.
+		"""
+		self.mode_cache.clear()
+		self.mode_cache_nbytes = 0
+		return
+
 	def get_merger_frequency(self, theta):
 		"""
 		Returns the (approximate) merger frequency in Hz, computed as half the 22 mode frequency at the peak of amplitude.
@@ -601,9 +2072,11 @@ class GW_generator:
 		theta = np.array(theta)
 		if theta.ndim == 1: theta = theta[None,:]
 		t_grid = np.linspace(-100,0.,1000)
-		warnings.filterwarnings('ignore')
-		_, ph = self.get_modes(theta, t_grid, (2,2), out_type = "ampph")#(N,D)
-		warnings.filterwarnings('default')
+		quiet, thread_state.quiet = getattr(thread_state, 'quiet', False), True #the grid is likely to be too long: the warning is silenced only for this thread
+		try:
+			_, ph = self.get_modes(theta, t_grid, (2,2), out_type = "ampph")#(N,D)
+		finally:
+			thread_state.quiet = quiet
 			#computing frequency as a function of time
 		f_t = -(1./(2*np.pi)) * np.gradient(ph, t_grid , axis = 1) #(N,D)
 		
@@ -891,7 +2364,7 @@ class GW_generator:
 		return alpha, beta, gamma
 		
 	#@do_profile()
-	def get_twisted_modes(self, theta, t_grid, modes, f_ref = 20., alpha0 = None, gamma0 = None, L0_frame = False, extra_stuff = None):
+	def get_twisted_modes(self, theta, t_grid, modes, f_ref = 20., alpha0 = None, gamma0 = None, L0_frame = False, extra_stuff = None, out = None):
 		"""
 		Return the twisted modes of the model, evaluated in the given time grid.
 		The twisted mode depends on angles alpha, beta, gamma and it is performed as in eqs. (17-20) in https://arxiv.org/abs/2005.05338
@@ -909,6 +2382,8 @@ class GW_generator:
 				reference frequency (in Hz) of the 22 mode at which the theta parameters refers to
 			L0_frame: bool
 				whether to output the modes in the inertial L0_frame
+			out: :class:`~numpy:numpy.ndarray`
+				A preallocated complex array with the shape of the output (and type complex64 if `self.dtype` is np.float32, complex128 otherwise). If given, the twisted modes are written in place into it and the real and imaginary part returned are views of it.
 		
 		Output:
 			real, imag:: :class:`~numpy:numpy.ndarray`
@@ -974,7 +2449,7 @@ class GW_generator:
 			# Performing the twist
 			
 		l_list = set([m[0] for m in modes]) #computing the set of l to take care of
-		h_P = np.zeros((theta.shape[0], t_grid.shape[0], len(modes)), dtype = np.complex64) #(N,D,K) #output matrix of precessing modes
+		h_P, = self.__get_out_buffers(out, 1, (theta.shape[0], t_grid.shape[0], len(modes)), np.result_type(self.dtype, np.complex64)) #(N,D,K) #output matrix of precessing modes
 		
 			#huge loop over l_list
 		for l in l_list:
@@ -1016,15 +2491,18 @@ class GW_generator:
 				#saving the results in the output matrix
 			ids_l = [i for i, lm in enumerate(modes) if lm[0] == l]
 			h_P[:,:,ids_l] = h_P_l
-			
-		if remove_last_dim:
-			h_P = h_P[...,0] #(N,D)
-		if remove_first_dim:
-			h_P = h_P[0,...] #(D,)/(D,K)
+			
+		if out is not None:
+			h_P = out
+		else:
+			if remove_last_dim:
+				h_P = h_P[...,0] #(N,D)
+			if remove_first_dim:
+				h_P = h_P[0,...] #(D,)/(D,K)
 		return h_P.real, h_P.imag, alpha, beta, gamma
 
 	#@do_profile()
-	def __get_WF(self, theta, t_grid, modes):
+	def __get_WF(self, theta, t_grid, modes, cache_modes = False, out = None, cache_plans = True, offsets = None, plan_builder = None, grid_key = None):
 		"""
 		Generates the waves in time domain, building it as a sum of modes weighted by spherical harmonics. Called by get_WF.
 		Accepts only input features as [q,s1,s2] or [m1, m2, spin1_z , spin2_z, D_L, inclination, phi_0].
@@ -1036,9 +2514,21 @@ class GW_generator:
 				shape (D',) - a grid in (reduced) time to evaluate the wave at (uses np.interp)
 			modes: list
 				list of modes employed for building the WF (if None, every mode available is employed)
+			cache_modes: bool
+				Whether to take the modes from the mode cache (see :func:`get_cached_modes`)
+			out: tuple
+				Two arrays of shape (N,D) to write the polarizations into (if None, they are allocated)
+			cache_plans: bool
+				Whether to store the interpolation plans in the cache of the generator
+			offsets: :class:`~numpy:numpy.ndarray`
+				shape (N+1,) - offsets of the grid of each WF, if `t_grid` is in the ragged layout
+			plan_builder: function
+				Function building the interpolation plans (see :func:`get_intrinsic_batch`)
+			grid_key: tuple
+				key of `t_grid` (see :func:`array_key`), if already computed by the caller
 		Ouput:
 			h_plus, h_cross: :class:`~numpy:numpy.ndarray`
-				shape (D,)/(N,D) - desidered polarizations (if it applies)
+				shape (D,)/(N,D) - desidered polarizations (if it applies). In the ragged layout, the shape is (M,)
 		"""
 		D= theta.shape[1] #number of features given
 		assert D == 7
@@ -1046,41 +2536,154 @@ class GW_generator:
 			#computing amplitude prefactor
 		prefactor = 4.7864188273360336e-20 # G/c^2*(M_sun/Mpc)
 		m_tot_us = theta[:,0] + theta[:,1]	#total mass in solar masses for the user  (N,)
-		amp_prefactor = prefactor*m_tot_us/theta[:,4] # G/c^2 (M / d_L) 
+		amp_prefactor = (prefactor*m_tot_us/theta[:,4]).astype(self.dtype) # G/c^2 (M / d_L) 
 
-		h_plus = np.zeros((theta.shape[0],t_grid.shape[0]))
-		h_cross = np.zeros((theta.shape[0],t_grid.shape[0]))
+		batch = self.get_intrinsic_batch(theta[:,:4], t_grid, cache_plans, offsets, plan_builder, grid_key) #shared by all the modes
+		h_plus, h_cross = self.__get_out_buffers(out, 2, batch.grid_shape(), self.dtype)
 
 			#if only mode 22 is required, it is treated separately for speed up	
 		if modes == (2,2):# or modes == [(2,2)]:
-			amp_22, ph_22 = self.modes[self.mode_dict[(2,2)]].get_mode(theta[:,:4], t_grid, out_type = "ampph")
-			amp_22 =  np.sqrt(5/(4.*np.pi))*np.multiply(amp_22.T, amp_prefactor).T #G/c^2*(M_sun/Mpc) nu *(M/M_sun)/(d_L/Mpc)
-				#setting spherical harmonics by hand
-			c_i = np.cos(theta[:,5]) #(N,)
-			h_p = np.multiply(np.multiply(amp_22.T,np.cos(ph_22.T+2.*theta[:,6])), 0.5*(1+np.square(c_i)) ).T
-			h_c = np.multiply(np.multiply(amp_22.T,np.sin(ph_22.T+2.*theta[:,6])), c_i ).T
-			return h_p, h_c
+			if cache_modes:
+				amp_22, ph_22 = self.get_cached_modes(theta[:,:4], t_grid, (2,2), batch.timings, batch.grid_key())
+			else:
+				self.__set_fused_coefficients(batch, [(2,2)])
+				start = time.perf_counter()
+				amp_22, ph_22 = self.modes[self.mode_dict[(2,2)]].get_mode(batch, t_grid, out_type = "ampph")
+				batch.timings[(2,2)] = time.perf_counter() - start
+			amp_22 *= batch.to_grid(np.sqrt(5/(4.*np.pi))*amp_prefactor) #G/c^2*(M_sun/Mpc) nu *(M/M_sun)/(d_L/Mpc)
+				#setting spherical harmonics by hand (in place)
+			c_i = np.cos(theta[:,5]).astype(self.dtype) #(N,)
+			ph_22 += batch.to_grid((2.*theta[:,6]).astype(self.dtype))
+			np.cos(ph_22, out = h_plus)
+			h_plus *= amp_22
+			h_plus *= batch.to_grid(0.5*(1+np.square(c_i)))
+			np.sin(ph_22, out = h_cross)
+			h_cross *= amp_22
+			h_cross *= batch.to_grid(c_i)
+			return h_plus, h_cross
 
 		if modes is None:
 			modes = self.list_modes()
 
+		available_modes = []
 		for mode in modes:
-			try:	
-				mode_id = self.mode_dict[mode]
-			except KeyError:
+			if mode not in self.mode_dict:
 				warnings.warn("Unable to find mode {}: mode might be non existing or in the wrong format. Skipping it".format(mode))
 				continue
-				
-			amp_lm, ph_lm = self.modes[mode_id].get_mode(theta[:,:4], t_grid, out_type = "ampph")
-			amp_lm =  np.multiply(amp_lm.T, amp_prefactor).T #G/c^2*(M_sun/Mpc) nu *(M/M_sun)/(d_L/Mpc)
-				# setting spherical harmonics: amp, ph, D_L,iota, phi_0
-			h_lm_real, h_lm_imag = self.__set_spherical_harmonics(mode, amp_lm, ph_lm, theta[:,5], theta[:,6])
-			h_plus = h_plus + h_lm_real
-			h_cross = h_cross + h_lm_imag
+			available_modes.append(mode)
+
+		if cache_modes:
+			amp_modes, ph_modes = self.get_cached_modes(theta[:,:4], t_grid, available_modes, batch.timings, batch.grid_key()) #(N,D,K)
+		else:
+			self.__set_fused_coefficients(batch, available_modes)
+
+		def generate_mode(mode):
+			start = time.perf_counter()
+			amp_lm, ph_lm = self.modes[self.mode_dict[mode]].get_mode(batch, t_grid, out_type = "ampph")
+			batch.timings[mode] = time.perf_counter() - start
+			return amp_lm, ph_lm
+
+			#the modes are generated concurrently (if n_threads>1) and they are summed in order
+		if cache_modes:
+			mode_list = ((amp_modes[...,i], ph_modes[...,i]) for i in range(len(available_modes)))
+		else:
+			mode_list = self.__map(generate_mode, available_modes)
+		for mode, (amp_lm, ph_lm) in zip(available_modes, mode_list):
+			amp_lm *= batch.to_grid(amp_prefactor) #G/c^2*(M_sun/Mpc) nu *(M/M_sun)/(d_L/Mpc)
+				# setting spherical harmonics: amp, ph, D_L,iota, phi_0 (added to h_plus, h_cross)
+			self.__set_spherical_harmonics(mode, amp_lm, ph_lm, theta[:,5], theta[:,6], out = (h_plus, h_cross), batch = batch)
 
 		return h_plus, h_cross
 
-	def get_modes(self, theta, t_grid, modes = (2,2), out_type = "ampph"):
+	def __get_WF_model_grid(self, theta, t_grid, modes, cache_plans = True, offsets = None):
+		"""
+		Generates the waves in time domain, as in __get_WF, but the sum of modes is performed on the internal grid of the model. Only the final WF is then interpolated on the user grid. Called by get_WF.
+		The WF is written as :math:`h = P + Q`, where :math:`P = \\sum_{\\ell m} Y_{\\ell m} H_{\\ell m}` holds the modes with positive m and :math:`Q` the modes with negative m. Amplitude and phase of P and Q are slowly varying functions of time and they can be safely interpolated.
+		The phase of P and Q is unwrapped relative to the phase of a reference mode (the 22, if available), which is smooth on the model grid.
+
+		Input:
+			theta: :class:`~numpy:numpy.ndarray`
+				shape (N,7) - source parameters to make prediction at
+			t_grid: :class:`~numpy:numpy.ndarray`
+				shape (D',) - a grid in (physical) time to evaluate the wave at
+			modes: list
+				list of modes employed for building the WF (if None, every mode available is employed)
+			cache_plans: bool
+				Whether to store the interpolation plans in the cache of the generator
+			offsets: :class:`~numpy:numpy.ndarray`
+				shape (N+1,) - offsets of the grid of each WF, if `t_grid` is in the ragged layout
+		Ouput:
+			h_plus, h_cross: :class:`~numpy:numpy.ndarray`
+				shape (N,D') - desidered polarizations. In the ragged layout, the shape is (M,)
+		"""
+		assert theta.shape[1] == 7
+		if modes is None:
+			modes = self.list_modes()
+		elif isinstance(modes, tuple):
+			modes = [modes]
+
+		prefactor = 4.7864188273360336e-20 # G/c^2*(M_sun/Mpc)
+		amp_prefactor = (prefactor*(theta[:,0] + theta[:,1])/theta[:,4]).astype(self.dtype) # G/c^2 (M / d_L)
+		c_i, s_i = np.cos(theta[:,5]*0.5), np.sin(theta[:,5]*0.5)
+
+		if (2,2) in modes: modes = [(2,2)]+[mode for mode in modes if mode != (2,2)] #the first mode is the reference for the phase
+		batch = self.get_intrinsic_batch(theta[:,:4], t_grid, cache_plans, offsets) #shared by all the modes
+		t_0 = batch.first(batch.t_grid) if batch.is_ragged() else t_grid[0] #the phase is zero at the beginning of the grid
+		self.__set_fused_coefficients(batch, modes)
+		times, ph_ref = None, None
+		available_modes = []
+		for mode in modes:
+			try:
+				mode_obj = self.modes[self.mode_dict[mode]]
+			except KeyError:
+				warnings.warn("Unable to find mode {}: mode might be non existing or in the wrong format. Skipping it".format(mode))
+				continue
+			if times is None:
+				times = mode_obj.times
+			elif not np.array_equal(times, mode_obj.times):
+				raise RuntimeError("Unable to combine the modes on the model grid: mode {} has a different time grid".format(mode))
+			available_modes.append(mode)
+
+		def generate_mode(mode):
+			start = time.perf_counter()
+			amp_lm, ph_lm, _ = self.modes[self.mode_dict[mode]].get_native_mode(batch, t_0) #(N,D)
+			batch.timings[mode] = time.perf_counter() - start
+			return amp_lm, ph_lm
+
+		P, Q = 0., 0. #positive and negative m parts of the WF on the model grid (N,D)
+		for mode, (amp_lm, ph_lm) in zip(available_modes, self.__map(generate_mode, available_modes)):
+			amp_lm = (amp_lm.T*amp_prefactor).T
+
+				#same as in __set_spherical_harmonics: h_lm = const*A*[d_lm*exp(i*(ph+m*phi_0)) + parity*d_lmm*exp(-i*(ph+m*phi_0))]
+			l,m = mode
+			const = np.sqrt( (2.*l+1.)/(4.*np.pi) ) * (-1)**m
+			Y_lm = (const*self.__get_Wigner_d_function(l,-m,-2,c_i, s_i)).astype(self.dtype) #(N,)
+			Y_lmm = (const*np.power(-1,l)*self.__get_Wigner_d_function(l,m,-2,c_i, s_i)).astype(self.dtype) #(N,)
+			ph_lm = (ph_lm.T + (m*theta[:,6]).astype(self.dtype)).T #(N,D)
+			if ph_ref is None: ph_ref = ph_lm
+			h_lm = amp_lm*np.exp(1j*(ph_lm-ph_ref)) #(N,D) #the phase of the reference mode is factored out
+			P = P + (Y_lm*h_lm.T).T
+			Q = Q + (Y_lmm*np.conj(h_lm).T).T
+
+		if times is None:
+			return np.zeros(batch.grid_shape(), dtype = self.dtype), np.zeros(batch.grid_shape(), dtype = self.dtype)
+
+			#interpolating amplitude and phase of P and Q
+		start = time.perf_counter()
+		plan = batch.get_plan(times)
+		if plan.is_outside():
+			warn_outside_grid()
+		h = 0.
+		for X, sign in [(P, 1), (Q, -1)]:
+				#X = |X|*exp(1j*(angle(X) + sign*ph_ref)): Q holds the complex conjugate of the modes
+			amp_X = plan.interpolate(np.abs(X), left = 0, right = 0)
+			ph_X = plan.interpolate(np.unwrap(np.angle(X), axis = 1) + sign*ph_ref)
+			h = h + amp_X*np.exp(1j*ph_X)
+		batch.timings['interpolation'] = time.perf_counter() - start
+
+		return h.real, h.imag
+
+	def get_modes(self, theta, t_grid, modes = (2,2), out_type = "ampph", out = None, lengths = None, offsets = None):
 		"""
 		Return the modes in the model, evaluated in the given time grid.
 		It can return amplitude and phase (out_type = "ampph") or the real and imaginary part (out_type = "realimag").
@@ -1095,6 +2698,12 @@ class GW_generator:
 				list of modes to be returned (if None, every mode available is employed)
 			out_type: bool
 				whether amplitude and phase ("ampph") or real and imaginary part ("realimag") shall be returned
+			out: tuple
+				Two preallocated arrays with the shape of the output and type `self.dtype`. If given, the modes are written in place into them and they are returned.
+			lengths: :class:`~numpy:numpy.ndarray`
+				shape (N,) - number of points of the grid of each mode, for a padded `t_grid` of shape (N,D'_max) (see :func:`get_WF`)
+			offsets: :class:`~numpy:numpy.ndarray`
+				shape (N+1,) - offsets of the grid of each mode in a flat (ragged) `t_grid` of shape (M,) (see :func:`get_WF`)
 	
 		Output:
 			amp, ph: :class:`~numpy:numpy.ndarray`
@@ -1110,10 +2719,15 @@ class GW_generator:
 
 		if theta.shape[1] == 7:
 			theta = theta[:,:4]
+		t_grid, offsets, pad_mask = self.__get_ragged_grid(theta.shape[0], t_grid, lengths, offsets)
 		K = len(modes)
+		batch = self.get_intrinsic_batch(theta, t_grid, offsets = offsets) #shared by all the modes
 
-		res1 = np.zeros((theta.shape[0],t_grid.shape[0],K))
-		res2 = np.zeros((theta.shape[0],t_grid.shape[0],K))
+		if pad_mask is None:
+			res1, res2 = self.__get_out_buffers(out, 2, batch.grid_shape()+(K,), self.dtype)
+		else:
+			res1, res2 = np.zeros(batch.grid_shape()+(K,), dtype = self.dtype), np.zeros(batch.grid_shape()+(K,), dtype = self.dtype)
+		self.__set_fused_coefficients(batch, modes)
 
 			#old version (worse)
 		#for mode in self.modes:	
@@ -1123,17 +2737,28 @@ class GW_generator:
 		#		i = modes.index(mode.lm())
 		#	res1[:,:,i], res2[:,:,i] = mode.get_mode(theta, t_grid, out_type = out_type)
 
+		def generate_mode(i):
+			start = time.perf_counter()
+			res1[...,i], res2[...,i] = self.modes[self.mode_dict[modes[i]]].get_mode(batch, t_grid, out_type = out_type)
+			batch.timings[modes[i]] = time.perf_counter() - start
+
+		available_ids = []
 		for i, mode in enumerate(modes):
-			try:
-				mode_id = self.mode_dict[mode]
-			except KeyError:
+			if mode not in self.mode_dict:
 				warnings.warn("Unable to find mode {}: mode might be non existing or in the wrong format. Skipping it".format(mode))
 				continue
-			res1[:,:,i], res2[:,:,i] = self.modes[mode_id].get_mode(theta, t_grid, out_type = out_type)
-
+			available_ids.append(i)
+		for _ in self.__map(generate_mode, available_ids): pass #each mode is written in its own slice of the output
+
+		if pad_mask is not None:
+			res_flat = (res1, res2)
+			res1, res2 = self.__get_out_buffers(out, 2, pad_mask.shape+(K,), self.dtype) #(N,D'_max,K)
+			res1[pad_mask], res2[pad_mask] = res_flat
+		if out is not None:
+			return out
 		if remove_last_dim:
 			res1, res2 = res1[...,0], res2[...,0] #(N,D)
-		if remove_first_dim:
+		if remove_first_dim and (offsets is None or pad_mask is not None):
 			res1, res2 = res1[0,...], res2[0,...] #(D,)/(D,K)
 		return res1, res2
 		
@@ -1163,7 +2788,7 @@ class GW_generator:
 		return Y_lm.real, Y_lm.imag
 	
 	#@do_profile(follow=[])
-	def __set_spherical_harmonics(self, mode, amp, ph, iota, phi_0):
+	def __set_spherical_harmonics(self, mode, amp, ph, iota, phi_0, out = None, batch = None):
 		"""
 		Given amplitude and phase of a mode, it returns the quantity [Y_lm*A*e^(i*ph)+ Y_l-m*A*e^(-i*ph)]. This amounts to the contribution to the WF given by the mode.
 		We parametrize: math:`Y_{lm}(iota, phi_0) = d_lm(iota) * exp(i*m*phi_0)`
@@ -1178,8 +2803,12 @@ class GW_generator:
 				shape (,)/(N,) - inclination for each wave
 			phi_0: :class:`~numpy:numpy.ndarray`
 				shape (,)/(N,) - reference phase for each wave
+			out: tuple
+				Two arrays of shape (N,D) to add the contribution of the mode to (in place). If None, new arrays are returned
+			batch: :class:`intrinsic_batch`
+				Batch the mode was generated for, to support the ragged layout of the grid (only if out is given)
 		Output:
-			h_lm_real, h_lm_imag (N,D)	processed strain, with d, iota, phi_0 dependence included.
+			h_lm_real, h_lm_imag (N,D)	processed strain, with d, iota, phi_0 dependence included (if out is given, the arrays in out).
 		"""
 		#FIXME: check if this is correct!
 		#To generate the modes as TPHM:
@@ -1196,10 +2825,23 @@ class GW_generator:
 		parity = np.power(-1,l) #are you sure of that? apparently yes...
 
 			#FIXME: this can be done better interpolating after the spherical harmonic multiplication
-		h_lm_real = np.multiply(np.multiply(amp.T,np.cos(ph.T+m*phi_0)), const*(d_lm + parity * d_lmm) ).T #(N,D)
-		h_lm_imag = np.multiply(np.multiply(amp.T,np.sin(ph.T+m*phi_0)), const*(d_lm - parity * d_lmm) ).T #(N,D)
-
-		return h_lm_real, h_lm_imag
+		phi_0 = np.asarray(m*phi_0).astype(ph.dtype) #the WF keeps the precision of the mode
+		Y_real, Y_imag = np.asarray(const*(d_lm + parity * d_lmm)).astype(amp.dtype), np.asarray(const*(d_lm - parity * d_lmm)).astype(amp.dtype)
+		if out is None:
+			h_lm_real = np.multiply(np.multiply(amp.T,np.cos(ph.T+phi_0)), Y_real ).T #(N,D)
+			h_lm_imag = np.multiply(np.multiply(amp.T,np.sin(ph.T+phi_0)), Y_imag ).T #(N,D)
+			return h_lm_real, h_lm_imag
+
+			#accumulating in place, with only two temporary arrays
+		to_grid = batch.to_grid if batch is not None else (lambda x: np.reshape(x, (-1,1)))
+		ph_m = ph + to_grid(phi_0) #(N,D)
+		h_lm = np.cos(ph_m)
+		for h, Y, trig in [(out[0], Y_real, np.cos), (out[1], Y_imag, np.sin)]:
+			trig(ph_m, out = h_lm)
+			h_lm *= amp
+			h_lm *= to_grid(Y)
+			h += h_lm
+		return out
 
 	def __generate_pow_exponents_for_Wigner_d_function(self, l, n, m):
 		ki = max(0, m-n)
@@ -1344,10 +2986,9 @@ class GW_generator:
 			mode_obj: :class:`mode_generator_base`
 				instance of mode_generator (depending on the model it can be :class:`mode_generator_NN` or :class:`mode_generator_MoE`)
 		"""
-		for mode_ in self.modes:	
-			if mode_.lm() == mode: #check if it is the correct mode
-				return mode_
-		return None
+		mode = tuple(mode)
+		if mode not in self.mode_dict: return None
+		return self.modes[self.mode_dict[mode]]
 		
 	def get_mode_grads(self, theta, t_grid, modes = (2,2), out_type = "ampph", grad_var = 'M_q'):
 		"""
@@ -1443,13 +3084,35 @@ class GW_generator:
 		if remove_first_dim:
 			res1, res2 = res1[0,...], res2[0,...] #(D,)/(D,K)
 		return res1, res2
-	
+
+def find_PCA_file(folder, model_type):
+	"""
+	Returns the file of the PCA model of the amplitude or of the phase, in the folder of a mode. The binary file amp(ph)_PCA_model.npz (see :func:`~mlgw.ML_routines.PCA_model.save_model`) is preferred to the text file amp(ph)_PCA_model(.dat), if both are present.
+
+	Input:
+		folder: str
+			folder of the mode
+		model_type: str
+			"amp" or "ph"
+
+	Output:
+		filename: str
+			path to the PCA model
+	"""
+	files = sorted(glob.glob(os.path.join(str(folder), model_type+"_PCA_model*")), key = lambda f: not f.endswith('.npz'))
+	if not files:
+		raise RuntimeError("Unable to load model: no PCA model found for {} in folder {}".format(model_type, folder))
+	return files[0]
+
 class mode_generator_base():
 	"""
 	Base class for the mode generator.
 	All modes generator should inherit from it and implement methods ``load``, ``get_raw_mode``. If gradients are needed, it must implement ``get_raw_grads``.
 	"""
-	def __init__(self, mode, folder = None):
+	backends = ('tf', 'tf_frozen', 'numpy') #available backends for the inference of the neural networks
+	precisions = ('full', 'float16', 'int8') #available precisions for the weights of the networks
+
+	def __init__(self, mode, folder = None, backend = 'tf'):
 		"""
 		Initialise class by loading models from a given folder.
 		Everything useful for the model must be put within the folder with the standard names, readable by ``load``.
@@ -1461,14 +3124,39 @@ class mode_generator_base():
 				tuple (l,m) of the mode which the model refers to
 			folder: str
 				Folder in which everything is kept (if None, models must be loaded manually with load())
+			backend: str
+				Backend for the inference of the networks (see :func:`GW_generator.set_backend`). It is known before loading, so that a model for the numpy backend is loaded without tensorflow
 		"""
+		if backend not in self.backends:
+			raise ValueError("Wrong backend given: expected one of {} but '{}' given".format(self.backends, backend))
 		self.times = None
 		self.mode = mode #(l,m) tuple
 		self.readme = None	
+		self.backend = backend
+		self.precision = 'full'
+		self.bundle_source = None #(bundle, entry) of a mode loaded from a model bundle
 
 		if folder is not None:
 			self.load(folder, verbose = False)
 		return
+
+	def __getstate__(self):
+		"""
+		Returns the state of the mode generator, for pickling. A mode loaded from a model bundle is pickled as a reference to the bundle (i.e. its path, see :class:`model_bundle`) together with its settings: it is loaded again from the bundle when unpickled, so that the arrays are never copied and are shared through the page cache.
+		"""
+		if getattr(self, 'bundle_source', None) is None:
+			return self.__dict__.copy()
+		return {'bundle_source': self.bundle_source, 'mode': self.mode, 'backend': self.backend, 'precision': self.precision, 'batch_size': getattr(self, 'batch_size', None)}
+
+	def __setstate__(self, state):
+		if 'times' in state:
+			self.__dict__.update(state)
+			return
+		type(self).__init__(self, state['mode'], backend = state['backend']) #mode stored in a model bundle
+		self.load_bundle(*state['bundle_source'])
+		self.set_precision(state['precision'])
+		if state['batch_size'] is not None: self.batch_size = state['batch_size']
+		return
 	
 	def get_raw_grads(self, theta):
 		raise NotImplementedError("You cannot use base class to compute the WF gradients")		
@@ -1476,9 +3164,126 @@ class mode_generator_base():
 	def load(self, folder, verbose = False):
 		raise NotImplementedError("You cannot use base class to load a mode generator")
 	
-	def get_raw_mode(self, theta):
+	def get_raw_mode(self, theta, dtype = np.float64, indices = None):
 		raise NotImplementedError("You cannot use base class to generate a mode")		
 
+	def to_bundle(self, prefix):
+		"""
+		Returns the metadata and the arrays that describe the mode in a model bundle (see :func:`GW_generator.export_bundle`). The base class stores the time grid, the PCA models and the README: subclasses add their regression models.
+
+		Input:
+			prefix: str
+				prefix of the names of the arrays of the mode in the bundle
+
+		Output:
+			metadata: dict
+				metadata of the mode (serializable to json)
+			arrays: dict
+				arrays of the mode, indexed by their name in the bundle
+		"""
+		arrays = {prefix+'times': self.times}
+		for name, PCA in [('amp_PCA', self.amp_PCA), ('ph_PCA', self.ph_PCA)]:
+			for param, value in zip(['V', 'mu', 'max_PC', 'E'], PCA.get_PCA_params()):
+				arrays['{}{}/{}'.format(prefix, name, param)] = np.asarray(value)
+		return {'readme': repr(self.readme)}, arrays
+
+	def load_bundle(self, bundle, entry):
+		"""
+		Loads the mode from a model bundle, as written by :func:`to_bundle`. The arrays are read-only views on the memory mapped bundle.
+
+		Input:
+			bundle: :class:`model_bundle`
+				model bundle
+			entry: dict
+				metadata of the mode in the bundle
+		"""
+		prefix = entry['prefix']
+		self.times = bundle[prefix+'times']
+		for name in ['amp_PCA', 'ph_PCA']:
+			PCA = PCA_model()
+			PCA.PCA_params = [bundle['{}{}/{}'.format(prefix, name, param)] for param in ['V', 'mu', 'max_PC', 'E']]
+			setattr(self, name, PCA)
+		self.readme = ast.literal_eval(entry['readme'])
+		self.bundle_source = (bundle, entry)
+		return
+
+	def get_red_coefficients(self, theta):
+		raise NotImplementedError("You cannot use base class to generate the PCA coefficients")
+
+	def set_backend(self, backend):
+		"""
+		Sets the backend for the inference of the neural networks (see :func:`GW_generator.set_backend`). By default, the backend plays no role in the generation of the mode.
+
+		Input:
+			backend: str
+				name of the backend
+		"""
+		if backend not in self.backends:
+			raise ValueError("Wrong backend given: expected one of {} but '{}' given".format(self.backends, backend))
+		self.backend = backend
+		return
+
+	def set_precision(self, precision):
+		"""
+		Sets the precision of the weights (see :func:`mode_generator_NN.set_precision`). By default, the precision plays no role in the generation of the mode.
+
+		Input:
+			precision: str
+				'full', 'float16' or 'int8'
+		"""
+		if precision not in self.precisions:
+			raise ValueError("Wrong precision given: expected one of {} but '{}' given".format(self.precisions, precision))
+		self.precision = precision
+		return
+
+	def nbytes(self):
+		"""
+		Returns the memory (in bytes) taken by the PCA bases (and means) of amplitude and phase.
+		"""
+		return sum(PCA.PCA_params[0].nbytes + PCA.PCA_params[1].nbytes for PCA in [self.amp_PCA, self.ph_PCA])
+
+	def get_PCA_coefficients(self, theta):
+		"""
+		Returns the PCA reduced coefficients for a batch of parameters. By default, it calls ``get_red_coefficients``: a mode generator can override it to split the batch.
+
+		Input:
+			theta: :class:`~numpy:numpy.ndarray`
+				shape (N,3) - source parameters to make prediction at
+
+		Output:
+			red_amp,red_ph: :class:`~numpy:numpy.ndarray`
+				shape (N,K) - PCA reduced amplitude and phase
+		"""
+		return self.get_red_coefficients(np.atleast_2d(np.asarray(theta)))
+
+	def compile_basis(self, t_grid, m_tot, dtype = np.float64):
+		"""
+		Folds the interpolation to a fixed user grid and total mass into the PCA bases of amplitude and phase.
+		As PCA reconstruction and linear interpolation are both linear, interp(V g + mu) = interp(V) g + interp(mu): with the compiled basis, the mode on the user grid is obtained from the PCA coefficients g with a single matrix multiplication.
+
+		Input:
+			t_grid: :class:`~numpy:numpy.ndarray`
+				shape (D',) - grid in (physical) time to evaluate the mode at
+			m_tot: float
+				total mass (in solar masses) of the WFs
+			dtype: type
+				floating point precision of the compiled basis
+
+		Output:
+			basis: tuple
+				(V_amp, mu_amp, V_ph, mu_ph): scaled PCA basis (D',K) and mean (D',) of amplitude and phase, interpolated to the user grid
+		"""
+		plan = interp_plan(np.divide(np.asarray(t_grid)[None,:], m_tot), self.times) #(1,D')
+		if plan.is_outside():
+			warn_outside_grid()
+		basis = []
+		for PCA, edge in [(self.amp_PCA, 0), (self.ph_PCA, None)]:
+			V, mu = PCA.get_scaled_basis(), PCA.PCA_params[1] #(D,K), (D,)
+			V = plan.interpolate(V[None,...], left = edge, right = edge)[0] #(D',K)
+			mu = plan.interpolate(mu.real[None,:], left = edge, right = edge)[0] #(D',)
+			basis.extend([V.astype(dtype), mu.astype(dtype)])
+		return tuple(basis)
+
 	def summary(self, filename = None):
 		warnings.warn("No summary has been implemented for the current model")
 
@@ -1503,7 +3308,7 @@ class mode_generator_base():
 		return self.times
 
 
-	def get_mode(self, theta, t_grid, out_type = "ampph"):
+	def get_mode(self, theta, t_grid, out_type = "ampph", plan = None):
 		"""
 		Generates the mode according to the MLGW model.
 		hlm(t; theta) = A(t) * exp(1j*phi(t)) 
@@ -1524,12 +3329,14 @@ class mode_generator_base():
 		Output waveforms are returned with amplitude and pahse (out_type = "ampph") or with real and imaginary part (out_type = "realimag").
 
 		Input:
-			theta: :class:`~numpy:numpy.ndarray`
-				shape (D,)/(N,D) - source parameters to make prediction at
+			theta: :class:`~numpy:numpy.ndarray`/:class:`intrinsic_batch`
+				shape (D,)/(N,D) - source parameters to make prediction at. A preprocessed :class:`intrinsic_batch` (shared among modes) is also accepted: in this case `t_grid` is ignored and the grid of the batch is used
 			t_grid: :class:`~numpy:numpy.ndarray`
 				shape (D',) - grid in time to evaluate the wave at (uses np.interp)
 			out_type: str
 				the output to be returned ('ampph', 'realimag')
+			plan: :class:`interp_plan`
+				Interpolation plan for the grids t_grid/M, with M the total mass of each WF (see :func:`GW_generator.get_interp_plan`). If None, it is computed internally.
 
 		Ouput:
 			amp, phase :class:`~numpy:numpy.ndarray`
@@ -1540,6 +3347,10 @@ class mode_generator_base():
 		if out_type not in ["realimag", "ampph"]:
 			raise ValueError("Wrong output type chosen. Expected \"realimag\", \"ampph\", given \""+out_type+"\"")
 
+		if isinstance(theta, intrinsic_batch):
+			if plan is not None: theta.set_plan(self.times, plan)
+			return self.__get_mode(theta, out_type) #(N,D)
+
 		theta = np.array(theta) #to ensure that theta is copied into new array
 		if not isinstance(t_grid, np.ndarray): #making sure that t_grid is np.array
 			t_grid = np.array(t_grid)
@@ -1561,23 +3372,97 @@ class mode_generator_base():
 			return
 
 			#generating waves and returning to user
-		res1, res2 = self.__get_mode(theta, t_grid, out_type) #(N,D)
+		batch = intrinsic_batch(theta, t_grid)
+		if plan is not None: batch.set_plan(self.times, plan)
+		res1, res2 = self.__get_mode(batch, out_type) #(N,D)
 		if to_reshape:
 			return res1[0,:], res2[0,:] #(D,)
 		return res1, res2 #(N,D)
 
+	def __get_nu_phi_diff(self, batch):
+		"""
+		Returns the amplitude scaling and the constant phase shift to apply to the raw mode.
+
+		Input:
+			batch: :class:`intrinsic_batch`
+				preprocessed intrinsic parameters
+		Output:
+			nu: :class:`~numpy:numpy.ndarray`
+				shape (N,)/() - amplitude scaling
+			phi_diff: float
+				constant phase shift of the mode
+		"""
+		if isinstance(self, mode_generator_NN):
+				#FIXME: make this consistent and not super random as it is now
+			nu = batch.nu
+			phi_diff = {(2,2):0, (2,1):np.pi/2, (3,3): -np.pi/2, (4,4):np.pi, (5,5): np.pi/2}			
+		else:
+			nu, phi_diff = 1, {self.mode: 0}
+		return nu, phi_diff[self.mode]
+
+	def get_native_mode(self, theta, t_0 = None):
+		"""
+		Generates the mode on the internal time grid of the model, without interpolating to a user grid.
+		For each WF, the mode is evaluated at the physical times `m_tot_us[i]*self.times`. Amplitude and phase follow the same conventions of :func:`get_mode`: the phase is zero at the physical time `t_0`, which should be the first point of the user grid.
+		
+		Input:
+			theta: :class:`~numpy:numpy.ndarray`/:class:`intrinsic_batch`
+				shape (N,D) - source parameters to make prediction at (D=3 or D=4), or their preprocessed version
+			t_0: float
+				Physical time at which the phase is set to zero (if None, the phase is zero at the beginning of the model grid). It can also be an array of shape (N,), with a different time for each WF
+
+		Output:
+			amp, ph: :class:`~numpy:numpy.ndarray`
+				shape (N,D_std) - amplitude and phase of the mode on the model grid
+			m_tot_us: :class:`~numpy:numpy.ndarray`
+				shape (N,) - total mass of each WF
+		"""
+		batch = theta if isinstance(theta, intrinsic_batch) else intrinsic_batch(theta)
+		m_tot_us = batch.m_tot_us
+
+		amp, ph = self.__get_raw_mode(batch) #raw WF (N, N_grid)
+		nu, phi_diff = self.__get_nu_phi_diff(batch)
+
+		if t_0 is None:
+			ph_0 = ph[:,0]
+		else:
+			ph_0 = interp_plan(np.divide(t_0, m_tot_us)[:,None], self.times).interpolate(ph)[:,0] #(N,)
+
+		amp = (amp.T*nu).T
+		ph = (ph.T - ph_0 + phi_diff).T
+		return amp, ph, m_tot_us
+
+	def __get_raw_mode(self, batch, indices = None):
+		"""
+		Generates the raw mode (see :func:`get_raw_mode`) for all the WFs of a batch. If the PCA coefficients of the mode were already computed for the batch (see :class:`fused_networks`), they are used for the PCA reconstruction.
+
+		Input:
+			batch: :class:`intrinsic_batch`
+				preprocessed source parameters
+			indices: :class:`~numpy:numpy.ndarray`
+				shape (D_r,) - indices of the points of the time grid to evaluate the mode at (if None, the whole grid is used)
+
+		Output:
+			amp,ph: :class:`~numpy:numpy.ndarray`
+				shape (N,D)/(N,D_r) - raw amplitude and phase
+		"""
+		if self.mode not in batch.coefficients:
+			return batch.expand(*self.get_raw_mode(batch.theta_unique, dtype = batch.dtype, indices = indices))
+		red_amp, red_ph = batch.coefficients[self.mode]
+		amp = self.amp_PCA.reconstruct_data(red_amp.astype(batch.dtype, copy = False), indices = indices)
+		ph = self.ph_PCA.reconstruct_data(red_ph.astype(batch.dtype, copy = False), indices = indices)
+		return batch.expand(amp, ph)
+
 	#@do_profile(follow=[])
-	def __get_mode(self, theta, t_grid, out_type):
+	def __get_mode(self, batch, out_type):
 		"""
 
 		Generates the mode in domain and perform. Called by get_mode.
-		Accepts only input features as [q,s1,s2] or [m1, m2, spin1_z , spin2_z, D_L, inclination, phi_0].
+		The intrinsic parameters are given as a :class:`intrinsic_batch`, which holds also the user time grid.
 		
 		Input:
-			theta: :class:`~numpy:numpy.ndarray`
-				shape (N,D) - source parameters to make prediction at (D=3 or D=4)
-			t_grid: :class:`~numpy:numpy.ndarray`
-				shape (D',) - a grid in time to evaluate the wave at (uses np.interp)
+			batch: :class:`intrinsic_batch`
+				preprocessed source parameters (and time grid) to make prediction at
 			out_type: str
 				the output to be returned ('ampph', 'realimag')
 		Output:
@@ -1586,53 +3471,40 @@ class mode_generator_base():
 			hlm_real, hlm_im: :class:`~numpy:numpy.ndarray`
 				shape (N,D') - desidered h_22 components (if it applies)
 		"""
-		D= theta.shape[1] #number of features given
-		assert D in [3,4] #check that the number of dimension is fine
-
-			#setting theta_std & m_tot_us
-		if D == 3:
-			theta_std = theta
-			m_tot_us = 20. * np.ones((theta.shape[0],)) 
+		if self.mode in batch.bases:
+				#the basis is already interpolated on the user grid (see compile_basis)
+			V_amp, mu_amp, V_ph, mu_ph = batch.bases[self.mode]
+			red_amp, red_ph = batch.coefficients[self.mode] if self.mode in batch.coefficients else self.get_PCA_coefficients(batch.theta_unique) #(N,K)
+			new_amp = np.matmul(red_amp.astype(batch.dtype, copy = False), V_amp[:,:red_amp.shape[1]].T) + mu_amp #(N,D')
+			new_ph = np.matmul(red_ph.astype(batch.dtype, copy = False), V_ph[:,:red_ph.shape[1]].T) + mu_ph #(N,D')
+			new_amp, new_ph = batch.expand(new_amp, new_ph)
 		else:
-			q = np.divide(theta[:,0],theta[:,1]) #theta[:,0]/theta[:,1] #mass ratio (general) (N,)
-			m_tot_us = theta[:,0] + theta[:,1]	#total mass in solar masses for the user
-			theta_std = np.column_stack((q,theta[:,2],theta[:,3])) #(N,3)
-
-			to_switch = np.where(theta_std[:,0] < 1.) #holds the indices of the events to swap
+			plan = batch.get_plan(self.times) #true red grid (N,D')
 
-				#switching masses (where relevant)
-			theta_std[to_switch,0] = np.power(theta_std[to_switch,0], -1)
-			theta_std[to_switch,1], theta_std[to_switch,2] = theta_std[to_switch,2], theta_std[to_switch,1]
-
-		amp, ph =  self.get_raw_mode(theta_std) #raw WF (N, N_grid)
-
-			#doing interpolations
-			############
-		new_amp = np.zeros((amp.shape[0], t_grid.shape[0]))
-		new_ph = np.zeros((amp.shape[0], t_grid.shape[0]))
+				#if the user grid touches only a small part of the model grid, the mode is reconstructed only where needed
+			restricted = plan.restrict(max_points = (len(self.times)-1)//2)
+			if restricted is not None:
+				indices, plan = restricted
+				amp, ph = self.__get_raw_mode(batch, indices) #raw WF (N, D_r)
+			else:
+				amp, ph = self.__get_raw_mode(batch) #raw WF (N, N_grid)
 
-		for i in range(amp.shape[0]):
-				#computing the true red grid
-			interp_grid = np.divide(t_grid, m_tot_us[i])
-			#FIXME: here you can already apply spherical harmonics (calling _set_spherical_harmonics) for speed up
+				#doing interpolations (for all the WFs at once)
+				############
+				#Spherical harmonics can be applied before the interpolation with GW_generator.get_WF(..., combine_on_model_grid = True)
 
 				#putting the wave on the user grid
-			new_amp[i,:] = np.interp(interp_grid, self.times, amp[i,:], left = 0, right = 0) #set to zero outside the domain
-			new_ph[i,:]  = np.interp(interp_grid, self.times, ph[i,:])
+			new_amp = plan.interpolate(amp, left = 0, right = 0) #set to zero outside the domain
+			new_ph = plan.interpolate(ph)
 
 				#warning if the model extrapolates outiside the grid
-			if (interp_grid[0] < self.times[0]):
-				warnings.warn("Warning: time grid given is too long for the fitted model. Set 0 amplitude outside the fitting domain.")
+			if plan.is_outside():
+				warn_outside_grid()
 
 			#amplitude and phase of the mode (maximum of amp at t=0)
-		if isinstance(self, mode_generator_NN):
-				#FIXME: make this consistent and not super random as it is now
-			nu = theta_std[:,0]/(1 + theta_std[:,0])**2
-			phi_diff = {(2,2):0, (2,1):np.pi/2, (3,3): -np.pi/2, (4,4):np.pi, (5,5): np.pi/2}			
-		else:
-			nu, phi_diff = 1, {self.mode: 0}
-		amp = (new_amp.T*nu).T
-		ph = (new_ph.T - new_ph[:,0] + phi_diff[self.mode]).T #phase is zero at the beginning of the WF
+		nu, phi_diff = self.__get_nu_phi_diff(batch)
+		amp = new_amp*batch.to_grid(nu)
+		ph = new_ph - batch.to_grid(batch.first(new_ph)) + phi_diff #phase is zero at the beginning of the WF
 
 		if out_type == 'ampph':
 			return amp, ph
@@ -1694,30 +3566,24 @@ class mode_generator_base():
 		elif theta.shape[1]<4:
 			raise ValueError("Wrong input values for theta: expected shape (None,4) [m1,m2,s1,s2]")
 
-			#creating theta_std
-		q = np.divide(theta[:,0],theta[:,1]) #theta[:,0]/theta[:,1] #mass ratio (general) (N,)
-		
-		m_tot_us = theta[:,0] + theta[:,1]	#total mass in solar masses for the user
-		theta_std = np.column_stack((q,theta[:,2],theta[:,3])) #(N,3)
-			#switching masses (where relevant)
-		to_switch = np.where(theta_std[:,0] < 1.) #holds the indices of the events to swap
-		theta_std[to_switch,0] = np.power(theta_std[to_switch,0], -1)
-		theta_std[to_switch,1], theta_std[to_switch,2] = theta_std[to_switch,2], theta_std[to_switch,1]
+		t_grid = np.asarray(t_grid)
+
+			#creating theta_std (switching masses where relevant)
+		batch = intrinsic_batch(theta, t_grid)
+		theta_std, m_tot_us, to_switch = batch.theta_std, batch.m_tot_us, batch.to_switch
 
 		grad_amp = np.zeros((theta_std.shape[0], len(t_grid), 4))
 		grad_ph = np.zeros((theta_std.shape[0], len(t_grid), 4))
 
 		#dealing with gradients w.r.t. (q,s1,s2)
 		grad_q_amp, grad_q_ph = self.get_raw_grads(theta_std) #(N,D_std,3)
-			#interpolating gradients on the user grid
-		for i in range(theta_std.shape[0]):
-			for j in range(1,4):
-				#print(t_grid.shape,self.times.shape)
-				grad_amp[i,:,j] = np.interp(t_grid, self.times * m_tot_us[i], grad_q_amp[i,:,j-1],left = 0, right = 0) #set to zero outside the domain #(D,)
-				grad_ph[i,:,j]  = np.interp(t_grid, self.times * m_tot_us[i], grad_q_ph[i,:,j-1]) #(D,)
+			#interpolating gradients on the user grid (all at once)
+		plan = batch.get_plan(self.times) #(N,D)
+		grad_amp[:,:,1:] = plan.interpolate(grad_q_amp, left = 0, right = 0) #set to zero outside the domain #(N,D,3)
+		grad_ph[:,:,1:] = plan.interpolate(grad_q_ph) #(N,D,3)
 
 		#dealing with gradients w.r.t. M
-		amp, ph = self.get_mode(theta, t_grid, out_type = "ampph") #true wave evaluated at t_grid #(N,D)
+		amp, ph = self.get_mode(batch, t_grid, out_type = "ampph") #true wave evaluated at t_grid #(N,D)
 		for i in range(theta_std.shape[0]):
 			grad_M_amp = np.gradient(amp[i,:], t_grid) #(D,)
 			grad_M_ph = np.gradient(ph[i,:], t_grid) #(D,)
@@ -1756,12 +3622,52 @@ class mode_generator_NN(mode_generator_base):
 		#WRITEME
 
 	"""
-	def __init__(self, mode, folder = None):
+	def __init__(self, mode, folder = None, backend = 'tf'):
 		self.ph_models = {}
 		self.ph_residual_models = {}
 		self.amp_models = {}
 		self.ph_res_coefficients = {}
-		super().__init__(mode, folder)
+		self.numpy_models = {} #numpy version of the networks, for the numpy backend
+		self.frozen_models = {} #traced and frozen version of the networks, for the tf_frozen backend
+		super().__init__(mode, folder, backend)
+
+	def __getstate__(self):
+		"""
+		Returns a compact state of the mode generator, for pickling. Each network is stored as a :class:`~mlgw.ML_routines.dense_NN` in full precision (i.e. only its weights, biases and activations) and no tensorflow object is pickled. A mode loaded from a model bundle is pickled as a reference to the bundle (see :func:`mode_generator_base.__getstate__`).
+		"""
+		if getattr(self, 'bundle_source', None) is not None:
+			return super().__getstate__()
+		state = self.__dict__.copy()
+		for name in ['amp_models', 'ph_models', 'ph_residual_models']:
+			state[name] = {comps: model if isinstance(model, dense_NN) else dense_NN.from_keras(model) for comps, model in state[name].items()}
+		state['numpy_models'], state['frozen_models'] = {}, {}
+		return state
+
+	def __setstate__(self, state):
+		"""
+		Rebuilds the mode generator from the state given by ``__getstate__``. The networks are kept as :class:`~mlgw.ML_routines.dense_NN`: the keras models are built only if a tensorflow backend is used (or the gradients are required). Backend and precision are set as in the pickled generator.
+		"""
+		if 'times' not in state:
+			return super().__setstate__(state)
+		self.__dict__.update(state)
+		self.backend, self.precision = 'numpy', 'full'
+		self.numpy_models = {id(model): model for models in [self.amp_models, self.ph_models, self.ph_residual_models] for model in models.values()}
+		self.set_backend(state['backend'])
+		self.set_precision(state['precision'])
+		return
+
+	def __build_keras_models(self):
+		"""
+		Makes sure that every network is a keras model: the networks of an unpickled generator are converted from :class:`~mlgw.ML_routines.dense_NN` to :class:`mlgw_NN`.
+		"""
+		for models in [self.amp_models, self.ph_models, self.ph_residual_models]:
+			for comps, model in models.items():
+				if not isinstance(model, dense_NN): continue
+				from .NN_model import mlgw_NN
+				models[comps] = mlgw_NN.from_dense_NN(model)
+				if id(model) in self.numpy_models: #the numpy networks are kept, possibly in reduced precision
+					self.numpy_models[id(models[comps])] = self.numpy_models.pop(id(model))
+		return
 
 	def load(self, folder, verbose = False, batch_size=10):
 		"""
@@ -1789,10 +3695,8 @@ class mode_generator_NN(mode_generator_base):
 
 		self.batch_size = batch_size
 			#loading PCA
-		self.amp_PCA = PCA_model()
-		self.amp_PCA.load_model(*glob.glob(str(folder/"amp_PCA_model*")))
-		self.ph_PCA = PCA_model()
-		self.ph_PCA.load_model(*glob.glob(str(folder/"ph_PCA_model*")))
+		self.amp_PCA = PCA_model(find_PCA_file(folder, 'amp'), mmap_mode = 'r')
+		self.ph_PCA = PCA_model(find_PCA_file(folder, 'ph'), mmap_mode = 'r')
 		self.times = np.loadtxt(*glob.glob(str(folder/"times*")))
 		
 		
@@ -1822,26 +3726,182 @@ class mode_generator_NN(mode_generator_base):
 					dict_to_fill = self.amp_models if q_str == 'amp' else self.ph_models
 
 			
-				new_model = mlgw_NN.load_from_file(nn_file)
-				
-					#Distilling the model for fast inference
-				#tf_function = tf.function(new_model,
-				#		input_signature=(tf.TensorSpec(shape=new_model.inputs[0].shape, dtype=tf.float32),))
-				#tf_function = convert_variables_to_constants_v2(tf_function.get_concrete_function())
-				#tf_function.features = new_model.features #Adding features by hand :D
-				
-				dict_to_fill[comps] = new_model
-						
-						
-				#dict_to_fill[comps] = tf.function(new_model,
-				#		input_signature=(tf.TensorSpec(shape=new_model.inputs[0].shape, dtype=tf.float64),))
+				dict_to_fill[comps] = self.__load_network(nn_file)
 
 		if not (self.amp_models and self.ph_models):
 			raise RuntimeError("Please supply both amplitude and phase models!")
+
+		self.numpy_models, self.frozen_models = {}, {}
+		precision, self.precision = self.precision, 'full' #the weights just loaded are in full precision
+		if self.backend != 'tf': self.set_backend(self.backend)
+		self.set_precision(precision)
+
+	def to_bundle(self, prefix):
+		"""
+		Returns the metadata and the arrays that describe the mode in a model bundle (see :func:`mode_generator_base.to_bundle`). Each network is stored as the weights, biases and activations of a :class:`~mlgw.ML_routines.dense_NN`.
+		"""
+		metadata, arrays = super().to_bundle(prefix)
+		metadata['networks'] = {}
+		for name in ['amp_models', 'ph_models', 'ph_residual_models']:
+			metadata['networks'][name] = {}
+			for comps, model in getattr(self, name).items():
+				network = model if isinstance(model, dense_NN) else dense_NN.from_keras(model)
+				metadata['networks'][name][comps] = {'activations': network.activation_names, 'features': network.features}
+				for i, (W, b) in enumerate(zip(network.weights, network.biases)):
+					arrays['{}{}/{}/W_{}'.format(prefix, name, comps, i)] = W
+					arrays['{}{}/{}/b_{}'.format(prefix, name, comps, i)] = b
+		for comps, coefficients in self.ph_res_coefficients.items():
+			arrays['{}ph_res_coefficients/{}'.format(prefix, comps)] = np.asarray(coefficients)
+		metadata['ph_res_coefficients'] = list(self.ph_res_coefficients.keys())
+		return metadata, arrays
+
+	def load_bundle(self, bundle, entry, batch_size = 10):
+		"""
+		Loads the mode from a model bundle (see :func:`mode_generator_base.load_bundle`). The networks are built as :class:`~mlgw.ML_routines.dense_NN` on the memory mapped weights: the keras models are built only if a tensorflow backend is used.
+
+		Input:
+			bundle: :class:`model_bundle`
+				model bundle
+			entry: dict
+				metadata of the mode in the bundle
+			batch_size: int
+				Batch size for inference
+		"""
+		super().load_bundle(bundle, entry)
+		prefix = entry['prefix']
+		self.batch_size = batch_size
+		for name, networks in entry['networks'].items():
+			models = getattr(self, name)
+			for comps, network in networks.items():
+				n_layers = len(network['activations'])
+				weights = [bundle['{}{}/{}/W_{}'.format(prefix, name, comps, i)] for i in range(n_layers)]
+				biases = [bundle['{}{}/{}/b_{}'.format(prefix, name, comps, i)] for i in range(n_layers)]
+				models[comps] = dense_NN(weights, biases, network['activations'], network['features'])
+		for comps in entry['ph_res_coefficients']:
+			self.ph_res_coefficients[comps] = bundle['{}ph_res_coefficients/{}'.format(prefix, comps)]
+
+			#as in __setstate__
+		backend, precision = self.backend, self.precision
+		self.backend, self.precision = 'numpy', 'full'
+		self.numpy_models = {id(model): model for models in [self.amp_models, self.ph_models, self.ph_residual_models] for model in models.values()}
+		self.frozen_models = {}
+		self.set_backend(backend)
+		self.set_precision(precision)
+		return
+
+	def __load_network(self, nn_file):
+		"""
+		Loads a network from a `.keras` file. With the numpy backend, the weights are read directly from the file into a :class:`~mlgw.ML_routines.dense_NN` (see :func:`~mlgw.ML_routines.dense_NN.from_keras_file`), so that tensorflow is never loaded. Otherwise, or if the file cannot be read in this way, the network is loaded by keras as a :class:`mlgw_NN`.
+
+		Input:
+			nn_file: str
+				path to the `.keras` file
+
+		Output:
+			model: :class:`mlgw_NN`/:class:`~mlgw.ML_routines.dense_NN`
+				network stored in the file
+		"""
+		if self.backend == 'numpy':
+			try:
+				return dense_NN.from_keras_file(nn_file)
+			except ImportError: #h5py is not available: the file is read by keras
+				pass
+			except (KeyError, ValueError) as e: #the file has a layout (or layers) that the reader does not know: it is read by keras
+				warnings.warn("Unable to read the network in {} without keras ({}): loading it with keras".format(nn_file, e))
+		from .NN_model import mlgw_NN
+		return mlgw_NN.load_from_file(nn_file)
+
+	def set_backend(self, backend):
+		"""
+		Sets the backend for the inference of the neural networks (see :func:`GW_generator.set_backend`).
+		With the 'numpy' backend, the weights and activations of every network are extracted into a :class:`~mlgw.ML_routines.dense_NN`.
+		With the 'tf_frozen' backend, every network is traced with an input signature of shape (None, D_in), so that a single graph serves all the batch sizes, and its variables are converted into constants.
+
+		Input:
+			backend: str
+				name of the backend
+		"""
+		if self.precision != 'full' and backend != 'numpy':
+			raise ValueError("Reduced precision '{}' is only supported by the numpy backend".format(self.precision))
+		super().set_backend(backend)
+		if backend != 'numpy': self.__build_keras_models()
+		if backend == 'numpy' and not self.numpy_models:
+			for models in [self.amp_models, self.ph_models, self.ph_residual_models]:
+				for model in models.values():
+					self.numpy_models[id(model)] = model if isinstance(model, dense_NN) else dense_NN.from_keras(model)
+		if backend == 'tf_frozen' and not self.frozen_models:
+			import tensorflow as tf
+			from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+			for models in [self.amp_models, self.ph_models, self.ph_residual_models]:
+				for model in models.values():
+					tf_function = tf.function(model,
+						input_signature=(tf.TensorSpec(shape=(None, model.inputs[0].shape[-1]), dtype=tf.float32),))
+					self.frozen_models[id(model)] = convert_variables_to_constants_v2(tf_function.get_concrete_function())
+		return
+
+	def set_precision(self, precision):
+		"""
+		Stores the weights of the amplitude model in reduced precision, to reduce the memory footprint (and bandwidth) of the model. The computation is always done in (at least) float32. Available precisions are:
+
+		- 'full': weights as trained (default)
+		- 'float16': weights of the amplitude networks and PCA basis of the amplitude in float16
+		- 'int8': weights of the dense layers of the amplitude networks quantized to int8 (see :func:`~mlgw.ML_routines.dense_NN.quantize`) and PCA basis of the amplitude in float16
+
+		The phase is much more sensitive to the precision, as its first PCA components are scaled up to ~1e4: the phase networks are kept in float32 and the PCA basis of the phase is stored in float32. For model_0, with the phase in float16 (int8) the mismatch with the full precision model would be ~5e-3 (~0.4), while with the amplitude only it is ~2e-9 (~1e-6). See :func:`GW_generator.get_precision_report`.
+		Reduced precision requires the numpy backend and it cannot be undone: to go back to full precision, the model must be loaded again.
+
+		Input:
+			precision: str
+				'full', 'float16' or 'int8'
+		"""
+		if precision == self.precision: return
+		if self.precision != 'full':
+			raise ValueError("The model is already in reduced precision '{}': load it again to change precision".format(self.precision))
+		if precision != 'full' and self.backend != 'numpy':
+			raise ValueError("Reduced precision '{}' is only supported by the numpy backend".format(precision))
+		super().set_precision(precision)
+
+		self.amp_PCA.PCA_params[0] = self.amp_PCA.PCA_params[0].real.astype(np.float16)
+		self.ph_PCA.PCA_params[0] = self.ph_PCA.PCA_params[0].real.astype(np.float32)
+		for model in self.amp_models.values():
+			self.numpy_models[id(model)] = self.numpy_models[id(model)].quantize(precision)
+		return
+
+	def nbytes(self):
+		"""
+		Returns the memory (in bytes) taken by the weights of the networks (as evaluated by the current backend) and by the PCA bases.
+		"""
+		if self.numpy_models:
+			nbytes = sum(network.nbytes() for network in self.numpy_models.values())
+		else:
+			nbytes = sum(w.nbytes for models in [self.amp_models, self.ph_models, self.ph_residual_models] for model in models.values() for w in model.get_weights())
+		return nbytes + super().nbytes()
+
+	def __predict(self, model, theta):
+		"""
+		Evaluates a network of the model on the given parameters, with the current backend.
+
+		Input:
+			model: :class:`mlgw_NN`
+				network to evaluate
+			theta: :class:`~numpy:numpy.ndarray`
+				shape (N,3) - source parameters to make prediction at
+
+		Output:
+			pred: :class:`~numpy:numpy.ndarray`
+				shape (N,K') - network output
+		"""
+		input_ = augment_features(theta, model.features).astype(np.float32)
+		if self.backend == 'numpy':
+			return self.numpy_models[id(model)](input_)
+		import tensorflow as tf
+		if self.backend == 'tf_frozen':
+			return self.frozen_models[id(model)](tf.constant(input_))[0].numpy() #a frozen graph returns a list of outputs
+		return model(tf.constant(input_)).numpy()
 		
 
 	#@do_profile(follow=[])
-	def get_raw_mode(self, theta):
+	def get_raw_mode(self, theta, dtype = np.float64, indices = None):
 		"""
 		Generates a mode according to the MLGW model with a parameters vector in MLGW model style (params=  [q,s1z,s2z]).
 		They are generated at masses m1 = q * m2 and m2 = 20/(1+q), so that M_tot = 20.
@@ -1850,10 +3910,33 @@ class mode_generator_NN(mode_generator_base):
 		Input:
 			theta: :class:`~numpy:numpy.ndarray`
 				shape (N,3) - source parameters to make prediction at
+			dtype: type
+				floating point precision of the PCA reconstruction (np.float32 or np.float64)
+			indices: :class:`~numpy:numpy.ndarray`
+				shape (D_r,) - indices of the points of the time grid to evaluate the mode at (if None, the whole grid is used). Only the relevant rows of the PCA basis are used.
 
 		Ouput:
 			amp,ph: :class:`~numpy:numpy.ndarray`
-				shape (N,D) - desidered amplitude and phase, evaluated on the internal default time grid
+				shape (N,D)/(N,D_r) - desidered amplitude and phase, evaluated on the internal default time grid (or on its points `indices`)
+		"""
+		rec_PCA_amp, rec_PCA_ph = self.get_PCA_coefficients(theta) #(N,K)
+
+		rec_amp = self.amp_PCA.reconstruct_data(rec_PCA_amp.astype(dtype, copy = False), indices = indices) #(N,D)
+		rec_ph = self.ph_PCA.reconstruct_data(rec_PCA_ph.astype(dtype, copy = False), indices = indices) #(N,D)
+
+		return rec_amp, rec_ph
+
+	def get_PCA_coefficients(self, theta):
+		"""
+		Returns the PCA reduced coefficients for a batch of parameters. The networks are evaluated in batches of `self.batch_size` parameters.
+
+		Input:
+			theta: :class:`~numpy:numpy.ndarray`
+				shape (N,3) - source parameters to make prediction at
+
+		Output:
+			red_amp,red_ph: :class:`~numpy:numpy.ndarray`
+				shape (N,K) - PCA reduced amplitude and phase
 		"""
 		theta = np.atleast_2d(np.asarray(theta))
 		if theta.shape[0]> self.batch_size:
@@ -1862,11 +3945,7 @@ class mode_generator_NN(mode_generator_base):
 			rec_PCA_ph = np.concatenate([c[1] for c in coeff_list], axis = 0)
 		else:
 			rec_PCA_amp, rec_PCA_ph = self.get_red_coefficients(theta) #(N,K)
-
-		rec_amp = self.amp_PCA.reconstruct_data(rec_PCA_amp) #(N,D)
-		rec_ph = self.ph_PCA.reconstruct_data(rec_PCA_ph) #(N,D)
-
-		return rec_amp, rec_ph
+		return rec_PCA_amp, rec_PCA_ph
 
 	#@do_profile(follow=[])
 	def get_red_coefficients(self, theta):
@@ -1887,19 +3966,13 @@ class mode_generator_NN(mode_generator_base):
 		ph_pred = np.zeros((theta.shape[0], self.ph_PCA.get_dimensions()[1]))
 		
 		for comps, model in self.amp_models.items():
-			#amp_pred[:,comps_to_list(comps)] = model(augment_features(theta, model.features)).numpy()
-			input_ = tf.constant(augment_features(theta, model.features).astype(np.float32))
-			amp_pred[:,comps_to_list(comps)] = model(input_)[0].numpy()
+			amp_pred[:,comps_to_list(comps)] = self.__predict(model, theta)
 		
 		for comps, model in self.ph_models.items():
-			#ph_pred[:,comps_to_list(comps)] = model(augment_features(theta, model.features)).numpy()
-			input_ = tf.constant(augment_features(theta, model.features).astype(np.float32))
-			ph_pred[:,comps_to_list(comps)] = model(input_)[0].numpy()
+			ph_pred[:,comps_to_list(comps)] = self.__predict(model, theta)
         
 		for comps, model in self.ph_residual_models.items():
-			#ph_pred[:,comps_to_list(comps)] += model(augment_features(theta, model.features)).numpy()*self.ph_res_coefficients[comps]
-			input_ = tf.constant(augment_features(theta, model.features).astype(np.float32))
-			ph_pred[:,comps_to_list(comps)] += model(input_)[0].numpy()*self.ph_res_coefficients[comps]
+			ph_pred[:,comps_to_list(comps)] += self.__predict(model, theta)*self.ph_res_coefficients[comps]
 
 		return amp_pred, ph_pred
 	
@@ -1961,6 +4034,8 @@ class mode_generator_NN(mode_generator_base):
 			red_amp,red_ph: :class:`~numpy:numpy.ndarray`
 				shape (N,K,3) - PCA reduced amplitude and phase
 		"""
+		self.__build_keras_models()
+		import tensorflow as tf
 		comps_to_list = lambda comps_str: [int(c) for c in comps_str]
 		#new way
 		amp_grad = np.zeros((theta.shape[0], self.amp_PCA.get_dimensions()[1],theta.shape[1]))
@@ -2278,7 +4353,7 @@ class mode_generator_MoE(mode_generator_base):
 			return self.ph_PCA
 		return None
 
-	def get_raw_mode(self, theta):
+	def get_raw_mode(self, theta, dtype = np.float64, indices = None):
 		"""
 		Generates a mode according to the MLGW model with a parameters vector in MLGW model style (params=  [q,s1z,s2z]).
 		They are generated at masses m1 = q * m2 and m2 = 20/(1+q), so that M_tot = 20.
@@ -2287,15 +4362,19 @@ class mode_generator_MoE(mode_generator_base):
 		Input:
 			theta: :class:`~numpy:numpy.ndarray`
 				shape (N,3) - source parameters to make prediction at
+			dtype: type
+				floating point precision of the PCA reconstruction (np.float32 or np.float64)
+			indices: :class:`~numpy:numpy.ndarray`
+				shape (D_r,) - indices of the points of the time grid to evaluate the mode at (if None, the whole grid is used). Only the relevant rows of the PCA basis are used.
 
 		Ouput:
 			amp,ph: :class:`~numpy:numpy.ndarray`
-				shape (N,D) - desidered amplitude and phase, evaluated on the internal default time grid
+				shape (N,D)/(N,D_r) - desidered amplitude and phase, evaluated on the internal default time grid (or on its points `indices`)
 		"""
 		rec_PCA_amp, rec_PCA_ph = self.get_red_coefficients(theta) #(N,K)
 
-		rec_amp = self.amp_PCA.reconstruct_data(rec_PCA_amp) #(N,D)
-		rec_ph = self.ph_PCA.reconstruct_data(rec_PCA_ph) #(N,D)
+		rec_amp = self.amp_PCA.reconstruct_data(rec_PCA_amp.astype(dtype, copy = False), indices = indices) #(N,D)
+		rec_ph = self.ph_PCA.reconstruct_data(rec_PCA_ph.astype(dtype, copy = False), indices = indices) #(N,D)
 
 		return rec_amp, rec_ph
 
@@ -2350,10 +4429,8 @@ class mode_generator_MoE(mode_generator_base):
 		file_list = os.listdir(folder)
 
 			#loading PCA
-		self.amp_PCA = PCA_model()
-		self.amp_PCA.load_model(folder+"amp_PCA_model")
-		self.ph_PCA = PCA_model()
-		self.ph_PCA.load_model(folder+"ph_PCA_model")
+		self.amp_PCA = PCA_model(find_PCA_file(folder, 'amp'), mmap_mode = 'r')
+		self.ph_PCA = PCA_model(find_PCA_file(folder, 'ph'), mmap_mode = 'r')
 
 		verboseprint("  Loaded PCA model for amplitude with ", self.amp_PCA.get_V_matrix().shape[1], " PC")
 		verboseprint("  Loaded PCA model for phase with ", self.ph_PCA.get_V_matrix().shape[1], " PC")
@@ -2407,6 +4484,41 @@ class mode_generator_MoE(mode_generator_base):
 		np.matmul(np.zeros((2,2)),np.ones((2,2))) #this has something to do with a speed up of matmul. Once it is called once, matmul gets much faster!
 		return
 
+	def to_bundle(self, prefix):
+		"""
+		Returns the metadata and the arrays that describe the mode in a model bundle (see :func:`mode_generator_base.to_bundle`). Each MoE model is stored with the same arrays as in the files amp(ph)_exp_# and amp(ph)_gat_#.
+		"""
+		metadata, arrays = super().to_bundle(prefix)
+		for q_str, features, models in [('amp', self.amp_features, self.MoE_models_amp), ('ph', self.ph_features, self.MoE_models_ph)]:
+			metadata[q_str+'_features'] = features
+			metadata[q_str+'_n_models'] = len(models)
+			for k, model in enumerate(models):
+				arrays['{}{}_exp_{}'.format(prefix, q_str, k)] = np.concatenate((model.W, np.stack((model.b, model.sigma))))
+				arrays['{}{}_gat_{}'.format(prefix, q_str, k)] = model.gating.V
+		return metadata, arrays
+
+	def load_bundle(self, bundle, entry):
+		"""
+		Loads the mode from a model bundle (see :func:`mode_generator_base.load_bundle`).
+
+		Input:
+			bundle: :class:`model_bundle`
+				model bundle
+			entry: dict
+				metadata of the mode in the bundle
+		"""
+		super().load_bundle(bundle, entry)
+		prefix = entry['prefix']
+		self.amp_features = entry['amp_features']
+		self.ph_features = entry['ph_features']
+		for q_str, features in [('amp', self.amp_features), ('ph', self.ph_features)]:
+			models = []
+			for k in range(entry[q_str+'_n_models']):
+				models.append(MoE_model(3+len(features),1))
+				models[-1].load(bundle['{}{}_exp_{}'.format(prefix, q_str, k)], bundle['{}{}_gat_{}'.format(prefix, q_str, k)])
+			setattr(self, 'MoE_models_'+q_str, models)
+		return
+
 	def MoE_models(self, model_type, k_list=None):
 		"""
 		Returns the MoE model(s).
@@ -6,12 +6,16 @@ Module ML_routines.py
 			class PCA_model: implements a PCA model with methods for fitting and doing data reduction
 		Gaussian Discriminant Analysis
 			class GDA: implements a model for a Gaussian discriminant Analysis classifiers. It might be useful for MoE.
+		Dense neural network
+			class dense_NN: evaluates a stack of dense layers with plain numpy
 		Data augmentation helper
 			function add_extra_features: adds to a dataset some extra polynomial features
+		Binary files
+			function load_npz: loads (and possibly memory maps) the arrays of a npz archive
 """
 #################
 
-import scipy.stats, scipy.linalg
+import scipy.linalg, scipy.special
 import numpy as np
 import warnings
 from itertools import combinations_with_replacement
@@ -28,20 +32,28 @@ PCA_model
 		mu (D,)			the average value for each feature of dataset
 		max_PC (K,)		maximum value of PC projection used to redurn scaled low dimensional data (activate it with scale_PC=True in fit_model methods())
 		E (K,)			Eigenvalues of the PCs
+	The model can be saved to a text file or to a binary .npz file (see save_model). The reconstruction uses the scaled basis V*max_PC (see get_scaled_basis), which is computed once and cached (or read from a binary file).
 	"""
-	def __init__(self, filename = None):
+	def __init__(self, filename = None, mmap_mode = None):
 		"""
 	__init__
 	========
 		Constructor for PCA model. If filename is given, loads the model from file.
 		Input:
 			filename	file to load the model from
+			mmap_mode	memory map mode for a binary file (see load_model)
 		"""
 		self.PCA_params = []
+		self.scaled_basis = (None, None, {}) #(V, max_PC, {dtype: V*max_PC}): cache of the scaled basis, valid as long as V and max_PC are the same objects
 		if filename is not None:
-			self.load_model(filename)
+			self.load_model(filename, mmap_mode)
 		return None
 
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['scaled_basis'] = (None, None, {}) #the cache is not pickled: it is computed again when needed
+		return state
+
 	def save_model(self, filename):
 		"""
 	save_model
@@ -49,6 +61,7 @@ PCA_model
 		Save the PCA model parameters to file in the matrix
 			[[V (D,K), mu (D,)], [max_PC (K(+1),)], [E (K(+1),)] ]
 		with shape (D+2,K+1)
+		If filename ends with '.npz', the model is saved in binary format instead: an uncompressed npz archive with arrays V, mu, max_PC, E and the scaled basis V_scaled = V*max_PC (D,K). It is much faster to load and it can be memory mapped (see load_model).
 		Input:
 			filename	file to save the model in
 		Output:
@@ -56,6 +69,10 @@ PCA_model
 		if self.PCA_params == []:
 			print("Model is not fitted yet! There is nothing to save")
 			return None
+		if str(filename).endswith('.npz'):
+			V, mu, max_PC, E = [np.asarray(p).real.astype(np.float64) for p in self.PCA_params]
+			np.savez(filename, V = V, mu = mu, max_PC = max_PC, E = E, V_scaled = self.get_scaled_basis(np.float64))
+			return None
 		(D, K) = self.PCA_params[0].shape
 		V = self.PCA_params[0] #(D,K)
 		mu = (self.PCA_params[1])[:,np.newaxis]#(D,1)
@@ -72,15 +89,22 @@ PCA_model
 		np.savetxt(filename, to_save)
 		return None 
 
-	def load_model(self, filename):
+	def load_model(self, filename, mmap_mode = None):
 		"""
 	load_model
 	==========
-		Load the PCA parameters from file. The format is the same as save_model
+		Load the PCA parameters from file. The format is the same as save_model: a file ending with '.npz' is read in binary format, any other file as text.
 		Input:
 			filename	file to load the model from
+			mmap_mode	if not None, the arrays of a binary file are memory mapped with the given mode (e.g. 'r'), rather than read in memory (see numpy.memmap). It is ignored for a text file
 		Output:
 		"""
+		if str(filename).endswith('.npz'):
+			arrays = load_npz(filename, mmap_mode)
+			self.PCA_params = [arrays['V'], arrays['mu'], arrays['max_PC'], arrays['E']]
+			self.scaled_basis = (self.PCA_params[0], self.PCA_params[2], {np.dtype(np.float64): arrays['V_scaled']})
+			return None
+
 		data = np.loadtxt(filename) #loading data
 
 		if not np.any(np.isnan(data)): #if there is no NaN, the old format is employed. This is to ensure code portability :(
@@ -98,7 +122,7 @@ PCA_model
 		self.PCA_params= [V,mu,max_PC, E]
 		return None
 
-	def reconstruct_data(self, red_data, K = None):
+	def reconstruct_data(self, red_data, K = None, indices = None):
 		"""
 	reconstruct_data
 	================
@@ -107,21 +131,22 @@ PCA_model
 		Input:
 			red_data (N,K')	low dimensional representation of data
 			K				Number of compontents to be used for reconstruction. If None, all the given components will be used
+			indices (D',)	Indices of the features to reconstruct. If None, all the D features are reconstructed; otherwise only the relevant rows of the PCA basis are used
 		Output:
-			data (N,D)		high dimensional reconstruction of data (after inversion of preprocessing)
+			data (N,D)		high dimensional reconstruction of data (after inversion of preprocessing). If red_data is in single precision, the reconstruction is performed in single precision.
 		"""
-		if K is None: #adding zeros if the compontents are not to be used
+		if K is None:
 			K = self.PCA_params[0].shape[1]
+		K = min(K, red_data.shape[1]) #the missing components are zero: only the first K columns of the basis are used
 
-		if K < self.PCA_params[0].shape[1]:
-			red_data = np.concatenate([red_data[:,:K], np.zeros((red_data.shape[0], self.PCA_params[0].shape[1]-K))], axis = 1) 
-		if red_data.shape[1]<self.PCA_params[0].shape[1]:
-			red_data = np.concatenate([red_data[:,:K], np.zeros((red_data.shape[0], self.PCA_params[0].shape[1]-red_data.shape[1]))], axis = 1) 
-		
-		red_data = np.multiply(red_data, self.PCA_params[2])
-		data = np.matmul(red_data, self.PCA_params[0].T)
-		data = data+self.PCA_params[1]
-		return data.real
+		dtype = np.float32 if red_data.dtype == np.float32 else np.float64
+		V, mu = self.get_scaled_basis(dtype), self.PCA_params[1]
+		if indices is not None:
+			V, mu = V[indices,:], mu[indices]
+
+		data = np.matmul(red_data[:,:K], V[:,:K].T)
+		data += mu.real.astype(data.dtype, copy = False)
+		return data
 
 
 	def reduce_data(self, data):
@@ -181,6 +206,28 @@ PCA_model
 		"""
 		return self.PCA_params[0]
 
+	def get_scaled_basis(self, dtype = np.float64):
+		"""
+		Returns the scaled basis V*max_PC, used for reconstruction: the reconstruction of data is then X = red_data * (V*max_PC).T + mu.
+		The scaled basis is computed once for each dtype and cached: the cache is updated whenever V or max_PC are replaced in PCA_params. A basis in reduced precision (float16) is not cached, so that the memory footprint of the model stays small.
+		Input:
+			dtype			floating point precision of the basis (np.float32 or np.float64)
+		Output:
+			V_scaled (D,K) 	scaled basis
+		"""
+		V, max_PC = self.PCA_params[0], self.PCA_params[2]
+		dtype = np.dtype(dtype)
+		cached_V, cached_max_PC, cache = self.scaled_basis
+		if cached_V is not V or cached_max_PC is not max_PC: #the parameters have changed since the basis was cached
+			cache = {}
+			self.scaled_basis = (V, max_PC, cache)
+		if dtype in cache:
+			return cache[dtype]
+		V_scaled = np.multiply(V.real, max_PC.real).astype(dtype, copy = False)
+		if V.dtype != np.float16:
+			cache[dtype] = V_scaled
+		return V_scaled
+
 	def get_mu(self):
 		"""
 		Returns the mean of the dataset, used for reconstruction
@@ -217,6 +264,43 @@ PCA_model
 		return self.PCA_params[-1]
 		
 
+def load_npz(filename, mmap_mode = None):
+	"""
+	Loads all the arrays of a npz archive. If mmap_mode is given, the arrays stored without compression (as np.savez does) are memory mapped from the archive, as np.load does for a .npy file; the compressed ones are read in memory.
+	Input:
+		filename	npz file to load
+		mmap_mode	memory map mode (see numpy.memmap): if None, the arrays are read in memory
+	Output:
+		arrays		dictionary with the arrays of the archive
+	"""
+	if mmap_mode is None:
+		with np.load(filename) as data:
+			return {name: data[name] for name in data.files}
+
+	import zipfile
+	arrays = {}
+	with zipfile.ZipFile(filename) as archive, open(filename, 'rb') as f:
+		for info in archive.infolist():
+			name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+			if info.compress_type != zipfile.ZIP_STORED:
+				with archive.open(info) as member:
+					arrays[name] = np.lib.format.read_array(member)
+				continue
+				#the data of a member start after its local header (30 bytes, file name and extra field)
+			f.seek(info.header_offset)
+			local_header = f.read(30)
+			f.seek(info.header_offset + 30 + int.from_bytes(local_header[26:28], 'little') + int.from_bytes(local_header[28:30], 'little'))
+			version = np.lib.format.read_magic(f)
+			if version == (1,0):
+				shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+			else:
+				shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+			if np.prod(shape, dtype = np.int64) == 0: #an empty array cannot be memory mapped
+				arrays[name] = np.empty(shape, dtype = dtype)
+				continue
+			arrays[name] = np.asarray(np.memmap(filename, dtype = dtype, mode = mmap_mode, offset = f.tell(), shape = shape, order = 'F' if fortran_order else 'C'))
+	return arrays
+
 ################# Gaussian Discriminant Analysis
 class GDA(object):
 	"""
@@ -244,12 +328,13 @@ GDA
 		self.hard_clustering = hard_clustering
 		if not naive: self.models = []
 		self.model_params = []
+		from scipy.stats import multivariate_normal #scipy.stats is slow to import: it is loaded only for the GDA model
 			#initializing with dummy things
 		for k in range(self.K):	
 			mu = np.zeros((D,)) #(D,)
 			sigma = np.ones((D,))/D
 			if not naive:
-				self.models.append( scipy.stats.multivariate_normal(mu, np.diag(sigma)) )
+				self.models.append( multivariate_normal(mu, np.diag(sigma)) )
 				self.model_params.append((mu,np.diag(sigma)))
 			else:
 				self.model_params.append((mu,sigma))
@@ -340,7 +425,8 @@ GDA
 			sigma_sq = np.matmul(np.multiply((X_train-mu).T, y_train[:,k]), X_train-mu) #(D,D)
 			sigma_sq = np.divide(sigma_sq, np.sum(y_train[:,k]))
 			if not self.naive:
-				self.models.append( scipy.stats.multivariate_normal(mu, sigma_sq) )
+				from scipy.stats import multivariate_normal
+				self.models.append( multivariate_normal(mu, sigma_sq) )
 			if self.naive:
 				#only elements in diagonal are taken (naive assumption)
 				sigma_sq = np.diag(sigma_sq) #(D,) #can be used to prevent overfitting
@@ -379,6 +465,194 @@ GDA
 		return np.sum(np.argmax(y_pred,axis=1)==np.argmax(y_test,axis=1))/float(y_test.shape[0])
 
 
+################# Dense neural network
+class dense_NN:
+	"""
+	Numpy implementation of the forward pass of a stack of dense layers (i.e. a keras Sequential model made only of Dense layers).
+	It holds the weights, biases and activations of each layer and evaluates the network with plain matrix multiplications, without any call to tensorflow: for the small networks used by mlgw, this is much faster than a keras call, which is dominated by the dispatch overhead.
+	The computation is done in float32, as in keras. The weights can be stored in reduced precision (see :func:`quantize`): they are converted to float32 at each call.
+	"""
+	activations = {
+		'linear': lambda x: x,
+		'sigmoid': lambda x: scipy.special.expit(x, out = x),
+		'tanh': lambda x: np.tanh(x, out = x),
+		'relu': lambda x: np.maximum(x, 0., out = x),
+		'elu': lambda x: np.where(x>0, x, np.expm1(np.minimum(x, 0.))),
+		'softplus': lambda x: np.logaddexp(x, 0., out = x),
+		'swish': lambda x: np.multiply(x, scipy.special.expit(x), out = x),
+		'silu': lambda x: np.multiply(x, scipy.special.expit(x), out = x),
+	}
+
+	def __init__(self, weights, biases, activations, features = None, scales = None):
+		"""
+		Initialise the network.
+
+		Input:
+			weights: list
+				list of weight matrices, each with shape (D_in,D_out). Weights in float16 or int8 are kept as they are, all the others are converted to float32
+			biases: list
+				list of biases, each with shape (D_out,)
+			activations: list
+				list of the names of the activation function of each layer (see `dense_NN.activations` for the available ones)
+			features: list
+				features to augment the input with (see :func:`augment_features`): they are stored for the user convenience and not used by the network
+			scales: list
+				list of the scales (D_out,) of each weight matrix in int8: the weights are W*scale (None for the layers not in int8)
+		"""
+		if not (len(weights) == len(biases) == len(activations)):
+			raise ValueError("The number of weights, biases and activations must be the same")
+		for act in activations:
+			if act not in self.activations:
+				raise ValueError("Activation function '{}' is not supported: available ones are {}".format(act, list(self.activations.keys())))
+		self.weights = [W if W.dtype in [np.float16, np.int8] else W.astype(np.float32, copy = False) for W in map(np.asarray, weights)] #no copy: weights memory mapped from a model bundle stay shared
+		self.biases = [np.asarray(b, dtype = np.float32) for b in biases]
+		self.activation_names = list(activations)
+		self.features = features
+		self.scales = [None]*len(weights) if scales is None else [None if sc is None else np.asarray(sc, dtype = np.float32) for sc in scales]
+		for W, sc in zip(self.weights, self.scales):
+			if (W.dtype == np.int8) != (sc is not None):
+				raise ValueError("A scale must be given for each (and only for each) weight matrix in int8")
+		return
+
+	def quantize(self, precision):
+		"""
+		Returns a copy of the network with the weights stored in reduced precision. Biases are kept in float32.
+
+		- 'float16': weights in half precision
+		- 'int8': symmetric linear quantization of each output unit, W ~ W_int8*scale, with scale = max|W|/127 (column-wise)
+
+		Input:
+			precision: str
+				'float16' or 'int8' ('float32' gives back a network in full precision)
+
+		Output:
+			dense_NN: :class:`dense_NN`
+				network in reduced precision
+		"""
+		weights = [W.astype(np.float32) if sc is None else W*sc for W, sc in zip(self.weights, self.scales)]
+		scales = None
+		if precision == 'float16':
+			weights = [W.astype(np.float16) for W in weights]
+		elif precision == 'int8':
+			scales = [np.max(np.abs(W), axis = 0)/127. for W in weights]
+			scales = [np.where(sc>0, sc, 1.).astype(np.float32) for sc in scales]
+			weights = [np.clip(np.rint(W/sc), -127, 127).astype(np.int8) for W, sc in zip(weights, scales)]
+		elif precision != 'float32':
+			raise ValueError("Wrong precision given: expected 'float32', 'float16' or 'int8' but '{}' given".format(precision))
+		return dense_NN(weights, self.biases, self.activation_names, self.features, scales)
+
+	def nbytes(self):
+		"""
+		Returns the memory (in bytes) taken by the weights and biases of the network.
+		"""
+		return sum(W.nbytes for W in self.weights) + sum(b.nbytes for b in self.biases) + sum(sc.nbytes for sc in self.scales if sc is not None)
+
+	@classmethod
+	def from_keras(cls, model):
+		"""
+		Extracts the weights, biases and activation functions from a keras Sequential model. Only Dense layers (with any of the supported activations) are allowed. If the model has the attribute `features` (as :class:`mlgw_NN` does), it is copied.
+
+		Input:
+			model: keras.Sequential
+				keras model to convert
+
+		Output:
+			dense_NN: :class:`dense_NN`
+				network equivalent to the given model
+		"""
+		weights, biases, activations = [], [], []
+		for layer in model.layers:
+			config = layer.get_config()
+			if 'units' not in config:
+				if not layer.get_weights(): continue #layers with no weights (e.g. Dropout) play no role in inference
+				raise ValueError("Unable to convert layer '{}' of type {}: only Dense layers are supported".format(layer.name, type(layer).__name__))
+			params = layer.get_weights()
+			weights.append(params[0])
+			biases.append(params[1] if config.get('use_bias', True) else np.zeros((params[0].shape[1],)))
+			activations.append(config['activation'])
+		features = getattr(model, 'features', None)
+		return cls(weights, biases, activations, None if features is None else list(features))
+
+	@classmethod
+	def from_keras_file(cls, nn_file):
+		"""
+		Loads a Sequential model of Dense layers saved by keras in the `.keras` format, without loading tensorflow: the architecture is read from the configuration of the model and the weights from the HDF5 file of the archive (it requires the package `h5py`). The layouts of the archive written by keras 2 and by keras 3 are both supported.
+		The features of a :class:`mlgw_NN` are read from the name of the model, as :class:`mlgw_NN` does. The network is the same as ``dense_NN.from_keras(mlgw_NN.load_from_file(nn_file))``.
+
+		Input:
+			nn_file: str
+				path to the `.keras` file
+
+		Output:
+			dense_NN: :class:`dense_NN`
+				network stored in the file
+		"""
+		import zipfile, json, io
+		import h5py
+
+		with zipfile.ZipFile(nn_file) as archive:
+			config = json.loads(archive.read('config.json'))['config']
+			weights_file = io.BytesIO(archive.read('model.weights.h5'))
+
+		dense_layers = []
+		for layer in config['layers']:
+			if layer['class_name'] == 'Dense':
+				dense_layers.append(layer['config'])
+			elif layer['class_name'] not in ['InputLayer', 'Dropout']:
+				raise ValueError("Unable to load layer '{}' of type {} from file {}: only Dense layers are supported".format(layer['config'].get('name', ''), layer['class_name'], nn_file))
+
+			#keras stores the weights of the layers in groups named as 'dense', 'dense_2', ... in the order of the layers
+			#the groups are in '_layer_checkpoint_dependencies' for keras 2 and in 'layers' for keras 3, where the layers with no weights have an empty group
+		suffix = lambda name: int(name.rsplit('_', 1)[1]) if name.rsplit('_', 1)[-1].isdigit() else 0
+		weights, biases, activations = [], [], []
+		with h5py.File(weights_file, 'r') as f:
+			layers_group = [f[name] for name in ['_layer_checkpoint_dependencies', 'layers'] if name in f]
+			if not layers_group:
+				raise ValueError("Unable to load file {}: unknown layout of the weights".format(nn_file))
+			layers_group = layers_group[0]
+			groups = [layers_group[name]['vars'] for name in sorted(layers_group.keys(), key = suffix)
+				if 'vars' in layers_group[name] and len(layers_group[name]['vars'])]
+			if len(groups) != len(dense_layers):
+				raise ValueError("Unable to load file {}: {} dense layers given but {} weight groups found".format(nn_file, len(dense_layers), len(groups)))
+			for layer, group in zip(dense_layers, groups):
+				weights.append(group['0'][()])
+				biases.append(group['1'][()] if layer.get('use_bias', True) else np.zeros((weights[-1].shape[1],)))
+				activations.append(layer['activation'])
+		for W_1, W_2 in zip(weights[:-1], weights[1:]):
+			if W_1.shape[1] != W_2.shape[0]:
+				raise ValueError("Unable to load file {}: the shapes of the weights do not match".format(nn_file))
+
+		features = None
+		if config['name'].find('---') > -1:
+			features = [f.strip() for f in config['name'][config['name'].find('---')+3:].split('--')]
+		return cls(weights, biases, activations, features)
+
+	def __call__(self, X):
+		"""
+		Evaluates the network.
+
+		Input:
+			X: :class:`~numpy:numpy.ndarray`
+				shape (N,D_in) - input of the network (already augmented with the features)
+
+		Output:
+			y: :class:`~numpy:numpy.ndarray`
+				shape (N,D_out) - output of the network (float32)
+		"""
+		y = np.asarray(X, dtype = np.float32)
+		for W, b, sc, act in zip(self.weights, self.biases, self.scales, self.activation_names):
+			y = np.matmul(y, W.astype(np.float32, copy = False))
+			if sc is not None: y *= sc
+			y += b
+			y = self.activations[act](y)
+		return y
+
+	def predict(self, X):
+		"""
+		Same as calling the network: for compatibility with the keras interface.
+		"""
+		return self(X)
+
 ################# Extra features routine
 def add_extra_features(data, feature_list, log_list = None):
 	"""
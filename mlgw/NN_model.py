@@ -8,16 +8,14 @@ import sys
 import os
 import numpy as np
 import json
-import matplotlib.pyplot as plt
 from shutil import copy2
 import glob
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
-from keras_tuner import BayesianOptimization, HyperModel
+#keras_tuner, matplotlib and GW_helper are only needed for training: they are imported by the functions that use them, so that they are never loaded when a model is used for inference
 import tensorflow as tf
 from tensorflow import keras
-from GW_helper import compute_optimal_mismatch
 from ML_routines import PCA_model, augment_features
 from keras.layers import Dense
 from keras.optimizers import Nadam
@@ -367,66 +365,92 @@ class mlgw_NN(keras.Sequential):
 			model = keras.models.load_model(nn_file, compile=False)
 		if name is None: name = model.name
 		return cls(model.layers, name, features = None)
+
+	@classmethod
+	def from_dense_NN(cls, network, name = None):
+		#builds the keras model of a numpy dense network (ML_routines.dense_NN), e.g. after unpickling a mode generator
+		layers = [keras.Input(shape = (network.weights[0].shape[0],))]
+		layers.extend([Dense(W.shape[1], activation = act) for W, act in zip(network.weights, network.activation_names)])
+		model = cls(layers, name, features = network.features)
+		for layer, W, b, sc in zip(model.layers, network.weights, network.biases, network.scales):
+			W = W.astype(np.float32) if sc is None else W*sc
+			layer.set_weights([W, b])
+		return model
 	
-class NN_HyperModel(HyperModel):
-	def __init__(self,  output_nodes, hyperparameter_ranges, loss_weights):
-		self.hyperparameter_ranges = hyperparameter_ranges
-		self.loss_weights = [1]*output_nodes if not isinstance(loss_weights,list) else loss_weights
-		self.output_nodes = output_nodes
+def get_NN_HyperModel():
+	#Returns the class NN_HyperModel, a keras_tuner.HyperModel. The class is built the first time it is required, so that keras_tuner is imported only for tuning: the class can be also accessed as the module attribute NN_HyperModel (see __getattr__)
+	if 'NN_HyperModel' in globals(): return globals()['NN_HyperModel']
+	from keras_tuner import HyperModel
+
+	class NN_HyperModel(HyperModel):
+		def __init__(self,  output_nodes, hyperparameter_ranges, loss_weights):
+			self.hyperparameter_ranges = hyperparameter_ranges
+			self.loss_weights = [1]*output_nodes if not isinstance(loss_weights,list) else loss_weights
+			self.output_nodes = output_nodes
 		
-	def build(self, hp):
+		def build(self, hp):
 		
-			#This apparently helps to save memory
-			#https://stackoverflow.com/questions/42047497/keras-out-of-memory-when-doing-hyper-parameter-grid-search
-		backend.clear_session()
+				#This apparently helps to save memory
+				#https://stackoverflow.com/questions/42047497/keras-out-of-memory-when-doing-hyper-parameter-grid-search
+			backend.clear_session()
 		
-		#FIXME: the enumeration here is super ugly: any chance to improve it?
-		if isinstance(self.hyperparameter_ranges["units"], (tuple, list)):
-			units = hp.Choice('units', self.hyperparameter_ranges["units"])
-		else:
-			units = hp.Fixed('units', self.hyperparameter_ranges["units"])
-		if isinstance(self.hyperparameter_ranges["layers"], (tuple, list)):
-			layers = hp.Choice('layers', self.hyperparameter_ranges["layers"])
-		else:
-			layers = hp.Fixed('layers', self.hyperparameter_ranges["layers"])
-		if isinstance(self.hyperparameter_ranges["activation"], (tuple, list)):
-			activation = hp.Choice('activation', self.hyperparameter_ranges["activation"])
-		else:
-			activation = hp.Fixed('activation', self.hyperparameter_ranges["activation"])
-		if isinstance(self.hyperparameter_ranges["learning_rate"], (tuple, list)):
-			lr = hp.Choice('learning rate', self.hyperparameter_ranges["learning_rate"])
-		else:
-			lr = hp.Fixed('learning rate',self.hyperparameter_ranges["learning_rate"])
-		if isinstance(self.hyperparameter_ranges["feature_order"], (tuple, list)):
-			feature_order = hp.Choice('feature order', self.hyperparameter_ranges["feature_order"])
-		else:
-			feature_order = hp.Fixed('feature order', self.hyperparameter_ranges["feature_order"])
-		if isinstance(self.hyperparameter_ranges["features"], (tuple, list)):
-			features = hp.Choice('features', self.hyperparameter_ranges["features"])
-		else:
-			features = hp.Fixed('features', self.hyperparameter_ranges["features"])
+			#FIXME: the enumeration here is super ugly: any chance to improve it?
+			if isinstance(self.hyperparameter_ranges["units"], (tuple, list)):
+				units = hp.Choice('units', self.hyperparameter_ranges["units"])
+			else:
+				units = hp.Fixed('units', self.hyperparameter_ranges["units"])
+			if isinstance(self.hyperparameter_ranges["layers"], (tuple, list)):
+				layers = hp.Choice('layers', self.hyperparameter_ranges["layers"])
+			else:
+				layers = hp.Fixed('layers', self.hyperparameter_ranges["layers"])
+			if isinstance(self.hyperparameter_ranges["activation"], (tuple, list)):
+				activation = hp.Choice('activation', self.hyperparameter_ranges["activation"])
+			else:
+				activation = hp.Fixed('activation', self.hyperparameter_ranges["activation"])
+			if isinstance(self.hyperparameter_ranges["learning_rate"], (tuple, list)):
+				lr = hp.Choice('learning rate', self.hyperparameter_ranges["learning_rate"])
+			else:
+				lr = hp.Fixed('learning rate',self.hyperparameter_ranges["learning_rate"])
+			if isinstance(self.hyperparameter_ranges["feature_order"], (tuple, list)):
+				feature_order = hp.Choice('feature order', self.hyperparameter_ranges["feature_order"])
+			else:
+				feature_order = hp.Fixed('feature order', self.hyperparameter_ranges["feature_order"])
+			if isinstance(self.hyperparameter_ranges["features"], (tuple, list)):
+				features = hp.Choice('features', self.hyperparameter_ranges["features"])
+			else:
+				features = hp.Fixed('features', self.hyperparameter_ranges["features"])
 		
-		print("The number of units are", units)
-		feats = '{}-{}'.format(feature_order, features)
-		model = mlgw_NN(features=feats)
-		D = len(augment_features([1,1,1], features=feats)[0]) #number of input features
-		print("number of features: ", D)
+			print("The number of units are", units)
+			feats = '{}-{}'.format(feature_order, features)
+			model = mlgw_NN(features=feats)
+			D = len(augment_features([1,1,1], features=feats)[0]) #number of input features
+			print("number of features: ", D)
 
-		model.add(Dense(units,
-						activation=activation,
-						input_shape=(D,)))
-		for _ in range(layers):
 			model.add(Dense(units,
-						activation=activation))
-		model.add(Dense(self.output_nodes, activation='linear'))
-
-		model.compile(loss=LossFunctions('custom_mse',weights=self.loss_weights).LF,
-				optimizer=Nadam(learning_rate=lr))
-		return model
+							activation=activation,
+							input_shape=(D,)))
+			for _ in range(layers):
+				model.add(Dense(units,
+							activation=activation))
+			model.add(Dense(self.output_nodes, activation='linear'))
+
+			model.compile(loss=LossFunctions('custom_mse',weights=self.loss_weights).LF,
+					optimizer=Nadam(learning_rate=lr))
+			return model
+
+	NN_HyperModel.__qualname__ = 'NN_HyperModel' #so that it is pickled as the module attribute
+	globals()['NN_HyperModel'] = NN_HyperModel
+	return NN_HyperModel
+
+def __getattr__(name):
+	if name == 'NN_HyperModel':
+		return get_NN_HyperModel()
+	raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 def save_model(model, history, out_folder, hyperparameters, PCA_data, PCA_data_loc = None, residual=False):
 	#saves the weights and features of a trained model to a file.
 	#also saves the relevant hyperparameters.
+	import matplotlib.pyplot as plt
 
 	out_folder = Path(out_folder)
 
@@ -485,8 +509,10 @@ def tune_model(out_folder, project_name, quantity, PCA_data_loc, PC_to_fit, hype
 	
 	if init_trials == None: init_trials = 3*len(hyperparameters)
 	
+	from keras_tuner import BayesianOptimization
+
 	tuner = BayesianOptimization(
-		NN_HyperModel(PCA_data.train_var.shape[1], hyperparameters, loss_weights),
+		get_NN_HyperModel()(PCA_data.train_var.shape[1], hyperparameters, loss_weights),
 		objective='val_loss',
 		max_trials=trials,
 		num_initial_points=init_trials,
@@ -504,6 +530,7 @@ def tune_model(out_folder, project_name, quantity, PCA_data_loc, PC_to_fit, hype
 	return tuner
 
 def analyse_tuner_results(file_loc, save_loc=None):
+	import matplotlib.pyplot as plt
 	data = []
 	if not isinstance(file_loc, Path): file_loc = Path(file_loc)
 
@@ -659,6 +686,7 @@ def fit_NN(fit_type, in_folder, out_folder, hyperparameters, N_train = None, com
 	return
 
 def create_residual_PCA(pca_data_loc, base_model_file, save_loc, quantity, components, savefigs=True):
+	import matplotlib.pyplot as plt
 	pca_data_loc = Path(pca_data_loc)
 	save_loc = Path(save_loc)
 	os.makedirs(save_loc, exist_ok = True)
@@ -717,6 +745,7 @@ def create_residual_PCA(pca_data_loc, base_model_file, save_loc, quantity, compo
 	return
 
 def compute_mismatch_WFS(ph_rec, amp_rec, ph_pca, amp_pca, time_grid, size, dt = 0.00001, plot = False):
+	import matplotlib.pyplot as plt
 	F = np.zeros((size))
 	time_grid = time_grid[:]
 
@@ -741,6 +770,7 @@ def compute_mismatch_WFS(ph_rec, amp_rec, ph_pca, amp_pca, time_grid, size, dt =
 		rec_WFs = PcaData.compute_WF(new_amp_rec,new_ph_rec,ratio=1)
 		pca_WFs = PcaData.compute_WF(new_amp_pca,new_ph_pca,ratio=1)
 
+		from GW_helper import compute_optimal_mismatch
 		F_model,phase_shift_model = compute_optimal_mismatch(rec_WFs, pca_WFs)
 		F[j*batch_size:(j+1)*batch_size] = F_model
 
@@ -14,11 +14,24 @@ GW_helper.py
 	It holds some routines useful for generating a GW dataset and a computing mismatch between waveforms. This is not strictly required by the model but it is useful for training the model. Used by module fit_model.py
 fit_model.py
 	It holds some routines to effectively fit the model.
+pool.py
+	It holds a pool of processes to generate large batches of WFs on all the cores of a machine.
+thread_policy.py
+	It holds some routines to set the number of threads used by tensorflow and by the BLAS library (see also the environment variable MLGW_NUM_THREADS).
 		
 """
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+from .thread_policy import set_threading, get_threading, threading_limits, init_from_env
+init_from_env() #before numpy and tensorflow are loaded
 from .GW_generator import GW_generator, list_models
+from .pool import generator_pool
 from .GW_generator import mode_generator_base
 from .GW_generator import mode_generator_NN
-from .NN_model import mlgw_NN
+
+def __getattr__(name):
+	#mlgw_NN is a keras model: tensorflow is loaded only when it is required
+	if name == 'mlgw_NN':
+		from .NN_model import mlgw_NN
+		return mlgw_NN
+	raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
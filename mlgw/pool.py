@@ -0,0 +1,215 @@
+"""
+Module pool.py
+==============
+
+Generation of large batches of WFs on a pool of worker processes.
+
+- :class:`generator_pool` starts the workers, each with its own :class:`~mlgw.GW_generator.GW_generator`, and shards a batch of WFs across them: the WFs are written by the workers directly into shared memory.
+
+- :class:`shared_array_owner` keeps a block of shared memory mapped as long as an array built on it is alive.
+
+The functions of the workers live at the top level of the module, so that they can be pickled with the 'spawn' start method.
+"""
+
+import os
+import warnings
+import weakref
+import itertools
+import traceback
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+from .GW_generator import GW_generator
+from . import thread_policy
+
+worker_generator = None #GW_generator of a worker process of a generator_pool
+
+def init_pool_worker(folder, generator_kwargs, worker_threads):
+	"""
+	Initializer of the worker processes of a :class:`generator_pool`: it sets the number of threads and it loads the model, once for each worker.
+	"""
+	global worker_generator, worker_grid
+	worker_grid = (None, None) #(id of the current call of the pool, time grid)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore') #with 'fork', tensorflow may be already initialized by the parent
+		thread_policy.set_threading(worker_threads)
+	if isinstance(folder, GW_generator):
+		worker_generator = folder #unpickled from its compact state
+	else:
+		worker_generator = GW_generator(folder, **generator_kwargs)
+	return
+
+def pool_worker_get_grid(call_id, grid_name, D, dtype):
+	"""
+	Returns the time grid of the current call of a :class:`generator_pool`, which the parent stores once in shared memory rather than sending it with each task. The grid is copied by the worker the first time it is required and reused by all the chunks of the same call.
+
+	Input:
+		call_id: int
+			id of the call of the pool (the names of the shared memory blocks may be reused once a block is freed)
+		grid_name: str
+			name of the shared memory block holding the grid
+		D: int
+			number of points of the grid
+		dtype: type
+			dtype of the grid
+
+	Output:
+		t_grid: :class:`~numpy:numpy.ndarray`
+			shape (D,) - time grid
+	"""
+	global worker_grid
+	if worker_grid[0] != call_id:
+		shm = shared_memory.SharedMemory(name = grid_name)
+		try:
+			worker_grid = (call_id, np.frombuffer(shm.buf, dtype = dtype, count = D).copy())
+		finally:
+			shm.close()
+	return worker_grid[1]
+
+def pool_worker_get_WF(task):
+	"""
+	Task of a worker process of a :class:`generator_pool`: it generates a chunk of WFs and writes them in place into the shared memory of the parent.
+
+	Input:
+		task: tuple
+			(name of the shared memory block, shape and dtype of the output, slice of rows to fill, theta of the rows, (id of the call, name of the shared memory block and dtype of the time grid), modes, keyword arguments of get_WF)
+
+	Output:
+		n_rows: int
+			number of WFs generated
+	"""
+	shm_name, shape, dtype, rows, theta, (call_id, grid_name, grid_dtype), modes, kwargs = task
+	t_grid = pool_worker_get_grid(call_id, grid_name, shape[1], grid_dtype)
+	shm = shared_memory.SharedMemory(name = shm_name)
+	h = None
+	try:
+		h = np.frombuffer(shm.buf, dtype = dtype, count = 2*shape[0]*shape[1]).reshape((2,)+shape) #(2,N,D')
+		worker_generator.get_WF(theta, t_grid, modes, out = (h[0,rows], h[1,rows]), **kwargs)
+	except BaseException as e:
+		traceback.clear_frames(e.__traceback__) #the frames of the traceback hold views of the buffer
+		raise
+	finally:
+		h = None #the buffer must be released before closing, otherwise the error of get_WF is replaced by a BufferError
+		shm.close()
+	return rows.stop - rows.start
+
+class shared_array_owner:
+	"""
+	Owner of an array living in a block of shared memory (:class:`multiprocessing.shared_memory.SharedMemory`). The array is built with ``np.asarray(owner)`` through the array interface, so that the array (and any view of it) holds a reference to the owner, which in turn holds the block: the block is closed (i.e. unmapped) by a finalizer as soon as the last array is deleted.
+	"""
+	def __init__(self, block, shape, dtype):
+		"""
+		Input:
+			block: :class:`multiprocessing.shared_memory.SharedMemory`
+				block of shared memory holding the array
+			shape: tuple
+				shape of the array
+			dtype: type
+				dtype of the array
+		"""
+		self.block = block
+		address = np.frombuffer(block.buf, dtype = np.uint8, count = 1).ctypes.data #the temporary array releases the buffer right away
+		self.__array_interface__ = {'shape': tuple(shape), 'typestr': np.dtype(dtype).str, 'data': (address, False), 'version': 3}
+		weakref.finalize(self, block.close)
+		return
+
+class generator_pool:
+	"""
+	Generates large batches of WFs on a pool of worker processes, to use all the cores of a machine.
+	Each worker loads the model once, when the pool is started. The batch of parameters is split in chunks, which are distributed to the workers: each worker writes the WFs directly into a block of shared memory (:class:`multiprocessing.shared_memory.SharedMemory`) owned by the parent, so that the WFs are never pickled and copied between processes. Likewise, the time grid is stored once in shared memory and read once by each worker.
+
+	The arrays returned by :func:`get_WF` live in shared memory: the memory is released as soon as they are deleted, even if the pool is still open, and they remain valid after the pool is closed.
+	The pool should be closed with :func:`close` (or used as a context manager). With the default 'spawn' start method, a script using the pool must protect its entry point with ``if __name__ == '__main__':``.
+	To avoid oversubscribing the cores, the threads of tensorflow and BLAS in each worker are limited, so that all the workers together use one thread per core (see :mod:`mlgw.thread_policy`).
+	"""
+	def __init__(self, folder = 0, n_workers = None, start_method = 'spawn', worker_threads = None, **generator_kwargs):
+		"""
+		Starts the worker processes and loads the model in each of them.
+
+		Input:
+			folder: str/int/:class:`GW_generator`
+				Folder of the model (or index of a pre-fitted model), as in :class:`GW_generator`. If a generator is given, it is pickled and sent to the workers, which do not load the model from the folder
+			n_workers: int
+				Number of worker processes (if None, the number of CPUs)
+			start_method: str
+				Start method of the processes (see :mod:`multiprocessing`). The default 'spawn' is safe with tensorflow, which does not support to be forked once initialized.
+			worker_threads: int
+				Number of threads of tensorflow and BLAS in each worker (if None, the number of CPUs divided by the number of workers)
+			generator_kwargs:
+				Keyword arguments for the :class:`GW_generator` of each worker (e.g. `dtype` or `backend`)
+		"""
+		self.n_workers = os.cpu_count() if n_workers is None else int(n_workers)
+		self.dtype = folder.dtype if isinstance(folder, GW_generator) else np.dtype(generator_kwargs.get('dtype', np.float64))
+		if worker_threads is None: worker_threads = max(1, (os.cpu_count() or 1)//self.n_workers)
+		self.call_ids = itertools.count() #to tell apart the time grids of different calls in the workers
+		context = multiprocessing.get_context(start_method)
+
+		with thread_policy.threading_environment(worker_threads): #inherited by the workers, before they load numpy and tensorflow
+			self.pool = context.Pool(self.n_workers, initializer = init_pool_worker, initargs = (folder, generator_kwargs, worker_threads))
+		return
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+		return
+
+	def get_WF(self, theta, t_grid, modes = (2,2), chunk_size = None, **kwargs):
+		"""
+		Generates a batch of WFs, as :func:`GW_generator.get_WF`, sharding the batch across the worker processes.
+
+		Input:
+			theta: :class:`~numpy:numpy.ndarray`
+				shape (N,D) - source parameters to make prediction at (see :func:`GW_generator.get_WF`)
+			t_grid: :class:`~numpy:numpy.ndarray`
+				shape (D',) - a grid in time to evaluate the wave at, shared by all the WFs
+			modes: list
+				list of modes employed for building the WF (if None, every mode available is employed)
+			chunk_size: int
+				Number of WFs sent to a worker at once (if None, the batch is split in 4 chunks for each worker, for load balancing)
+			kwargs:
+				Other keyword arguments of :func:`GW_generator.get_WF` (e.g. `combine_on_model_grid`). The arguments `out`, `lengths`, `offsets` and `cache_modes` are not supported
+
+		Ouput:
+			h_plus, h_cross: :class:`~numpy:numpy.ndarray`
+				shape (N,D') - desidered polarizations, in shared memory
+		"""
+		unsupported = sorted(set(kwargs) & {'out', 'lengths', 'offsets', 'cache_modes'})
+		if unsupported:
+			raise ValueError("Arguments {} of get_WF are not supported by the pool: the WFs are written into shared memory on a time grid shared by all the WFs".format(unsupported))
+		theta = np.atleast_2d(np.asarray(theta))
+		t_grid = np.asarray(t_grid)
+		if t_grid.ndim != 1:
+			raise ValueError("The time grid must be shared by all the WFs: a grid of shape (D',) is expected")
+		N = theta.shape[0]
+		if chunk_size is None: chunk_size = max(1, int(np.ceil(N/(4*self.n_workers))))
+		shape = (N, t_grid.shape[0])
+
+		shm = shared_memory.SharedMemory(create = True, size = max(1, 2*N*t_grid.shape[0]*self.dtype.itemsize))
+		grid_shm = shared_memory.SharedMemory(create = True, size = max(1, t_grid.nbytes)) #the grid is read once by each worker, rather than sent with each task
+		grid = (next(self.call_ids), grid_shm.name, t_grid.dtype)
+		try:
+			np.frombuffer(grid_shm.buf, dtype = t_grid.dtype, count = t_grid.shape[0])[:] = t_grid
+			tasks = [(shm.name, shape, self.dtype, slice(i, min(i+chunk_size, N)), theta[i:i+chunk_size], grid, modes, kwargs) for i in range(0, N, chunk_size)]
+			for _ in self.pool.imap_unordered(pool_worker_get_WF, tasks): pass
+		except BaseException:
+			shm.close()
+			raise
+		finally:
+			shm.unlink() #the memory is freed as soon as it is not mapped anymore
+			grid_shm.close()
+			grid_shm.unlink()
+		h = np.asarray(shared_array_owner(shm, (2,)+shape, self.dtype)) #(2,N,D'): the block stays mapped as long as h (or a view of it) is alive
+		return h[0], h[1]
+
+	def close(self):
+		"""
+		Stops the worker processes.
+		"""
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
+		return
@@ -0,0 +1,163 @@
+"""
+Module thread_policy.py
+=======================
+
+Controls the number of threads used by the numerical libraries behind mlgw: the thread pools of tensorflow (used by the tensorflow backends) and the BLAS library of numpy (used by the numpy backend and by the PCA models).
+By default, all of them use every core of the machine: when many generators run at once (e.g. in a pool of processes or next to a sampler), the threads oversubscribe the cores and the throughput collapses.
+
+- :func:`set_threading` sets the number of threads, for the whole process.
+
+- :func:`threading_limits` is a context manager to temporarily limit the BLAS threads.
+
+- :func:`get_threading` returns the current setting.
+
+The number of threads can also be set with the environment variable ``MLGW_NUM_THREADS``, read when mlgw is imported: it is the same as calling ``set_threading(MLGW_NUM_THREADS)`` before anything else.
+The thread pools of tensorflow are created when tensorflow runs its first operation and cannot be changed later: set them before generating the first WF (e.g. with the environment variable).
+Changing the number of BLAS threads after numpy is imported requires the optional package `threadpoolctl`.
+"""
+#The module must not import numpy or tensorflow: it runs before them, so that their thread pools can be set by environment variables
+
+import os
+import sys
+import warnings
+import contextlib
+
+try:
+	import threadpoolctl #optional: sets the number of BLAS threads at runtime
+except ImportError:
+	threadpoolctl = None
+
+env_variable = 'MLGW_NUM_THREADS'
+blas_env_variables = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS']
+tf_env_variables = {'intra_op': 'TF_NUM_INTRAOP_THREADS', 'inter_op': 'TF_NUM_INTEROP_THREADS'}
+
+def set_threading(n_threads = None, intra_op = None, inter_op = None, blas = None):
+	"""
+	Sets the number of threads used by tensorflow and by the BLAS library, for the whole process.
+	Each limit that is not given defaults to `n_threads`; if `n_threads` is None as well, it is left unchanged.
+	The limits are applied to the libraries already loaded and, through their environment variables, to the ones that are loaded later (and to the child processes).
+	A warning is raised if a limit cannot be applied: tensorflow thread pools cannot be changed once tensorflow is initialized, while the BLAS threads of a loaded numpy can only be changed with `threadpoolctl`.
+
+	Input:
+		n_threads: int
+			Number of threads for all the thread pools
+		intra_op: int
+			Number of threads used by tensorflow to parallelize a single operation (e.g. a matrix multiplication)
+		inter_op: int
+			Number of threads used by tensorflow to run independent operations concurrently
+		blas: int
+			Number of threads of the BLAS library
+	"""
+	limits = {'intra_op': intra_op, 'inter_op': inter_op, 'blas': blas}
+	limits = {k: (n_threads if v is None else v) for k, v in limits.items()}
+	for k, v in limits.items():
+		if v is not None and int(v) < 1:
+			raise ValueError("The number of threads must be a positive integer: {} given for '{}'".format(v, k))
+
+		#tensorflow
+	for k in ['intra_op', 'inter_op']:
+		if limits[k] is None: continue
+		os.environ[tf_env_variables[k]] = str(int(limits[k]))
+		if 'tensorflow' not in sys.modules: continue
+		import tensorflow as tf
+		getter = getattr(tf.config.threading, 'get_{}_parallelism_threads'.format(k))
+		setter = getattr(tf.config.threading, 'set_{}_parallelism_threads'.format(k))
+		if getter() == int(limits[k]): continue
+		try:
+			setter(int(limits[k]))
+		except RuntimeError:
+			warnings.warn("Unable to set the {} threads of tensorflow, as it is already initialized: the number of threads must be set before generating the first WF (or with the environment variable {})".format(k.replace('_', '-'), env_variable))
+
+		#BLAS
+	if limits['blas'] is not None:
+		honored = all(os.environ.get(var, None) == str(int(limits['blas'])) for var in blas_env_variables) #e.g. inherited by a child process, before loading numpy
+		for var in blas_env_variables:
+			os.environ[var] = str(int(limits['blas']))
+		if threadpoolctl is not None:
+			threadpoolctl.threadpool_limits(limits = int(limits['blas']), user_api = 'blas')
+		elif 'numpy' in sys.modules and not honored:
+			warnings.warn("Unable to set the number of BLAS threads, as numpy is already loaded: install threadpoolctl or use the environment variable {}".format(env_variable))
+	return
+
+def get_threading():
+	"""
+	Returns the number of threads used by tensorflow and by the BLAS library. A value of None means that the library picks the number of threads by itself (usually one per core) or that it is unknown.
+
+	Output:
+		threading: dict
+			Number of threads, with keys 'intra_op', 'inter_op' and 'blas'
+	"""
+	threading = {}
+	for k, var in tf_env_variables.items():
+		n = None
+		if 'tensorflow' in sys.modules:
+			import tensorflow as tf
+			n = getattr(tf.config.threading, 'get_{}_parallelism_threads'.format(k))() or None
+		if n is None and os.environ.get(var, '').isdigit():
+			n = int(os.environ[var])
+		threading[k] = n
+	threading['blas'] = None
+	if threadpoolctl is not None:
+		blas = [lib['num_threads'] for lib in threadpoolctl.threadpool_info() if lib['user_api'] == 'blas']
+		if blas: threading['blas'] = max(blas)
+	elif os.environ.get(blas_env_variables[0], '').isdigit():
+		threading['blas'] = int(os.environ[blas_env_variables[0]])
+	return threading
+
+@contextlib.contextmanager
+def threading_limits(n_threads = None, blas = None):
+	"""
+	Context manager that temporarily limits the number of BLAS threads: the previous limits are restored on exit.
+	The thread pools of tensorflow are shared by the whole process and cannot be changed once tensorflow is initialized, hence they are not affected: they must be set once with :func:`set_threading` (or with the environment variable ``MLGW_NUM_THREADS``).
+	It requires the optional package `threadpoolctl`: without it, a warning is raised and the limits are not applied.
+
+		with mlgw.threading_limits(1):
+			h_p, h_c = generator.get_WF(theta, t_grid)
+
+	Input:
+		n_threads: int
+			Number of threads
+		blas: int
+			Number of threads of the BLAS library (if None, `n_threads`)
+	"""
+	blas = n_threads if blas is None else blas
+	if blas is None:
+		yield
+	elif threadpoolctl is None:
+		warnings.warn("Unable to limit the number of BLAS threads: the package threadpoolctl is required")
+		yield
+	else:
+		with threadpoolctl.threadpool_limits(limits = int(blas), user_api = 'blas'):
+			yield
+
+@contextlib.contextmanager
+def threading_environment(n_threads):
+	"""
+	Context manager that sets the environment variables for `n_threads` threads of tensorflow and BLAS (as well as ``MLGW_NUM_THREADS``), restoring them on exit.
+	It is meant to start child processes (e.g. a :class:`~mlgw.pool.generator_pool`): they inherit the environment and they start with the given number of threads, whatever the order of their imports.
+
+	Input:
+		n_threads: int
+			Number of threads
+	"""
+	variables = [env_variable] + blas_env_variables + list(tf_env_variables.values())
+	old_env = {var: os.environ.get(var, None) for var in variables}
+	os.environ.update({var: str(int(n_threads)) for var in variables})
+	try:
+		yield
+	finally:
+		for var, value in old_env.items():
+			if value is None: os.environ.pop(var, None)
+			else: os.environ[var] = value
+
+def init_from_env():
+	"""
+	Applies the number of threads set by the environment variable ``MLGW_NUM_THREADS`` (if any). It is called when mlgw is imported.
+	"""
+	value = os.environ.get(env_variable, '').strip()
+	if not value: return
+	try:
+		set_threading(int(value))
+	except ValueError:
+		warnings.warn("Ignoring the environment variable {}={}: a positive integer is expected".format(env_variable, value))
+	return